@@ -1,30 +1,136 @@
-import math
-import re
-from collections import Counter, defaultdict
+import hashlib
 
-from flask import Blueprint, jsonify, request
-from nltk.stem import PorterStemmer
+from flask import Blueprint, current_app, jsonify, request
 
 from api.utils.get_cursor import get_cursor
-from api.utils.levenshtein_distance import levenshtein_distance
-from database.db import connection, cursor
+from api.utils.stemmed_words import compress, encode, get_stemmed_words
 
 
 get_stemmed_word_bp = Blueprint("get_stemmed_word", __name__)
 
+# Largest number of stems returned by a paged request
+max_page_size = 10000
+
+
+def parse_paging(args):
+    """
+    Read the optional paging parameters of a /get_stemmed_word request.
+
+    Args:
+        args (MultiDict): The request arguments: "offset" and "limit".
+
+    Returns:
+        tuple[int, int | None]: The offset and the limit, None if not given.
+
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    try:
+        offset = int(args.get("offset", 0))
+    except ValueError:
+        raise ValueError("offset must be an integer")
+
+    limit = None
+    if "limit" in args:
+        try:
+            limit = int(args["limit"])
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if not 0 < limit <= max_page_size:
+            raise ValueError(f"limit must be between 1 and {max_page_size}")
+
+    if offset < 0:
+        raise ValueError("offset must be non-negative")
+    return offset, limit
+
+
+def make_response(version, build_body, encodings=None, total=None):
+    """
+    Build a JSON response in the best content coding the client accepts, or a 304
+    if the client already has it.
+
+    Args:
+        version (str): Identifies the content: the vocabulary version and, for a
+                       filtered or paged response, its parameters.
+        build_body (Callable[[], bytes]): Encodes the uncompressed body, only called
+                                          when the body is sent.
+        encodings (dict, optional): Precomputed compressed bodies (see `compress`),
+                                    compressed on the fly otherwise.
+        total (int, optional): The number of stems matching the request, sent as
+                               X-Total-Count.
+    """
+    # Compressed bodies are different representations, with their own ETag, and
+    # bodies too small to compress are sent as they are
+    coding = request.accept_encodings.best_match(["br", "gzip"])
+    if encodings is not None and coding not in encodings:
+        coding = None
+    etags = [version] if coding is None else [f"{version}-{coding}", version]
+
+    cached_etag = next(filter(request.if_none_match.contains_weak, etags), None)
+    if cached_etag is not None:
+        response = current_app.response_class(status=304)
+        response.set_etag(cached_etag)
+    else:
+        body = build_body()
+        if encodings is None:
+            encodings = compress(body, quick=True)
+        response = current_app.response_class(mimetype="application/json")
+        if coding in encodings:
+            response.set_data(encodings[coding])
+            response.headers["Content-Encoding"] = coding
+            response.set_etag(etags[0])
+        else:
+            response.set_data(body)
+            response.set_etag(version)
+
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+        response.headers["Access-Control-Expose-Headers"] = "X-Total-Count"
+    return response
+
 
 @get_stemmed_word_bp.route("/get_stemmed_word")
 def suggestions():
-    '''
-        Return a list of ALL stemmed word from the database inverted_index table.
-    '''
-    
-    all_stemmed_words = cursor.execute("SELECT word FROM words").fetchall()
-    
-    
-    # Convert the list of tuples to a list of strings
-    all_stemmed_words = [word[0] for word in all_stemmed_words]
-    
-    
-    
-    return jsonify(all_stemmed_words)
\ No newline at end of file
+    """
+    Return the stems of the words found in page bodies.
+
+    The whole vocabulary is encoded and compressed once per index generation, and
+    carries an ETag, so clients revalidating it with If-None-Match get a 304 until
+    the index changes.
+
+    Query parameters:
+        prefix (str, optional): Only return the stems starting with it, in
+                                alphabetical order.
+        offset (int, optional): The number of stems to skip, 0 by default.
+        limit (int, optional): The number of stems to return, at most 10000. All
+                               of them by default.
+
+    Returns:
+        A JSON list of stems, in term_id order unless a prefix is given. Filtered or
+        paged responses hold the number of matching stems in X-Total-Count.
+    """
+    try:
+        offset, limit = parse_paging(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    prefix = request.args.get("prefix", "").lower()
+
+    stemmed_words = get_stemmed_words(get_cursor())
+
+    if not prefix and offset == 0 and limit is None:
+        return make_response(
+            stemmed_words.version,
+            lambda: stemmed_words.body,
+            stemmed_words.encodings,
+        )
+
+    stems = stemmed_words.with_prefix(prefix) if prefix else stemmed_words.stems
+    end = len(stems) if limit is None else offset + limit
+    parameters = f"{prefix}\0{offset}\0{limit}".encode()
+    return make_response(
+        f"{stemmed_words.version}-{hashlib.sha1(parameters).hexdigest()[:16]}",
+        lambda: encode(stems[offset:end]),
+        total=len(stems),
+    )
@@ -1,13 +1,19 @@
+import base64
+import hashlib
+import json
 import math
 import re
 from collections import Counter, defaultdict
 
-from flask import Blueprint, jsonify, request
-from nltk.stem import PorterStemmer
+from flask import Blueprint, current_app, jsonify, request
 
 from api.utils.get_cursor import get_cursor
 from api.utils.levenshtein_distance import levenshtein_distance
-from database.db import connection, cursor
+from api.utils.page_details import PAGE_FIELDS, get_pages_details
+from api.utils.result_cache import ResultCache
+from api.utils.retrieval import rank
+from database.metadata import get_index_generation
+from database.stemmer import stem_word
 
 # For some reason i cannot use get_cursor
 # cursor = get_cursor()
@@ -18,12 +24,23 @@ search_bp = Blueprint("search", __name__)
 title_match_weight = 0.7
 keyword_match_weight = 0.3
 
+# Number of results returned when no limit is given, and the largest allowed limit
+default_page_size = 50
+max_page_size = 100
+
+# Results are ranked in steps of this many, so that the next pages of a query are
+# served from the cached ranking, and never beyond max_result_depth
+ranking_depth_step = 100
+max_result_depth = 1000
+
 
 stop_words = []
 with open("./database/stopwords.txt", "r") as f:
     stop_words = set(f.read().split())
 
-stemmer = PorterStemmer()
+# Responses and rankings of recent queries, dropped whenever the index changes
+result_cache = ResultCache()
+
 title_index = defaultdict(list)
 body_index = defaultdict(list)
 
@@ -44,7 +61,7 @@ def parse_query(query):
         processed_word = re.sub(r"[^a-zA-Z-]+", "", word.lower())
         if processed_word in stop_words:
             continue
-        stemmed_word = stemmer.stem(word)
+        stemmed_word = stem_word(word)
         print(f"input word: {word}, stemmed word: {stemmed_word}")
         word_list.append(stemmed_word)
 
@@ -60,12 +77,12 @@ def parse_query(query):
         for word in phrase_word:
             word = word.lower()
             if word not in stop_words:
-                stemmed_word = stemmer.stem(word)
+                stemmed_word = stem_word(word)
                 processed_phrase_word.append(stemmed_word)
 
-        processed_phrase_word = " ".join(processed_phrase_word)
-        processed_stemmed_phrase = r"(?<!\S){}(?!\S)".format(processed_phrase_word)
-        phrase_list.append(processed_stemmed_phrase)
+        # A phrase made only of stop words cannot be matched against the index
+        if processed_phrase_word:
+            phrase_list.append(processed_phrase_word)
 
     return [word_list, phrase_list]
 
@@ -83,236 +100,150 @@ def get_tf_score(query):
     return vector
 
 
-def checkIfInDocument(url, query_vector):
+def get_cache_key(query_vector, phrase_list):
     """
-    Check if the query vector is in the document.
+    Normalize a parsed query so that queries with the same stems and phrases (in any
+    order) share a result cache entry.
     """
-    title = cursor.execute(
-        """SELECT stemmed_title FROM page_stemmed_title WHERE url = ?""",
-        (url,),
-    ).fetchone()[0]
+    return (
+        tuple(sorted(query_vector.items())),
+        tuple(sorted({tuple(phrase) for phrase in phrase_list})),
+    )
 
-    content = cursor.execute(
-        """SELECT stemmed_word FROM page_stemmed_word WHERE url = ?""",
-        (url,),
-    ).fetchone()[0]
 
-    # Turn to a list
-    title = title.split()
-    content = content.split()
+def get_query_fingerprint(cache_key):
+    """Get a short hash of a normalized query, to tie paging cursors to it."""
+    return hashlib.sha1(repr(cache_key).encode("utf-8")).hexdigest()[:16]
 
-    for word in query_vector:
-        # Check if the word is in the title
-        if word in title or word in content:
-            return True
 
-    return False
+def encode_cursor(cache_key, offset):
+    """Encode the position of the next page of a query as an opaque string."""
+    cursor_data = {"query": get_query_fingerprint(cache_key), "offset": offset}
+    return base64.urlsafe_b64encode(json.dumps(cursor_data).encode("utf-8")).decode("ascii")
 
 
-def checkIfPhraseInDocument(url, phrase_vector):
-    """
-    Check if the phrase vector is in the document.
+def decode_cursor(encoded_cursor, cache_key):
     """
-    title = cursor.execute(
-        """SELECT stemmed_title FROM page_stemmed_title WHERE url = ?""",
-        (url,),
-    ).fetchone()[0]
-
-    content = cursor.execute(
-        """SELECT stemmed_word FROM page_stemmed_word WHERE url = ?""",
-        (url,),
-    ).fetchone()[0]
-
-    # Turn to a list
-    # title = title.split()
-    # content = content.split()
-
-    for phrase in phrase_vector:
-        # Check if the word is in the title
-        if re.search(phrase, title):
-            # print(f"Found phrase: {phrase} in {url}")
-            return True
-        if re.search(phrase, content):
-            # print(f"Found phrase: {phrase} in {url}")
-            return True
-
-    return False
+    Decode a cursor returned by `encode_cursor`.
 
+    Returns:
+        int: The offset of the page.
 
-def computeCosineSimilarity(document_vector, query_vector):
+    Raises:
+        ValueError: If the cursor is malformed or belongs to another query.
     """
-    Compute the cosine similarity between the document vector and the query vector.
+    try:
+        cursor_data = json.loads(base64.urlsafe_b64decode(encoded_cursor.encode("ascii")))
+        offset = cursor_data["offset"]
+        fingerprint = cursor_data["query"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+    if fingerprint != get_query_fingerprint(cache_key) or not isinstance(offset, int):
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+def parse_paging(args, cache_key):
     """
+    Read the paging and field selection parameters of a search request.
 
-    if len(document_vector) == 0 or len(query_vector) == 0:
-        return 0.0
+    Args:
+        args (MultiDict): The request arguments: "offset" or "cursor", "limit" and
+                          "fields" (comma-separated, see PAGE_FIELDS).
+        cache_key (tuple): The normalized query.
 
-    # Remove unmatched words
-    mathced_document_vector = {}
-    for key, value in document_vector.items():
-        if key in query_vector:
-            mathced_document_vector[key] = value
+    Returns:
+        tuple[int, int, tuple]: The offset, the limit and the requested fields.
 
-    matched_query_vector = {}
-    for key, value in query_vector.items():
-        if key in document_vector:
-            matched_query_vector[key] = value
-
-    # Compute cosine similarity
-    dot_product = sum(
-        mathced_document_vector[word] * matched_query_vector[word]
-        for word in matched_query_vector
-    )
-    magnitude_document = sum(value**2 for value in document_vector.values()) ** 0.5
-
-    # IDK there will be divide by 0
-    if magnitude_document == 0:
-        return 0.0
-
-    return dot_product / magnitude_document
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    if "cursor" in args:
+        offset = decode_cursor(args["cursor"], cache_key)
+    else:
+        try:
+            offset = int(args.get("offset", 0))
+        except ValueError:
+            raise ValueError("offset must be an integer")
 
+    try:
+        limit = int(args.get("limit", default_page_size))
+    except ValueError:
+        raise ValueError("limit must be an integer")
 
-def getDocumentContentVector(url):
-    """
-    Get the document vector for the content of the page.
-    """
-    document_vector = {}
-    # Get all words and their tf_idf
-    word_and_tfidf = cursor.execute(
-        """SELECT word, tf_idf FROM word_statistics WHERE url = ?""",
-        (url,),
-    )
+    if offset < 0 or not 0 < limit <= max_page_size:
+        raise ValueError(f"offset must be non-negative and limit between 1 and {max_page_size}")
 
-    for word, tf_idf in word_and_tfidf:
-        document_vector[word] = tf_idf
+    fields = PAGE_FIELDS
+    if "fields" in args:
+        requested = set(args["fields"].split(","))
+        unknown = requested - set(PAGE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        fields = tuple(field for field in PAGE_FIELDS if field in requested)
 
-    return document_vector
+    return offset, limit, fields
 
 
-def getDocumentTitleVector(url):
+def get_ranking(cache_key, query_vector, phrase_list, depth, generation):
     """
-    Get the document vector for the title of the page.
+    Get the best `depth` results of a query, reusing a cached ranking when it is deep
+    enough.
+
+    Returns:
+        list[tuple[str, float]]: The ranked (url, score) tuples.
     """
-    document_vector = {}
-    # Get all words and their tf_idf
-    word_and_tfidf = cursor.execute(
-        """SELECT title, tf_idf FROM title_statistics WHERE url = ?""",
-        (url,),
+    ranking_key = ("ranking", cache_key)
+    cached = result_cache.get(ranking_key, generation)
+    if cached is not None:
+        ranking, complete = cached
+        if complete or len(ranking) >= depth:
+            return ranking
+
+    # Rank a little deeper than needed so that the next pages hit the cache
+    depth = min(max_result_depth, -(-depth // ranking_depth_step) * ranking_depth_step)
+    ranking = rank(
+        query_vector,
+        phrase_list,
+        depth,
+        {"title": title_match_weight, "body": keyword_match_weight},
+    )
+    complete = len(ranking) < depth
+    result_cache.put(
+        ranking_key,
+        generation,
+        (ranking, complete),
+        size=sum(len(url) + 64 for url, _ in ranking),
     )
+    return ranking
 
-    for word, tf_idf in word_and_tfidf:
-        document_vector[word] = tf_idf
 
-    return document_vector
+def make_response(body, next_cursor):
+    """Build a JSON response, with the cursor of the next page if there is one."""
+    response = current_app.response_class(body, mimetype="application/json")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
+    return response
 
 
-def getPageDetails(url, score):
-    # Get the page details
-    """
-    {
-        "score": 0.99999,
-        "title": "Home Move (2001) sfasdfasdfsadfasdfasdfas",
-        "link": "https://www.cse.hk.hk/alumni/2016-06-08",
-        "last_modification_date": "2016-06-16T00:00:00Z",
-        "file_size": "5931B",
-        "keywords": {"CSE": "3", "MOV": "5", "TEST": "4"},
-        "children_links": [
-            "http://childlink1.com",
-            "http://childlink2.com",
-            "http://childlink3.com",
-            "http://childlink1.com",
-            "http://childlink2.com",
-            "http://childlink3.com",
-            "http://childlink1.com",
-            "http://childlink2.com",
-            "http://childlink3.com",
-        ],
-        "parent_links": [
-            "http://parentlink1.com",
-            "http://parentlink2.com",
-            "http://parentlink3.com",
-        ],
-    }
-    """
-    # 5 decimal places
-    score = "{:.5f}".format(score)
-    page_details = cursor.execute(
-        """SELECT title, last_modified_date, size FROM page_information WHERE url = ?""",
-        (url,),
-    ).fetchone()
-
-    # Get top 5 stemmed keyword from the page (from inverted_index and title_inverted_index)
-    content_keywords = cursor.execute(
-        """SELECT word, term_frequency FROM inverted_index WHERE url = ? ORDER BY term_frequency DESC""",
-        (url,),
-    ).fetchall()
-
-    title_keywords = cursor.execute(
-        """SELECT title, term_frequency FROM title_inverted_index WHERE url = ? ORDER BY term_frequency DESC""",
-        (url,),
-    ).fetchall()
-
-    # print(f"Content keywords: {content_keywords}")
-    # print(f"Title keywords: {title_keywords}")
-    # Combine 2 lists and form a dict, then extract the top 5
-    keywords = {}
-    for word, tf in content_keywords:
-        keywords[word] = tf
-    for title, tf in title_keywords:
-        if title in keywords:
-            keywords[title] += tf
-        else:
-            keywords[title] = tf
-
-    sorted_keywords = sorted(keywords.items(), key=lambda item: item[1], reverse=True)
-    top_keywords = sorted_keywords[:5]
-
-    dictkeyword = {word: str(tf) for word, tf in top_keywords}
-
-    # Get parent and children links
-    children_links = cursor.execute(
-        """SELECT child_url FROM page_relationships WHERE parent_url = ?""",
-        (url,),
-    ).fetchall()
-
-    parent_links = cursor.execute(
-        """SELECT parent_url FROM page_relationships WHERE child_url = ?""",
-        (url,),
-    ).fetchall()
-
-    children_links = [child[0] for child in children_links]
-    parent_links = [parent[0] for parent in parent_links]
-
-    if page_details:
-        title, last_modified_date, size = page_details
-        return {
-            "score": score,  # Placeholder for score
-            "title": title,
-            "link": url,
-            "last_modification_date": last_modified_date,
-            "file_size": f"{size}B",
-            "keywords": dictkeyword,
-            "children_links": children_links,
-            "parent_links": parent_links,
-        }
-    else:
-        return None
-
-# Handle get page rank result
-def getPageRank(url):
-    # Get the page rank
-    page_rank = cursor.execute(
-        """SELECT rank FROM page_rank WHERE url = ?""",
-        (url,),
-    ).fetchone()
-
-    if page_rank:
-        return page_rank[0]
-    else:
-        return None
-
 @search_bp.route("/search")
 def search():
+    """
+    Search the index.
+
+    Query parameters:
+        query (str): The query. Words in double quotes are matched as phrases.
+        offset (int): The number of results to skip, 0 by default.
+        cursor (str): Instead of an offset, the X-Next-Cursor header of a previous
+                      response, to get the page after it.
+        limit (int): The number of results, 50 by default and at most 100.
+        fields (str): The comma-separated result fields to return, all by default.
+
+    Returns:
+        A JSON list of results. If more results follow, the X-Next-Cursor header
+        holds the cursor of the next page.
+    """
     # Get query input
     query = request.args.get("query", "").lower()
     if not query:
@@ -325,83 +256,33 @@ def search():
     # Count tf of each query word
     query_vector = get_tf_score(parsed_query[0])
 
-    # Get all documents in the database
-    all_documents = cursor.execute("""SELECT url FROM urls""").fetchall()
-
-    # Store each document's title and body similarity score for retrieval
-    title_similarity = {}
-    content_similarity = {}
-
-    for document in all_documents:
-        url = document[0]
-
-        if parsed_query[1]:  # have phrase
-            # Check if the phrase is in the document
-            if not checkIfPhraseInDocument(url, parsed_query[1]):
-                continue
-        else:
-            if not checkIfInDocument(url, parsed_query[0]):
-                continue
-
-        # Get document vector
-        document_title_vector = getDocumentTitleVector(url)
-        document_content_vector = getDocumentContentVector(url)
-
-        # Compute cosine similarity
-        title_similarity[url] = computeCosineSimilarity(
-            document_title_vector, query_vector
-        )
-        content_similarity[url] = computeCosineSimilarity(
-            document_content_vector, query_vector
-        )
-
-        # print(f"Title similarity for {url}: {title_similarity[url]}")
-        # print(f"Content similarity for {url}: {content_similarity[url]}")
-        # print("=" * 20)
-
-    # Sort the 2 dict
-    title_similarity = dict(
-        sorted(title_similarity.items(), key=lambda item: item[1], reverse=True)
+    cache_key = get_cache_key(query_vector, parsed_query[1])
+    try:
+        offset, limit, fields = parse_paging(request.args, cache_key)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = max(0, min(limit, max_result_depth - offset))
+
+    # Serve repeated requests from the cache, as long as the index did not change
+    response_key = ("response", cache_key, offset, limit, fields)
+    generation = get_index_generation()
+    cached_response = result_cache.get(response_key, generation)
+    if cached_response is not None:
+        return make_response(*cached_response)
+
+    # Rank the documents matching the query, reading only the postings of the
+    # query terms, one past the page to know whether another page follows
+    ranking = get_ranking(
+        cache_key, query_vector, parsed_query[1], offset + limit + 1, generation
     )
-    content_similarity = dict(
-        sorted(content_similarity.items(), key=lambda item: item[1], reverse=True)
-    )
-
-    # Combine the two similarity scores
-    combined_similarity = {}
-
-    for url in title_similarity:
-        if url in combined_similarity:
-            combined_similarity[url] += title_match_weight * title_similarity[url]
-        else:
-            combined_similarity[url] = title_match_weight * title_similarity[url]
-
-    for url in content_similarity:
-        if url not in combined_similarity:
-            combined_similarity[url] = keyword_match_weight * content_similarity[url]
-        else:
-            combined_similarity[url] += keyword_match_weight * content_similarity[url]
-    
-    
-    # Include page rank
-    for url in combined_similarity:
-        page_rank = getPageRank(url)
-        if page_rank is not None:
-            combined_similarity[url] *= page_rank
-    
-    combined_similarity = dict(
-        sorted(combined_similarity.items(), key=lambda item: item[1], reverse=True)
-    )
-    
-    # Get the top 50 results
-    top_results = list(combined_similarity.items())[:50]
 
-    # Get the top 50 results
-    result = []
-    for url, score in top_results:
-        # Get the page details
-        #print(f"{url}: {score:.10f}")
+    # Get the details of the results of the page in a few batched queries
+    result = get_pages_details(ranking[offset : offset + limit], fields)
 
-        result.append(getPageDetails(url, score))
+    next_cursor = None
+    if len(ranking) > offset + limit and offset + limit < max_result_depth:
+        next_cursor = encode_cursor(cache_key, offset + limit)
 
-    return jsonify(result)
+    body = jsonify(result).get_data()
+    result_cache.put(response_key, generation, (body, next_cursor), size=len(body))
+    return make_response(body, next_cursor)
@@ -1,11 +1,26 @@
+import re
+
 from flask import Blueprint, jsonify, request
 
-from api.utils.levenshtein_distance import levenshtein_distance
+from api.utils.fuzzy_index import get_fuzzy_index
 from api.utils.get_cursor import get_cursor
+from api.utils.suggestion_index import get_suggestion_index
 
 suggestions_bp = Blueprint("suggestions", __name__)
 
 
+def like_prefix_pattern(query):
+    """
+    Build a regular expression matching the words SQLite's `LIKE query || '%'`
+    matches: "%" and "_" are wildcards and ASCII letters ignore case.
+    """
+    wildcards = {"%": ".*", "_": "."}
+    return re.compile(
+        "".join(wildcards.get(char, re.escape(char)) for char in query),
+        re.ASCII | re.IGNORECASE | re.DOTALL,
+    )
+
+
 @suggestions_bp.route("/suggestions")
 def suggestions():
     """
@@ -38,53 +53,42 @@ def suggestions():
 
     suggestions = []
 
-    # First try exact prefix matches (current implementation)
-    cursor.execute(
-        """
-        SELECT t.word 
-        FROM tokens t
-        LEFT JOIN inverted_index i ON t.word = i.word
-        WHERE t.word LIKE ? 
-        GROUP BY t.word
-        ORDER BY t.ngram_size, SUM(COALESCE(i.term_frequency, 0)) DESC
-        LIMIT 10
-    """,
-        (query + "%",),
-    )
-
-    exact_suggestions = [row[0] for row in cursor.fetchall()]
-    suggestions.extend(exact_suggestions)
-
-    # If fuzzy matching is enabled and we need more suggestions
-    if enable_fuzzy and len(suggestions) < 10:
-        # Get all words from the tokens table
+    # First try exact prefix matches, from the precomputed completions unless the
+    # query holds LIKE wildcards
+    if "%" in query or "_" in query:
         cursor.execute(
             """
-            SELECT t.word, SUM(COALESCE(i.term_frequency, 0)) as freq, t.ngram_size
-            FROM tokens t
-            LEFT JOIN inverted_index i ON t.word = i.word
-            WHERE t.word NOT LIKE ?
-            GROUP BY t.word
+            SELECT word FROM token_frequencies
+            WHERE word LIKE ?
+            ORDER BY ngram_size, frequency DESC, word
+            LIMIT 10
             """,
-            (query + "%",),  # Exclude words we already have
+            (query + "%",),
         )
+        exact_suggestions = [row[0] for row in cursor.fetchall()]
+    else:
+        exact_suggestions = get_suggestion_index(cursor).complete(query)
+    suggestions.extend(exact_suggestions)
+
+    # If fuzzy matching is enabled and we need more suggestions
+    if enable_fuzzy and len(suggestions) < 10:
+        # Words within the threshold, from the fuzzy index of the vocabulary
+        fuzzy_index = get_fuzzy_index(cursor)
+        exact_prefix = like_prefix_pattern(query)  # Exclude words we already have
 
         potential_matches = []
-        for row in cursor.fetchall():
-            word, freq, ngram_size = row
-            # Calculate edit distance
-            distance = levenshtein_distance(
-                query, word[: len(query)] if len(word) > len(query) else word
-            )
-            if distance <= threshold:
-                # Add to potential matches with score based on distance and frequency
-                score = freq / (
-                    distance + 1
-                )  # Higher score for closer matches with higher frequency
-                potential_matches.append((word, score, ngram_size))
+        for word, distance in fuzzy_index.search(query, threshold):
+            if exact_prefix.match(word):
+                continue
+            freq, ngram_size = fuzzy_index.tokens[word]
+            # Add to potential matches with score based on distance and frequency
+            score = freq / (
+                distance + 1
+            )  # Higher score for closer matches with higher frequency
+            potential_matches.append((word, score, ngram_size))
 
         # Sort by ngram_size and then score
-        potential_matches.sort(key=lambda x: (x[2], -x[1]))
+        potential_matches.sort(key=lambda x: (x[2], -x[1], x[0]))
 
         # Add fuzzy matches until we have 10 suggestions
         fuzzy_suggestions = [
@@ -0,0 +1,155 @@
+import numpy as np
+
+from api.utils.levenshtein_distance import encode_strings, levenshtein_distances
+from database.metadata import GenerationCache
+
+"""
+An in-memory index of the `tokens` vocabulary for fuzzy autosuggestions, rebuilt
+whenever the index generation changes (see `database.metadata.GenerationCache`).
+"""
+
+# Number of leading characters of each token kept for batch searches; longer
+# queries walk the trie
+BATCH_SEARCH_WIDTH = 32
+
+
+class FuzzyIndex:
+    """
+    The `tokens` vocabulary, searched for fuzzy autosuggestions.
+
+    The distance of a token to a query is the Levenshtein distance between the query
+    and the token cut to the query's length (the token itself if it is shorter).
+
+    Selective searches (a threshold of at most 1 and a query of 3 characters or
+    more) walk a trie of the tokens, carrying one banded row of the Levenshtein table
+    per node, so branches whose row is already above the threshold are never
+    visited. The walk stops at the query's length: every token below a node at that
+    depth is at the same distance. Broader searches reach most of the trie, and
+    score every token at once with `levenshtein_distances` instead.
+    """
+
+    def __init__(self, rows):
+        """
+        Args:
+            rows (Iterable[tuple[str, int, int]]): (token, frequency, ngram_size)
+                                                   tuples.
+        """
+        # A node maps each next character to its child, and None to the token
+        # ending at the node
+        self.root = {}
+        self.tokens = {}
+        for token, frequency, ngram_size in rows:
+            self.tokens[token] = (frequency, ngram_size)
+            node = self.root
+            for char in token:
+                node = node.setdefault(char, {})
+            node[None] = token
+
+        self.token_list = list(self.tokens)
+        self.codes, self.lengths = encode_strings(
+            [token[:BATCH_SEARCH_WIDTH] for token in self.token_list]
+        )
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def search(self, query, threshold):
+        """
+        Find the tokens within `threshold` edits of the query.
+
+        Args:
+            query (str): The partial query.
+            threshold (int): The maximum edit distance.
+
+        Returns:
+            list[tuple[str, int]]: (token, distance) tuples, in no particular order.
+        """
+        if (threshold <= 1 and len(query) > 2) or len(query) > BATCH_SEARCH_WIDTH:
+            return self.search_trie(query, threshold)
+        return self.search_batch(query, threshold)
+
+    def search_batch(self, query, threshold):
+        """Score every token against the query, see `search`."""
+        length = len(query)
+        distances = levenshtein_distances(
+            query,
+            (self.codes[:, :length], np.minimum(self.lengths, length)),
+            threshold,
+        )
+        return [
+            (self.token_list[index], int(distances[index]))
+            for index in np.flatnonzero(distances <= threshold)
+        ]
+
+    def search_trie(self, query, threshold):
+        """Walk the trie, see `search`."""
+        length = len(query)
+        limit = threshold + 1
+        matches = []
+        stack = [(self.root, 0, [min(i, limit) for i in range(length + 1)])]
+        while stack:
+            node, depth, row = stack.pop()
+            distance = row[length]
+
+            if depth == length:
+                if distance <= threshold:
+                    matches += [(token, distance) for token in iter_tokens(node)]
+                continue
+
+            if None in node and distance <= threshold:
+                matches.append((node[None], distance))
+            if min(row) > threshold:
+                continue
+
+            # Only the cells within `threshold` of the diagonal can stay within it
+            start = max(1, depth + 1 - threshold)
+            end = min(length, depth + 1 + threshold)
+            for char, child in node.items():
+                if char is None:
+                    continue
+                next_row = [limit] * (length + 1)
+                next_row[0] = min(depth + 1, limit)
+                for i in range(start, end + 1):
+                    next_row[i] = min(
+                        next_row[i - 1] + 1,
+                        row[i] + 1,
+                        row[i - 1] + (query[i - 1] != char),
+                        limit,
+                    )
+                stack.append((child, depth + 1, next_row))
+        return matches
+
+
+def iter_tokens(node):
+    """Yield every token of a trie node and its descendants."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        for char, child in node.items():
+            if char is None:
+                yield child
+            else:
+                stack.append(child)
+
+
+def load_fuzzy_index(cursor, generation):
+    """Build the fuzzy index from the token_frequencies table."""
+    cursor.execute("SELECT word, frequency, ngram_size FROM token_frequencies")
+    return FuzzyIndex(cursor.fetchall())
+
+
+fuzzy_index = GenerationCache(load_fuzzy_index)
+
+
+def get_fuzzy_index(cursor):
+    """
+    Get the fuzzy index of the current vocabulary, building it on first use and
+    after every index change.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor used to read the vocabulary.
+
+    Returns:
+        FuzzyIndex: The index.
+    """
+    return fuzzy_index.get(cursor)
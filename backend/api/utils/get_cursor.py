@@ -3,12 +3,13 @@ import sqlite3
 from flask import g
 
 from api.app import app
+from database.db import DATABASE_PATH
 
 
 def get_cursor():
     db = getattr(g, "_database", None)
     if db is None:
-        db = g._database = sqlite3.connect("documents.db")
+        db = g._database = sqlite3.connect(DATABASE_PATH)
     return db.cursor()
 
 
@@ -0,0 +1,329 @@
+import math
+import mmap
+import sys
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+from database.postings import POSTINGS_BLOCK_SIZE, decode_block, decode_positions
+from database.snapshot import SECTION_ENTRY, SNAPSHOT_HEADER, SNAPSHOT_MAGIC
+
+# Number of decoded posting lists of a compressed snapshot kept in memory, per field
+DECODED_POSTINGS_CACHE_SIZE = 256
+
+# Typecode of each numeric section; every other section is raw UTF-8
+SECTION_TYPES = {
+    "doc_url_offsets": "I",
+    "page_rank": "f",
+    "body_norm": "f",
+    "title_norm": "f",
+}
+for field in ("title", "body"):
+    SECTION_TYPES[f"{field}_term_offsets"] = "I"
+    SECTION_TYPES[f"{field}_posting_offsets"] = "I"
+    SECTION_TYPES[f"{field}_doc_ids"] = "I"
+    SECTION_TYPES[f"{field}_weights"] = "f"
+    SECTION_TYPES[f"{field}_max_weights"] = "f"
+    SECTION_TYPES[f"{field}_term_blocks"] = "I"
+    SECTION_TYPES[f"{field}_block_last_doc_ids"] = "I"
+    SECTION_TYPES[f"{field}_block_offsets"] = "I"
+    SECTION_TYPES[f"{field}_document_frequencies"] = "I"
+    SECTION_TYPES[f"{field}_idfs"] = "f"
+    SECTION_TYPES[f"{field}_max_tfs"] = "I"
+
+
+class PostingCursor:
+    """
+    Walks the postings of one term of a compressed snapshot in document id order,
+    decoding one block at a time. `next_geq` uses the skip table to jump straight to
+    the block that may contain its target, and positions are only decoded when asked.
+    """
+
+    def __init__(self, snapshot, field, term_id):
+        """
+        Args:
+            snapshot (IndexSnapshot): A compressed snapshot.
+            field (str): Either "title" or "body".
+            term_id (int): The index of the term in the field's term dictionary.
+        """
+        sections = snapshot.sections
+        self.data = sections[f"{field}_postings"]
+        self.last_doc_ids = sections[f"{field}_block_last_doc_ids"]
+        self.block_offsets = sections[f"{field}_block_offsets"]
+        term_blocks = sections[f"{field}_term_blocks"]
+        self.first_block = term_blocks[term_id]
+        self.end_block = term_blocks[term_id + 1]
+        self.document_frequency = sections[f"{field}_document_frequencies"][term_id]
+
+        # The decoded block, and the current posting in it
+        self.block = None
+        self.doc_ids = []
+        self.frequencies = []
+        self.positions_offset = None
+        self.positions = None
+        self.index = 0
+
+    def load_block(self, block):
+        """Decode the document ids and frequencies of a block of the term."""
+        count = min(
+            POSTINGS_BLOCK_SIZE,
+            self.document_frequency - (block - self.first_block) * POSTINGS_BLOCK_SIZE,
+        )
+        previous_doc_id = 0
+        if block > self.first_block:
+            previous_doc_id = self.last_doc_ids[block - 1]
+        self.doc_ids, self.frequencies, self.positions_offset = decode_block(
+            self.data, self.block_offsets[block], count, previous_doc_id
+        )
+        self.block = block
+        self.positions = None
+        self.index = 0
+
+    def next_geq(self, target):
+        """
+        Move forward to the first posting whose document id is at least `target`.
+
+        Returns:
+            int | None: Its document id, or None if there is no such posting.
+        """
+        if self.block is None or target > self.last_doc_ids[self.block]:
+            start = self.first_block if self.block is None else self.block + 1
+            block = bisect_left(self.last_doc_ids, target, start, self.end_block)
+            if block == self.end_block:
+                return None
+            self.load_block(block)
+        self.index = bisect_left(self.doc_ids, target, self.index)
+        return self.doc_ids[self.index]
+
+    def frequency(self):
+        """Get the term frequency of the current posting."""
+        return self.frequencies[self.index]
+
+    def get_positions(self):
+        """Get the positions of the term in the current posting's document."""
+        if self.positions is None:
+            self.positions = decode_positions(
+                self.data, self.positions_offset, self.frequencies
+            )
+        return self.positions[self.index]
+
+    def read_all(self):
+        """
+        Decode every posting of the term.
+
+        Returns:
+            tuple[list[int], list[int]]: The document ids and the term frequencies.
+        """
+        doc_ids, frequencies = [], []
+        for block in range(self.first_block, self.end_block):
+            self.load_block(block)
+            doc_ids += self.doc_ids
+            frequencies += self.frequencies
+        self.block = None
+        return doc_ids, frequencies
+
+
+class IndexSnapshot:
+    """
+    Read-only view over a snapshot written by `database.snapshot.export_snapshot`.
+
+    The file is memory-mapped, so several server processes reading the same
+    snapshot share its pages through the OS page cache.
+    """
+
+    def __init__(self, path):
+        """
+        Map the snapshot file and locate its sections.
+
+        Args:
+            path (str): The path of the snapshot file.
+
+        Raises:
+            ValueError: If the file is not an index snapshot, or was written by an
+                        older version of `export_snapshot`.
+        """
+        with open(path, "rb") as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, section_count, self.generation = SNAPSHOT_HEADER.unpack_from(
+            self.mapping, 0
+        )
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an index snapshot")
+
+        view = memoryview(self.mapping)
+        self.sections = {}
+        for i in range(section_count):
+            name, offset, length = SECTION_ENTRY.unpack_from(
+                self.mapping, SNAPSHOT_HEADER.size + i * SECTION_ENTRY.size
+            )
+            name = name.rstrip(b"\0").decode("ascii")
+            section = view[offset : offset + length]
+            typecode = SECTION_TYPES.get(name)
+            if typecode is None:
+                self.sections[name] = section
+            elif sys.byteorder == "little":
+                self.sections[name] = section.cast(typecode)
+            else:
+                # The snapshot is little-endian; big-endian hosts need a swapped copy
+                values = array(typecode, section.tobytes())
+                values.byteswap()
+                self.sections[name] = values
+
+        self.document_count = len(self.sections["doc_url_offsets"]) - 1
+        # Compressed snapshots store term frequencies and positions, see
+        # `database.postings`
+        self.compressed = "body_postings" in self.sections
+        # Frequent query terms are only decoded once
+        self.decode_postings = lru_cache(maxsize=2 * DECODED_POSTINGS_CACHE_SIZE)(
+            self.decode_postings
+        )
+        self.max_page_rank = max(
+            (rank for rank in self.sections["page_rank"] if not math.isnan(rank)),
+            default=None,
+        )
+
+    def get_string(self, prefix, index):
+        """Get the `index`-th string of the "<prefix>s" string table."""
+        offsets = self.sections[f"{prefix}_offsets"]
+        blob = self.sections[f"{prefix}s"]
+        return bytes(blob[offsets[index] : offsets[index + 1]]).decode("utf-8")
+
+    def find_string(self, prefix, string):
+        """
+        Binary search a sorted string table.
+
+        Returns:
+            int | None: The index of the string, or None if it is not present.
+        """
+        offsets = self.sections[f"{prefix}_offsets"]
+        blob = self.sections[f"{prefix}s"]
+        key = string.encode("utf-8")
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            current = bytes(blob[offsets[middle] : offsets[middle + 1]])
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def get_url(self, doc_id):
+        """Get the URL of a document id."""
+        return self.get_string("doc_url", doc_id)
+
+    def get_doc_id(self, url):
+        """Get the document id of a URL, or None if it is not in the snapshot."""
+        return self.find_string("doc_url", url)
+
+    def get_posting_cursor(self, field, stem):
+        """
+        Get a cursor over the postings of a stem in one field of a compressed snapshot.
+
+        Returns:
+            PostingCursor | None: The cursor, or None if the stem is not indexed.
+        """
+        term_id = self.find_string(f"{field}_term", stem)
+        if term_id is None:
+            return None
+        return PostingCursor(self, field, term_id)
+
+    def get_weights(self, field, term_id, doc_ids, frequencies):
+        """Compute the tf-idf weights of postings of a compressed snapshot."""
+        idf = self.sections[f"{field}_idfs"][term_id]
+        max_tfs = self.sections[f"{field}_max_tfs"]
+        return [
+            frequency * idf / max_tfs[doc_id]
+            for doc_id, frequency in zip(doc_ids, frequencies)
+        ]
+
+    def get_max_weight(self, field, stem):
+        """Get the largest weight / norm of a stem in one field, or None."""
+        term_id = self.find_string(f"{field}_term", stem)
+        if term_id is None:
+            return None
+        return self.sections[f"{field}_max_weights"][term_id]
+
+    def decode_postings(self, field, term_id):
+        """Decode the document ids and tf-idf weights of a compressed posting list."""
+        doc_ids, frequencies = PostingCursor(self, field, term_id).read_all()
+        weights = self.get_weights(field, term_id, doc_ids, frequencies)
+        return array("I", doc_ids), array("d", weights)
+
+    def get_posting_arrays(self, field, stem):
+        """
+        Get the postings of a stem in one field without decoding the URLs.
+
+        Args:
+            field (str): Either "title" or "body".
+            stem (str): The stem to look up.
+
+        Returns:
+            tuple | None: The document ids (ascending), their tf-idf weights and the
+                          largest weight / norm among them, or None if the stem is
+                          not indexed.
+        """
+        term_id = self.find_string(f"{field}_term", stem)
+        if term_id is None:
+            return None
+
+        max_weight = self.sections[f"{field}_max_weights"][term_id]
+        if self.compressed:
+            doc_ids, weights = self.decode_postings(field, term_id)
+            return doc_ids, weights, max_weight
+
+        offsets = self.sections[f"{field}_posting_offsets"]
+        start, end = offsets[term_id], offsets[term_id + 1]
+        return (
+            self.sections[f"{field}_doc_ids"][start:end],
+            self.sections[f"{field}_weights"][start:end],
+            max_weight,
+        )
+
+    def lookup_postings(self, field, stem, doc_ids):
+        """
+        Get the tf-idf weights of a stem in the given documents only. A compressed
+        snapshot only decodes the blocks that may contain them.
+
+        Args:
+            field (str): Either "title" or "body".
+            stem (str): The stem to look up.
+            doc_ids (list[int]): The document ids, in ascending order.
+
+        Returns:
+            list[tuple[int, float]]: (document id, tf_idf) tuples for the documents
+                                     that contain the stem.
+        """
+        term_id = self.find_string(f"{field}_term", stem)
+        if term_id is None:
+            return []
+
+        postings = []
+        if self.compressed:
+            cursor = PostingCursor(self, field, term_id)
+            for doc_id in doc_ids:
+                found = cursor.next_geq(doc_id)
+                if found is None:
+                    break
+                if found == doc_id:
+                    postings.append((doc_id, cursor.frequency()))
+            weights = self.get_weights(
+                field,
+                term_id,
+                [doc_id for doc_id, _ in postings],
+                [frequency for _, frequency in postings],
+            )
+            return [(doc_id, weight) for (doc_id, _), weight in zip(postings, weights)]
+
+        offsets = self.sections[f"{field}_posting_offsets"]
+        start, end = offsets[term_id], offsets[term_id + 1]
+        posting_doc_ids = self.sections[f"{field}_doc_ids"]
+        weights = self.sections[f"{field}_weights"]
+        for doc_id in doc_ids:
+            position = bisect_left(posting_doc_ids, doc_id, start, end)
+            if position < end and posting_doc_ids[position] == doc_id:
+                postings.append((doc_id, weights[position]))
+        return postings
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def levenshtein_distance(s1, s2):
     """
     Calculate the Levenshtein distance (edit distance) between two strings.
@@ -26,3 +29,95 @@ def levenshtein_distance(s1, s2):
         previous_row = current_row
 
     return previous_row[-1]
+
+
+def encode_strings(strings):
+    """
+    Pack strings into a padded matrix of code points.
+
+    Args:
+        strings (list[str]): The strings.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The (len(strings), longest length) matrix of
+                                       code points, padded with -1, and the length
+                                       of each string.
+    """
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    width = int(lengths.max()) if len(strings) else 0
+    codes = np.full((len(strings), width), -1, dtype=np.int32)
+
+    # Scatter the code points of all the strings at once
+    flat = np.frombuffer("".join(strings).encode("utf-32-le"), dtype=np.int32)
+    rows = np.repeat(np.arange(len(strings)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    columns = np.arange(len(flat)) - np.repeat(starts, lengths)
+    codes[rows, columns] = flat
+    return codes, lengths
+
+
+def levenshtein_distances(query, candidates, threshold=None):
+    """
+    Calculate the Levenshtein distance between a query and many candidates at once.
+
+    The candidates are padded into a matrix of code points, and the dynamic
+    programming table is filled one candidate position at a time for all of them
+    together with NumPy. With a threshold, candidates whose length alone is too far
+    from the query's are skipped, and the computation stops once every remaining
+    candidate exceeds it.
+
+    Args:
+        query (str): The string every candidate is compared with.
+        candidates (list[str] | tuple[np.ndarray, np.ndarray]): The candidates, or
+            their `encode_strings` matrix and lengths to reuse it across queries.
+        threshold (int, optional): The largest distance of interest.
+
+    Returns:
+        np.ndarray: The distance of each candidate. With a threshold, distances
+                    larger than it are reported as threshold + 1.
+    """
+    if isinstance(candidates, tuple):
+        codes, lengths = candidates
+    else:
+        codes, lengths = encode_strings(candidates)
+
+    length = len(query)
+    if threshold is None:
+        # No distance exceeds the longest length, so the band is the whole table
+        threshold = max(length, codes.shape[1])
+        capped = False
+    else:
+        capped = True
+    limit = threshold + 1
+    distances = np.full(len(lengths), limit, dtype=np.int32)
+
+    # Candidates whose length alone is too far from the query's are left at `limit`
+    selected = np.flatnonzero(np.abs(lengths - length) <= threshold)
+    codes = codes[selected]
+    lengths = lengths[selected]
+    distances[selected[lengths == 0]] = length
+
+    query_codes = np.array([ord(char) for char in query], dtype=np.int32)
+    # column[i] holds the distances between query[:i] and each candidate[:j]. Only
+    # the cells within `threshold` of the diagonal can stay within it, the others
+    # are left at `limit`
+    column = np.repeat(np.arange(length + 1, dtype=np.int32)[:, None], len(selected), 1)
+    np.minimum(column, limit, out=column)
+    next_column = np.empty_like(column)
+    for j in range(codes.shape[1]):
+        next_column.fill(limit)
+        next_column[0] = min(j + 1, limit)
+        mismatches = query_codes[:, None] != codes[:, j]
+        for i in range(max(1, j + 1 - threshold), min(length, j + 1 + threshold) + 1):
+            cell = next_column[i]
+            np.minimum(column[i], next_column[i - 1], out=cell)
+            cell += 1
+            np.minimum(cell, column[i - 1] + mismatches[i - 1], out=cell)
+        column, next_column = next_column, column
+
+        finished = lengths == j + 1
+        distances[selected[finished]] = column[length, finished]
+        if (column.min(axis=0)[lengths > j + 1] > threshold).all():
+            break
+
+    return np.minimum(distances, limit) if capped else distances
@@ -0,0 +1,127 @@
+from collections import defaultdict
+
+from database.db import chunked, cursor
+from database.dictionary import get_doc_ids
+
+# The fields of a search result, in the order they are returned
+PAGE_FIELDS = (
+    "score",
+    "title",
+    "link",
+    "last_modification_date",
+    "file_size",
+    "keywords",
+    "children_links",
+    "parent_links",
+)
+
+
+def query_by_ids(query, doc_ids):
+    """
+    Run a query with an "IN ({placeholders})" clause over the doc_ids, in chunks.
+
+    Args:
+        query (str): The query, with a "{placeholders}" field.
+        doc_ids (list[int]): The doc_ids to bind.
+
+    Returns:
+        list[tuple]: The rows of every chunk.
+    """
+    rows = []
+    for chunk in chunked(doc_ids):
+        placeholders = ", ".join("?" * len(chunk))
+        rows += cursor.execute(query.format(placeholders=placeholders), chunk)
+    return rows
+
+
+def get_pages_details(results, fields=PAGE_FIELDS):
+    """
+    Get the details shown for each search result, with a handful of batched queries
+    instead of several queries per page.
+
+    Args:
+        results (list[tuple[str, float]]): The (url, score) of each result, in order.
+        fields (Iterable[str]): The PAGE_FIELDS to return. The keywords and links are
+                                only queried if they are requested.
+
+    Returns:
+        list[dict | None]: The details of each result, in the same order, or None
+                           for a page that is not in page_information:
+            {
+                "score": "0.99999",
+                "title": "Home Move (2001)",
+                "link": "https://www.cse.hk.hk/alumni/2016-06-08",
+                "last_modification_date": "2016-06-16 00:00:00",
+                "file_size": "5931B",
+                "keywords": {"cse": "3", "mov": "5", "test": "4"},
+                "children_links": ["http://childlink1.com", ...],
+                "parent_links": ["http://parentlink1.com", ...],
+            }
+    """
+    doc_ids = get_doc_ids(url for url, _ in results)
+    ids = list(doc_ids.values())
+
+    pages = {
+        doc_id: (title, last_modified_date, size)
+        for doc_id, title, last_modified_date, size in query_by_ids(
+            """SELECT doc_id, title, last_modified_date, size FROM page_information
+               WHERE doc_id IN ({placeholders})""",
+            ids,
+        )
+    }
+
+    keywords = defaultdict(dict)
+    if "keywords" in fields:
+        for doc_id, keyword, frequency in query_by_ids(
+            """SELECT k.doc_id, t.term, k.frequency FROM page_top_keywords k
+               JOIN terms t USING (term_id)
+               WHERE k.doc_id IN ({placeholders})
+               ORDER BY k.doc_id, k.frequency DESC, t.term""",
+            ids,
+        ):
+            keywords[doc_id][keyword] = str(frequency)
+
+    children_links = defaultdict(list)
+    if "children_links" in fields:
+        for parent_id, child_url in query_by_ids(
+            """SELECT r.parent_id, d.url FROM page_relationships r
+               JOIN documents d ON d.doc_id = r.child_id
+               WHERE r.parent_id IN ({placeholders})
+               ORDER BY r.parent_id, d.url""",
+            ids,
+        ):
+            children_links[parent_id].append(child_url)
+
+    # Parents are listed in the order the links were discovered
+    parent_links = defaultdict(list)
+    if "parent_links" in fields:
+        for child_id, parent_url in query_by_ids(
+            """SELECT r.child_id, d.url FROM page_relationships r
+               JOIN documents d ON d.doc_id = r.parent_id
+               WHERE r.child_id IN ({placeholders})
+               ORDER BY r.child_id, r.rowid""",
+            ids,
+        ):
+            parent_links[child_id].append(parent_url)
+
+    details = []
+    for url, score in results:
+        doc_id = doc_ids.get(url)
+        if doc_id not in pages:
+            details.append(None)
+            continue
+        title, last_modified_date, size = pages[doc_id]
+        page_details = {
+            "score": "{:.5f}".format(score),
+            "title": title,
+            "link": url,
+            "last_modification_date": last_modified_date,
+            "file_size": f"{size}B",
+            "keywords": keywords[doc_id],
+            "children_links": children_links[doc_id],
+            "parent_links": parent_links[doc_id],
+        }
+        details.append(
+            {field: page_details[field] for field in PAGE_FIELDS if field in fields}
+        )
+    return details
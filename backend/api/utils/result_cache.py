@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Default limits of the /search result cache
+RESULT_CACHE_ENTRIES = 1024
+RESULT_CACHE_BYTES = 32 * 1024 * 1024
+RESULT_CACHE_TTL = 300
+
+
+class ResultCache:
+    """
+    An LRU cache of encoded responses (or other query results), bounded by entry count,
+    total size and age.
+
+    Entries belong to an index generation (see `database.metadata.get_index_generation`).
+    As soon as a lookup or insertion sees a newer generation, every entry is dropped.
+    """
+
+    def __init__(
+        self,
+        max_entries=RESULT_CACHE_ENTRIES,
+        max_bytes=RESULT_CACHE_BYTES,
+        ttl=RESULT_CACHE_TTL,
+    ):
+        """
+        Args:
+            max_entries (int): The maximum number of cached responses.
+            max_bytes (int): The maximum total size of the cached responses.
+            ttl (float): How long a response stays valid, in seconds.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expiry time, size, value)
+        self.size = 0
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def _check_generation(self, generation):
+        """Drop every entry if the index changed since they were cached."""
+        if generation != self.generation:
+            self.entries.clear()
+            self.size = 0
+            self.generation = generation
+
+    def _discard(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.size -= size
+
+    def get(self, key, generation):
+        """
+        Look up a value.
+
+        Args:
+            key (Hashable): The normalized query.
+            generation (int): The current index generation.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        with self.lock:
+            self._check_generation(generation)
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                self._discard(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, generation, value, size=None):
+        """
+        Cache a value, evicting the least recently used ones if needed.
+
+        Args:
+            key (Hashable): The normalized query.
+            generation (int): The index generation the value was computed from.
+            value: The encoded response, or any other value.
+            size (int, optional): The approximate size of the value in bytes.
+                                  Defaults to len(value).
+        """
+        if size is None:
+            size = len(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._check_generation(generation)
+            if key in self.entries:
+                self._discard(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._discard(oldest)
+
+    def clear(self):
+        """Drop every entry."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
@@ -0,0 +1,603 @@
+import heapq
+import math
+import os
+import threading
+from itertools import accumulate
+
+from api.utils.index_snapshot import IndexSnapshot
+from api.utils.vector_scoring import VectorScorer
+from database.db import chunked, cursor
+from database.dictionary import get_urls
+from database.metadata import get_index_generation, get_metadata
+
+# The tables and columns that hold the index of each searchable field
+FIELD_TABLES = {
+    "title": {
+        "statistics": "title_statistics",
+        "positional_index": "title_positional_index",
+        "max_weight": "title_max_weight",
+        "norm": "title_norm",
+    },
+    "body": {
+        "statistics": "word_statistics",
+        "positional_index": "positional_index",
+        "max_weight": "word_max_weight",
+        "norm": "body_norm",
+    },
+}
+
+
+# The mmapped index snapshot, if the server loaded one and it matches the database.
+# Postings, norms and PageRank scores are then read from it instead of SQLite.
+# Queries get it from `check_snapshot`, as other threads may replace it.
+snapshot = None
+
+# Scores documents with NumPy arrays over the snapshot, instead of `top_k`
+vector_scorer = None
+
+# Where the snapshot is loaded from, and the (inode, size, modification time) of the
+# file last opened there, to reopen it once it is replaced
+snapshot_path = None
+snapshot_file = None
+snapshot_vectorized = True
+snapshot_lock = threading.Lock()
+
+
+def load_snapshot(path, vectorized=True):
+    """
+    Serve postings, document norms and PageRank scores from an index snapshot, for
+    as long as it matches the database (see `check_snapshot`).
+
+    Args:
+        path (str): The path of a snapshot written by `database.snapshot.export_snapshot`.
+                    It does not need to exist yet.
+        vectorized (bool): Score every matching document at once with NumPy
+                           (see `VectorScorer`) rather than with MaxScore pruning.
+    """
+    global snapshot_path, snapshot_vectorized
+    snapshot_path = path
+    snapshot_vectorized = vectorized
+    with snapshot_lock:
+        open_snapshot()
+
+
+def get_file_identity(path):
+    """Get the (inode, size, modification time) of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def open_snapshot():
+    """Map the snapshot file, or stop using a snapshot if the file is not usable."""
+    global snapshot, vector_scorer, snapshot_file
+    snapshot = vector_scorer = None
+    snapshot_file = get_file_identity(snapshot_path)
+    if snapshot_file is None:
+        return
+    try:
+        snapshot = IndexSnapshot(snapshot_path)
+    except (OSError, ValueError) as e:
+        print(f"Not using the index snapshot: {e}")
+        return
+    if snapshot_vectorized:
+        vector_scorer = VectorScorer(snapshot, FIELD_TABLES)
+
+
+def check_snapshot(generation):
+    """
+    Get the snapshot to rank a query with, if it was exported at the current index
+    generation.
+
+    A snapshot file replaced since it was opened (e.g. by crawl_and_save.py) is
+    reopened. Until the file matches the database again, queries are ranked from
+    SQLite. Other threads may switch snapshots at any time, so a query uses the
+    pair returned here throughout instead of reading the globals again.
+
+    Args:
+        generation (int): The current index generation.
+
+    Returns:
+        tuple[IndexSnapshot | None, VectorScorer | None]: The snapshot and its
+                                                          vector scorer, if any.
+    """
+    global snapshot, vector_scorer
+    with snapshot_lock:
+        if snapshot_path is not None and (
+            snapshot is None or snapshot.generation != generation
+        ):
+            if get_file_identity(snapshot_path) != snapshot_file:
+                open_snapshot()
+            if snapshot is not None and snapshot.generation != generation:
+                snapshot = vector_scorer = None
+        return snapshot, vector_scorer
+
+
+def get_positions(field, stem):
+    """
+    Get the positions of a stem in every document whose field contains it.
+
+    Args:
+        field (str): Either "title" or "body".
+        stem (str): The stem to look up.
+
+    Returns:
+        dict: A mapping of doc_id -> list of positions.
+    """
+    tables = FIELD_TABLES[field]
+    rows = cursor.execute(
+        f"""SELECT p.doc_id, p.positions FROM {tables["positional_index"]} p
+            JOIN terms t USING (term_id)
+            WHERE t.term = ?""",
+        (stem,),
+    )
+    return {doc_id: [int(p) for p in positions.split()] for doc_id, positions in rows}
+
+
+class PostingList:
+    """
+    The postings of one query term in one field, read lazily: in full while ranking
+    still accepts new documents, then only for the documents still in the running.
+
+    Documents are the doc_ids of the database, or the document ids of the index
+    snapshot when postings come from it.
+    """
+
+    def __init__(
+        self, field, stem, coefficient, upper_bound, candidates=None, snapshot=None
+    ):
+        """
+        Args:
+            field (str): Either "title" or "body".
+            stem (str): The query term.
+            coefficient (float): The field weight times the query term frequency.
+            upper_bound (float): An upper bound of coefficient * tf_idf / norm.
+            candidates (set, optional): If given, other documents are ignored.
+            snapshot (IndexSnapshot, optional): The snapshot to read postings from,
+                                                SQLite otherwise.
+        """
+        self.snapshot = snapshot
+        self.field = field
+        self.stem = stem
+        self.coefficient = coefficient
+        self.upper_bound = upper_bound
+        self.candidates = candidates
+
+    def read(self):
+        """
+        Read every posting.
+
+        Returns:
+            Iterable[tuple]: (document, tf_idf) tuples.
+        """
+        if self.snapshot is not None:
+            doc_ids, tf_idfs, _ = self.snapshot.get_posting_arrays(
+                self.field, self.stem
+            )
+            postings = list(zip(doc_ids, tf_idfs))
+        else:
+            tables = FIELD_TABLES[self.field]
+            postings = cursor.execute(
+                f"""SELECT s.doc_id, s.tf_idf FROM {tables["statistics"]} s
+                    JOIN terms t USING (term_id)
+                    WHERE t.term = ?""",
+                (self.stem,),
+            ).fetchall()
+
+        if self.candidates is None:
+            return postings
+        return [posting for posting in postings if posting[0] in self.candidates]
+
+    def lookup(self, documents):
+        """
+        Read the postings of the given documents only.
+
+        Returns:
+            Iterable[tuple]: (document, tf_idf) tuples.
+        """
+        if self.snapshot is not None:
+            return self.snapshot.lookup_postings(
+                self.field, self.stem, sorted(documents)
+            )
+
+        tables = FIELD_TABLES[self.field]
+        postings = []
+        for chunk in chunked(list(documents)):
+            placeholders = ", ".join("?" * len(chunk))
+            postings += cursor.execute(
+                f"""SELECT s.doc_id, s.tf_idf FROM {tables["statistics"]} s
+                    JOIN terms t USING (term_id)
+                    WHERE t.term = ? AND s.doc_id IN ({placeholders})""",
+                [self.stem, *chunk],
+            )
+        return postings
+
+
+class DocumentValues:
+    """
+    The norms and PageRank factors of documents, fetched in batches as ranking needs
+    them. With a snapshot, norms are read from its arrays directly.
+
+    `norms[field][document]` is 0.0 or NaN for a missing norm and
+    `factors[document]` is 1.0 for a document without a PageRank score.
+    """
+
+    def __init__(self, snapshot=None):
+        """
+        Args:
+            snapshot (IndexSnapshot, optional): The snapshot to read values from,
+                                                SQLite otherwise.
+        """
+        self.snapshot = snapshot
+        if snapshot is not None:
+            self.norms = {
+                field: snapshot.sections[tables["norm"]]
+                for field, tables in FIELD_TABLES.items()
+            }
+        else:
+            self.norms = {field: {} for field in FIELD_TABLES}
+        self.factors = {}
+
+    def fetch(self, documents):
+        """Make sure the values of the given documents are loaded."""
+        documents = [document for document in documents if document not in self.factors]
+        if self.snapshot is not None:
+            page_ranks = self.snapshot.sections["page_rank"]
+            for document in documents:
+                page_rank = page_ranks[document]
+                self.factors[document] = 1.0 if math.isnan(page_rank) else page_rank
+            return
+
+        for field in FIELD_TABLES:
+            self.norms[field].update(dict.fromkeys(documents, 0.0))
+        self.factors.update(dict.fromkeys(documents, 1.0))
+        for chunk in chunked(documents):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = cursor.execute(
+                f"""SELECT doc_id, body_norm, title_norm FROM document_norms
+                    WHERE doc_id IN ({placeholders})""",
+                chunk,
+            )
+            for doc_id, body_norm, title_norm in rows:
+                self.norms["body"][doc_id] = body_norm
+                self.norms["title"][doc_id] = title_norm
+            self.factors.update(
+                cursor.execute(
+                    f"SELECT doc_id, rank FROM page_rank WHERE doc_id IN ({placeholders})",
+                    chunk,
+                )
+            )
+
+
+def get_max_weights(field, stems, snapshot=None):
+    """
+    Get the largest normalized weight (tf_idf / norm) of each stem in one field,
+    from the snapshot if one is given.
+
+    Returns:
+        dict: A mapping of stem -> maximum weight. Stems without a stored maximum are
+              omitted.
+    """
+    if snapshot is not None:
+        max_weights = {}
+        for stem in stems:
+            max_weight = snapshot.get_max_weight(field, stem)
+            if max_weight is not None:
+                max_weights[stem] = max_weight
+        return max_weights
+
+    tables = FIELD_TABLES[field]
+    max_weights = {}
+    for chunk in chunked(list(stems)):
+        placeholders = ", ".join("?" * len(chunk))
+        rows = cursor.execute(
+            f"""SELECT t.term, m.max_weight FROM {tables["max_weight"]} m
+                JOIN terms t USING (term_id)
+                WHERE t.term IN ({placeholders})""",
+            chunk,
+        )
+        max_weights.update(rows)
+    return max_weights
+
+
+def get_max_page_rank(snapshot=None):
+    """Get the largest PageRank score, or None if no page has one."""
+    if snapshot is not None:
+        return snapshot.max_page_rank
+
+    max_page_rank = get_metadata("max_page_rank")
+    if max_page_rank is None:
+        max_page_rank = cursor.execute("SELECT MAX(rank) FROM page_rank").fetchone()[0]
+    return max_page_rank
+
+
+def get_posting_lists(query_vector, field_weights, candidates=None, snapshot=None):
+    """
+    Build the posting list of each query term in each field.
+
+    Args:
+        query_vector (dict): A mapping of stem -> query term frequency.
+        field_weights (dict): The weight of each field in the combined score.
+        candidates (set, optional): If given, only these documents are kept.
+        snapshot (IndexSnapshot, optional): The snapshot to read postings from,
+                                            SQLite otherwise.
+
+    Returns:
+        list[PostingList]: The posting lists. Terms without a stored maximum weight
+                           get an infinite upper bound, so they are always read.
+    """
+    posting_lists = []
+    for field, field_weight in field_weights.items():
+        max_weights = get_max_weights(field, query_vector, snapshot)
+        for stem, query_weight in query_vector.items():
+            coefficient = field_weight * query_weight
+            if stem in max_weights:
+                upper_bound = coefficient * max_weights[stem]
+            elif snapshot is not None:
+                # Not in the snapshot, so no postings
+                continue
+            else:
+                upper_bound = math.inf
+            posting_lists.append(
+                PostingList(
+                    field, stem, coefficient, upper_bound, candidates, snapshot
+                )
+            )
+    return posting_lists
+
+
+def top_k(posting_lists, k, max_factor, snapshot=None):
+    """
+    Select the k documents with the highest score, where the score of a document is
+    its PageRank factor times the sum of coefficient * tf_idf / norm over the posting
+    lists that contain it.
+
+    The posting lists are accumulated term-at-a-time from the highest upper bound to
+    the lowest (MaxScore). Once the remaining lists cannot lift a new document above
+    the k-th best score, no new document is accepted, documents that cannot reach the
+    top k are dropped, and the remaining lists are only probed for the documents left.
+
+    Args:
+        posting_lists (list[PostingList]): The posting lists to merge.
+        k (int): The number of documents to select.
+        max_factor (float): An upper bound of the PageRank factor of every document.
+        snapshot (IndexSnapshot, optional): The snapshot the posting lists read,
+                                            whose norms and PageRank scores are used.
+
+    Returns:
+        list[tuple]: Up to k (score, document) tuples, best first.
+    """
+    if k <= 0:
+        return []
+
+    posting_lists = sorted(
+        posting_lists, key=lambda posting_list: posting_list.upper_bound, reverse=True
+    )
+    # remaining_bounds[i] bounds what lists i.. can add to a document's similarity
+    remaining_bounds = list(
+        accumulate(
+            (posting_list.upper_bound for posting_list in reversed(posting_lists)),
+            initial=0.0,
+        )
+    )[::-1]
+
+    values = DocumentValues(snapshot)
+    factors = values.factors
+    accumulators = {}
+    accepting = True
+    for i, posting_list in enumerate(posting_lists):
+        coefficient = posting_list.coefficient
+        norms = values.norms[posting_list.field]
+
+        if accepting:
+            postings = posting_list.read()
+            values.fetch(document for document, _ in postings)
+            for document, tf_idf in postings:
+                norm = norms[document]
+                score = coefficient * tf_idf / norm if norm > 0 else 0.0
+                accumulators[document] = accumulators.get(document, 0.0) + score
+        else:
+            for document, tf_idf in posting_list.lookup(accumulators):
+                norm = norms[document]
+                if norm > 0:
+                    accumulators[document] += coefficient * tf_idf / norm
+
+        remaining_bound = remaining_bounds[i + 1]
+        if len(accumulators) < k or i + 1 == len(posting_lists):
+            continue
+        best = heapq.nlargest(
+            k, accumulators.items(), key=lambda item: item[1] * factors[item[0]]
+        )
+        threshold = best[-1][1] * factors[best[-1][0]]
+        if accepting and remaining_bound * max_factor > threshold:
+            continue
+
+        # No new document can make it into the top k, drop the hopeless ones
+        accepting = False
+        accumulators = {
+            document: score
+            for document, score in accumulators.items()
+            if (score + remaining_bound) * factors[document] >= threshold
+        }
+
+    return heapq.nlargest(
+        k, ((score * factors[document], document) for document, score in accumulators.items())
+    )
+
+
+def match_phrase_in_snapshot(snapshot, field, phrase):
+    """
+    Find the documents of a compressed snapshot whose field contains the phrase.
+
+    The posting cursors of the stems are advanced together with `next_geq`, led by
+    the rarest stem, so only the blocks around candidate documents are decoded, and
+    positions are only compared in documents that contain every stem.
+
+    Args:
+        snapshot (IndexSnapshot): The compressed snapshot.
+        field (str): Either "title" or "body".
+        phrase (list): The stems of the phrase, in order.
+
+    Returns:
+        set: The document ids of the documents containing the phrase.
+    """
+    cursors = [snapshot.get_posting_cursor(field, stem) for stem in phrase]
+    if any(posting_cursor is None for posting_cursor in cursors):
+        return set()
+    lead, *others = sorted(
+        cursors, key=lambda posting_cursor: posting_cursor.document_frequency
+    )
+
+    matches = set()
+    doc_id = lead.next_geq(0)
+    while doc_id is not None:
+        aligned = True
+        for posting_cursor in others:
+            found = posting_cursor.next_geq(doc_id)
+            if found is None:
+                return matches
+            if found != doc_id:
+                aligned = False
+                doc_id = found
+                break
+
+        if aligned:
+            # Every stem occurs in the document, check that they follow each other
+            starts = set(cursors[0].get_positions())
+            for offset, posting_cursor in enumerate(cursors[1:], start=1):
+                positions = posting_cursor.get_positions()
+                starts &= {position - offset for position in positions}
+            if starts:
+                matches.add(doc_id)
+            doc_id += 1
+        doc_id = lead.next_geq(doc_id)
+
+    return matches
+
+
+def match_phrase(field, phrase, snapshot=None):
+    """
+    Find the documents whose field contains the phrase by intersecting the
+    position lists of its stems.
+
+    Args:
+        field (str): Either "title" or "body".
+        phrase (list): The stems of the phrase, in order.
+        snapshot (IndexSnapshot, optional): The snapshot in use, if any.
+
+    Returns:
+        set: The doc_ids of the documents containing the phrase, or their document
+             ids in a compressed snapshot (see `match_phrase_in_snapshot`).
+    """
+    if snapshot is not None and snapshot.compressed:
+        return match_phrase_in_snapshot(snapshot, field, phrase)
+
+    # doc_id -> positions at which the phrase could start
+    starts = None
+    # Walk the stems from the rarest to the most common to prune early
+    by_length = sorted(
+        ((offset, get_positions(field, stem)) for offset, stem in enumerate(phrase)),
+        key=lambda item: len(item[1]),
+    )
+    for offset, positions in by_length:
+        shifted = {
+            doc_id: {position - offset for position in stem_positions}
+            for doc_id, stem_positions in positions.items()
+        }
+        if starts is None:
+            starts = shifted
+        else:
+            next_starts = {}
+            for doc_id, candidates in starts.items():
+                remaining = candidates & shifted.get(doc_id, set())
+                if remaining:
+                    next_starts[doc_id] = remaining
+            starts = next_starts
+        if not starts:
+            return set()
+
+    return set(starts)
+
+
+def find_phrase_matches(phrase_list, snapshot=None):
+    """
+    Get the documents whose title or body contains at least one of the phrases.
+
+    Args:
+        phrase_list (list): A list of phrases, each a list of stems.
+        snapshot (IndexSnapshot, optional): The snapshot in use, if any.
+
+    Returns:
+        set: The matching documents (see `PostingList`).
+    """
+    matches = set()
+    for phrase in phrase_list:
+        for field in FIELD_TABLES:
+            matches |= match_phrase(field, phrase, snapshot)
+
+    if snapshot is not None and not snapshot.compressed:
+        # The positions were read from SQLite
+        matches = {snapshot.get_doc_id(url) for url in get_urls(matches).values()}
+        matches.discard(None)
+    return matches
+
+
+def get_document_urls(documents, snapshot=None):
+    """Get a mapping of document -> URL (see `PostingList`)."""
+    if snapshot is not None:
+        return {document: snapshot.get_url(document) for document in documents}
+    return get_urls(documents)
+
+
+def rank(query_vector, phrase_list, k, field_weights):
+    """
+    Find the k best documents for a parsed query using the inverted index.
+
+    The score of a document is the weighted sum of the cosine similarities of its
+    fields and the query, times its PageRank score if it has one. Without phrases,
+    a document matches if its title or body contains any query term. With phrases,
+    a document matches if its title or body contains any of the phrases.
+
+    Args:
+        query_vector (dict): A mapping of stem -> query term frequency.
+        phrase_list (list): A list of phrases, each a list of stems.
+        k (int): The number of documents to return.
+        field_weights (dict): The weight of the "title" and "body" similarities.
+
+    Returns:
+        list[tuple[str, float]]: Up to k (url, score) tuples, best first. Matching
+                                 documents with a score of zero come last.
+    """
+    snapshot, vector_scorer = check_snapshot(get_index_generation())
+
+    if phrase_list:
+        document_candidates = find_phrase_matches(phrase_list, snapshot)
+        candidates = set(get_document_urls(document_candidates, snapshot).values())
+    else:
+        document_candidates = candidates = None
+
+    if vector_scorer is not None:
+        best = vector_scorer.rank(query_vector, k, field_weights, document_candidates)
+        results = [(snapshot.get_url(doc_id), score) for doc_id, score in best]
+    else:
+        posting_lists = get_posting_lists(
+            query_vector, field_weights, document_candidates, snapshot
+        )
+
+        # Documents without a PageRank score keep their similarity as is
+        max_page_rank = get_max_page_rank(snapshot)
+        max_factor = 1.0 if max_page_rank is None else max(max_page_rank, 1.0)
+
+        best = top_k(posting_lists, k, max_factor, snapshot)
+        urls = get_document_urls((document for _, document in best), snapshot)
+        results = [(urls[document], score) for score, document in best]
+    results.sort(key=lambda result: (-result[1], result[0]))
+
+    # Phrase matches that share no term with the query still match, with a score of zero
+    if candidates is not None and len(results) < k:
+        found = {url for url, _ in results}
+        results += [(url, 0.0) for url in sorted(candidates - found)][: k - len(results)]
+
+    return results
@@ -0,0 +1,103 @@
+import gzip
+import hashlib
+import json
+from bisect import bisect_left
+
+from database.metadata import GenerationCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+The stems of the `words` table served by /get_stemmed_word, encoded and compressed
+once per index generation (see `database.metadata.GenerationCache`).
+"""
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESSED_SIZE = 1024
+
+
+def compress(body, quick=False):
+    """
+    Compress a response body with every supported content coding.
+
+    Args:
+        body (bytes): The uncompressed body.
+        quick (bool): Trade size for speed, for bodies compressed per request.
+
+    Returns:
+        dict: A mapping of content coding ("br", "gzip") -> compressed body. Empty if
+              the body is too small to be worth compressing.
+    """
+    if len(body) < MIN_COMPRESSED_SIZE:
+        return {}
+    encodings = {"gzip": gzip.compress(body, compresslevel=6 if quick else 9, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(body, quality=5 if quick else 11)
+    return encodings
+
+
+def encode(stems):
+    """Encode a list of stems as a compact JSON array."""
+    return json.dumps(stems, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class StemmedWords:
+    """
+    The stemmed vocabulary, in term_id order, with its JSON encoding precomputed and
+    compressed, and a sorted copy to list the stems starting with a prefix.
+    """
+
+    def __init__(self, stems, generation):
+        """
+        Args:
+            stems (list[str]): The stems, in term_id order.
+            generation (int): The index generation they were read at.
+        """
+        self.stems = stems
+        self.sorted_stems = sorted(stems)
+        self.body = encode(stems)
+        self.encodings = compress(self.body)
+        digest = hashlib.sha1(self.body).hexdigest()[:16]
+        self.version = f"{generation}-{digest}"
+
+    def __len__(self):
+        return len(self.stems)
+
+    def with_prefix(self, prefix):
+        """Get the stems starting with `prefix`, in alphabetical order."""
+        stems = self.sorted_stems
+        start = end = bisect_left(stems, prefix)
+        while end < len(stems) and stems[end].startswith(prefix):
+            end += 1
+        return stems[start:end]
+
+
+def load_stemmed_words(cursor, generation):
+    """Read and encode the stems of the words table."""
+    cursor.execute(
+        """
+        SELECT t.term FROM words w JOIN terms t USING (term_id)
+        ORDER BY term_id
+        """
+    )
+    return StemmedWords([row[0] for row in cursor.fetchall()], generation)
+
+
+stemmed_words = GenerationCache(load_stemmed_words)
+
+
+def get_stemmed_words(cursor):
+    """
+    Get the stemmed vocabulary, reading and encoding it on first use and after every
+    index change.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor used to read the vocabulary.
+
+    Returns:
+        StemmedWords: The vocabulary.
+    """
+    return stemmed_words.get(cursor)
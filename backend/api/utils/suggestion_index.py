@@ -0,0 +1,110 @@
+from bisect import bisect_left
+
+from database.metadata import GenerationCache
+
+"""
+An in-memory index of prefix completions for /suggestions, built from the
+token_frequencies table and rebuilt whenever the index generation changes (see
+`database.metadata.GenerationCache`).
+"""
+
+# Number of completions returned for a prefix
+SUGGESTION_COUNT = 10
+
+
+class SuggestionIndex:
+    """
+    Prefix completions of the vocabulary, ranked like /suggestions ranks them:
+    unigrams before n-grams, then by decreasing frequency, then alphabetically.
+
+    Tokens are kept sorted, so the completions of a prefix are a contiguous range
+    found by binary search. The best `count` completions of every prefix with more
+    completions than that are precomputed; the completions of other prefixes are
+    few enough to rank at lookup time.
+    """
+
+    def __init__(self, rows, count=SUGGESTION_COUNT):
+        """
+        Args:
+            rows (Iterable[tuple[str, int, int]]): (token, ngram_size, frequency)
+                                                   tuples.
+            count (int): The number of completions returned for a prefix.
+        """
+        self.count = count
+        rows = sorted(rows, key=lambda row: (row[1], -row[2], row[0]))
+        ranked = [token for token, _, _ in rows]
+        self.ranks = {token: rank for rank, token in enumerate(ranked)}
+        self.tokens = sorted(self.ranks)
+
+        # A prefix has more than `count` completions if and only if it is shared by
+        # its first completion and the `count`-th one after it
+        large_prefixes = set()
+        for first, last in zip(self.tokens, self.tokens[count:]):
+            length = 0
+            shortest = min(len(first), len(last))
+            while length < shortest and first[length] == last[length]:
+                length += 1
+            large_prefixes.update(first[:i] for i in range(1, length + 1))
+
+        # Prefixes of a token are visited shortest first, and large prefixes only
+        # have large prefixes themselves
+        self.top_completions = {prefix: [] for prefix in large_prefixes}
+        for token in ranked:
+            for i in range(1, len(token) + 1):
+                completions = self.top_completions.get(token[:i])
+                if completions is None:
+                    break
+                if len(completions) < count:
+                    completions.append(token)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def complete(self, prefix):
+        """
+        Get the best completions of a prefix.
+
+        Args:
+            prefix (str): The typed prefix, in lowercase.
+
+        Returns:
+            list[str]: Up to `count` tokens starting with the prefix, best first.
+        """
+        completions = self.top_completions.get(prefix)
+        if completions is not None:
+            return list(completions)
+
+        completions = []
+        i = bisect_left(self.tokens, prefix)
+        while (
+            i < len(self.tokens)
+            and self.tokens[i].startswith(prefix)
+            and len(completions) <= self.count
+        ):
+            completions.append(self.tokens[i])
+            i += 1
+        completions.sort(key=self.ranks.__getitem__)
+        return completions[: self.count]
+
+
+def load_suggestion_index(cursor, generation):
+    """Build the suggestion index from the token_frequencies table."""
+    cursor.execute("SELECT word, ngram_size, frequency FROM token_frequencies")
+    return SuggestionIndex(cursor.fetchall())
+
+
+suggestion_index = GenerationCache(load_suggestion_index)
+
+
+def get_suggestion_index(cursor):
+    """
+    Get the suggestion index of the current vocabulary, building it on first use
+    and after every index change.
+
+    Args:
+        cursor (sqlite3.Cursor): The cursor used to read the vocabulary.
+
+    Returns:
+        SuggestionIndex: The index.
+    """
+    return suggestion_index.get(cursor)
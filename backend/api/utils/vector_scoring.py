@@ -0,0 +1,96 @@
+import numpy as np
+
+
+class VectorScorer:
+    """
+    Scores every document of an index snapshot at once with NumPy arrays.
+
+    Document ids of the snapshot index dense per-document arrays (norms, PageRank
+    factors, accumulated scores), and posting lists are read as zero-copy views of
+    the snapshot's doc_ids and weights sections.
+    """
+
+    def __init__(self, snapshot, fields=("title", "body")):
+        """
+        Args:
+            snapshot (IndexSnapshot): The loaded snapshot.
+            fields (Iterable[str]): The fields that can be scored.
+        """
+        self.snapshot = snapshot
+        self.norms = {
+            field: np.asarray(snapshot.sections[f"{field}_norm"], dtype=np.float64)
+            for field in fields
+        }
+        page_ranks = np.asarray(snapshot.sections["page_rank"], dtype=np.float64)
+        # Documents without a PageRank score keep their similarity as is
+        self.factors = np.where(np.isnan(page_ranks), 1.0, page_ranks)
+
+    def get_postings(self, field, stem):
+        """
+        Get the postings of a stem in one field as arrays.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray] | None: The document ids and their tf-idf
+                                                  weights, or None if the stem is
+                                                  not indexed.
+        """
+        arrays = self.snapshot.get_posting_arrays(field, stem)
+        if arrays is None:
+            return None
+        doc_ids, tf_idfs, _ = arrays
+        return np.asarray(doc_ids), np.asarray(tf_idfs, dtype=np.float64)
+
+    def rank(self, query_vector, k, field_weights, candidates=None):
+        """
+        Select the k best documents, scored like `api.utils.retrieval.rank`: the
+        weighted sum of the cosine similarities of each field, times the PageRank factor.
+
+        Args:
+            query_vector (dict): A mapping of stem -> query term frequency.
+            k (int): The number of documents to return.
+            field_weights (dict): The weight of each field in the combined score.
+            candidates (set, optional): If given, the document ids that match the query.
+                                        Otherwise, every document containing a query
+                                        term matches.
+
+        Returns:
+            list[tuple[int, float]]: Up to k (document id, score) tuples, best first,
+                                     ties broken by document id (i.e. by URL).
+        """
+        if k <= 0:
+            return []
+
+        document_count = self.snapshot.document_count
+        scores = np.zeros(document_count)
+        matched = np.zeros(document_count, dtype=bool)
+
+        for field, field_weight in field_weights.items():
+            norms = self.norms[field]
+            for stem, query_weight in query_vector.items():
+                postings = self.get_postings(field, stem)
+                if postings is None:
+                    continue
+                doc_ids, tf_idfs = postings
+                document_norms = norms[doc_ids]
+                # NaN marks a missing norm, such documents get a similarity of zero
+                contributions = np.divide(
+                    field_weight * query_weight * tf_idfs,
+                    document_norms,
+                    out=np.zeros(len(doc_ids)),
+                    where=document_norms > 0,
+                )
+                # Document ids are unique within a posting list
+                scores[doc_ids] += contributions
+                matched[doc_ids] = True
+
+        if candidates is not None:
+            matched = np.zeros(document_count, dtype=bool)
+            matched[np.fromiter(candidates, dtype=np.int64, count=len(candidates))] = True
+
+        doc_ids = np.flatnonzero(matched)
+        scores = scores[doc_ids] * self.factors[doc_ids]
+        if k < len(doc_ids):
+            best = np.argpartition(-scores, k - 1)[:k]
+            doc_ids, scores = doc_ids[best], scores[best]
+        order = np.lexsort((doc_ids, -scores))
+        return [(int(doc_ids[i]), float(scores[i])) for i in order]
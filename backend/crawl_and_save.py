@@ -1,21 +1,33 @@
 import os
+import sys
 
 """
 This script is used to crawl a webpage and save the content to a database.
 It first creates the necessary database tables, then fetches and saves the pages,
-and finally calculates the PageRank scores for the pages.
+calculates the PageRank scores for the pages, and finally exports the index
+snapshot used by the search server.
+
+An existing database is recrawled: unchanged pages are skipped, and the statistics
+and PageRank scores are updated incrementally (with a full refresh when too much
+changed). Pass --fresh to delete it and crawl from scratch.
 Usage:
-    python/python3 crawl_and_save.py
+    python/python3 crawl_and_save.py [--fresh]
 """
 
 
-if os.path.exists("documents.db"):
-    os.remove("documents.db")
+if "--fresh" in sys.argv[1:]:
+    # Before database.db opens the file
+    path = os.environ.get("SEARCH_ENGINE_DB", "documents.db")
+    for file in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(file):
+            os.remove(file)
 
 from crawler.fetch_and_save_pages import fetch_and_save_pages
 from database.create_tables import create_tables
 from database.page_rank import calculate_page_rank
+from database.snapshot import export_snapshot
 
 create_tables()
 fetch_and_save_pages("https://www.cse.ust.hk/~kwtleung/COMP4321/testpage.htm")
-calculate_page_rank()
+calculate_page_rank(incremental=True)
+export_snapshot()
@@ -1,29 +1,115 @@
+import multiprocessing
+import threading
+import time
 from collections import deque
-from typing import Dict, List, Optional, Set
-from urllib.parse import urljoin
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from queue import Queue
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
-from database.add_pages import add_pages
-from database.should_fetch_page import should_fetch_page
+from crawler.parse_webpage import parse_webpage
+from database.add_pages import add_pages, analyze_page, remove_pages
+from database.db import connection
+from database.should_fetch_page import (
+    get_cache_validators,
+    get_stored_child_links,
+    should_fetch_page,
+)
 
+# Number of hosts and connections per host kept alive by the shared session
+POOL_HOSTS = 16
+POOL_CONNECTIONS_PER_HOST = 8
 
-def fetch_webpage(url: str) -> Dict[str, Optional[str]]:
+# Statuses meaning that a page no longer exists, so it is removed from the index
+GONE_STATUS_CODES = (404, 410)
+
+# One session for every fetch (requests' connection pool is thread-safe), so TCP/TLS
+# connections are reused across pages instead of being opened for every request
+session = requests.Session()
+session.mount("http://", HTTPAdapter(POOL_HOSTS, POOL_CONNECTIONS_PER_HOST))
+session.mount("https://", HTTPAdapter(POOL_HOSTS, POOL_CONNECTIONS_PER_HOST))
+
+
+def is_unchanged(response: requests.Response, validators: Dict[str, str]) -> bool:
+    """
+    Checks whether a response is for the same version of the page as the stored one.
+
+    Args:
+        response (requests.Response): The response, whose body has not been read yet.
+        validators (Dict[str, str]): The conditional headers sent with the request.
+
+    Returns:
+        bool: True if the server answered 304, or if it ignored the conditional headers
+              but sent the same ETag or Last-Modified value as the stored page.
+    """
+    if response.status_code == 304:
+        return True
+    if not validators:
+        return False
+
+    etag = response.headers.get("ETag")
+    if etag and etag == validators.get("If-None-Match"):
+        return True
+    last_modified = response.headers.get("Last-Modified")
+    return bool(last_modified) and last_modified == validators.get("If-Modified-Since")
+
+
+def fetch_webpage(url: str, validators: Optional[Dict[str, str]] = None) -> Dict[str, Optional[str]]:
     """
     Fetches the content of a webpage using the provided URL.
 
     Args:
         url (str): The URL of the webpage to fetch.
+        validators (Dict[str, str], optional): Conditional request headers for a page that was
+                                               fetched before, see `get_cache_validators`.
 
     Returns:
         Dict[str, Optional[str]]: A dictionary containing:
-            - "html" (str): The HTML content of the webpage.
+            - "html" (str or None): The HTML content of the webpage, None if it has not changed.
             - "last_modified" (str or None): The value of the "Last-Modified" header if available, otherwise None.
+            - "size" (int or None): The size of the page, None if it has not changed.
+            - "etag" (str or None): The value of the "ETag" header if available, otherwise None.
+            - "not_modified" (bool): True if the stored copy of the page is still current. The body
+                                     is not downloaded in that case.
+            - "gone" (bool): True if the server answered 404 or 410. The other values are None.
     """
-    response = requests.get(url)
-    html_content = response.text
-    last_modified = response.headers.get("Last-Modified")
+    validators = validators or {}
+    response = session.get(url, headers=validators, stream=True)
+
+    with response:
+        last_modified = response.headers.get("Last-Modified")
+        etag = response.headers.get("ETag")
+
+        if response.status_code in GONE_STATUS_CODES:
+            return {
+                "html": None,
+                "last_modified": None,
+                "size": None,
+                "etag": None,
+                "not_modified": False,
+                "gone": True,
+            }
+
+        if is_unchanged(response, validators):
+            return {
+                "html": None,
+                "last_modified": last_modified or validators.get("If-Modified-Since"),
+                "size": None,
+                "etag": etag or validators.get("If-None-Match"),
+                "not_modified": True,
+                "gone": False,
+            }
+
+        html_content = response.text
 
     if last_modified is None:
         last_modified = response.headers.get("Date")
@@ -37,56 +123,89 @@ def fetch_webpage(url: str) -> Dict[str, Optional[str]]:
         "html": html_content,
         "last_modified": last_modified,
         "size": content_length,
+        "etag": etag,
+        "not_modified": False,
+        "gone": False,
     }
 
 
-def parse_webpage(html: str, base_url: str) -> Dict[str, Optional[object]]:
+def parse_page(
+    webpage: Dict[str, Optional[str]],
+    url: str,
+    parent_url: Optional[str],
+    analysis_pool: Optional[Executor] = None,
+) -> Dict[str, Optional[object]]:
     """
-    Parses the webpage HTML to extract the title, body text, and all URLs.
+    Parses a fetched webpage into the page yielded by the crawlers.
 
     Args:
-        html (str): The HTML content of the webpage.
-        base_url (str): The base URL to resolve relative URLs.
+        webpage (Dict): The result of `fetch_webpage`, for a page that has changed.
+        url (str): The URL of the webpage.
+        parent_url (str or None): The URL of the page that linked to it.
+        analysis_pool (Executor, optional): A process pool in which the page is parsed
+                                            and analyzed by `analyze_page` instead,
+                                            so the crawler threads don't parse HTML.
 
     Returns:
-        Dict[str, Optional[object]]: A dictionary containing:
-            - "title" (str): The title of the webpage, or None if not found.
-            - "body_text" (str): The combined text of the body content.
-            - "urls" (List[str]): A list of all URLs found in anchor tags.
-    """
-    soup = BeautifulSoup(html, "html.parser")
-    title = soup.title.string if soup.title else None
-    if soup.title:
-        soup.title.decompose()  # Remove the title element from the soup
-    body_text = " ".join(soup.stripped_strings)
-    urls = [urljoin(base_url, a["href"]) for a in soup.find_all("a", href=True)]
+        Dict[str, Optional[object]]: The page, see `iter_recursive_fetch`, or its
+                                     analysis (which holds the same keys) with an
+                                     `analysis_pool`.
+    """
+    if analysis_pool is not None:
+        page = {
+            "html": webpage["html"],
+            "last_modified": webpage["last_modified"],
+            "size": webpage["size"],
+            "etag": webpage["etag"],
+            "parent_url": parent_url,
+            "url": url,
+        }
+        return analysis_pool.submit(analyze_page, page).result()
+
+    parsed_data = parse_webpage(webpage["html"], url)
     return {
-        "title": title,
-        "body_text": body_text,
-        "urls": urls,
+        "body_text": parsed_data["body_text"],
+        "last_modified": webpage["last_modified"],
+        "size": webpage["size"],
+        "etag": webpage["etag"],
+        "parent_url": parent_url,
+        "title": parsed_data["title"],
+        "url": url,
+        "child_links": parsed_data["urls"],  # Add child links to the result
     }
 
 
-def recursive_fetch(base_url: str) -> List[Dict[str, Optional[str]]]:
+def iter_recursive_fetch(
+    base_url: str,
+    max_pages: int = 500,
+    analysis_pool: Optional[Executor] = None,
+    gone_urls: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Optional[str]]]:
     """
     Recursively fetches webpages starting from the specified base URL using a breadth-first search (BFS) strategy while avoiding cyclic links.
 
+    Pages are yielded as soon as they are fetched, so the caller does not have to keep the whole crawl in memory.
+
     Args:
         base_url (str): The initial URL from which to begin fetching webpages.
+        max_pages (int): The maximum number of pages to fetch.
+        analysis_pool (Executor, optional): Parses the pages, see `parse_page`.
+        gone_urls (List[str], optional): Receives the URLs that answered 404 or 410.
 
-    Returns:
-        List[Dict[str, Optional[str]]]: A list of dictionaries, each containing:
+    Yields:
+        Dict[str, Optional[str]]: A dictionary for each fetched page, containing:
             - "body_text" (str): The main text content of the fetched webpage.
             - "last_modified" (str or None): The value of the "Last-Modified" header for the fetched webpage, if available; otherwise, None.
+            - "size" (int): The size of the fetched webpage.
+            - "etag" (str or None): The value of the "ETag" header for the fetched webpage, if available; otherwise, None.
             - "parent_url" (str or None): The URL of the webpage that initiated the fetch; can be None for the root URL.
             - "title" (str): The title of the fetched webpage.
             - "url" (str): The URL of the fetched webpage.
             - "child_links" (List[str]): A list of all URLs found in anchor tags on the fetched webpage.
+        With an `analysis_pool`, the analysis of each page by `analyze_page` instead.
     """
     visited: Set[str] = set()
     queue = deque([(base_url, None)])  # (current_url, parent_url)
-    results = []
-    max_pages = 500
     fetched_count = 0
 
     while queue:
@@ -99,39 +218,339 @@ def recursive_fetch(base_url: str) -> List[Dict[str, Optional[str]]]:
         visited.add(current_url)
         try:
             print(current_url)
-            webpage = fetch_webpage(current_url)
-            if not should_fetch_page(current_url, webpage["last_modified"]):
+            webpage = fetch_webpage(current_url, get_cache_validators(current_url))
+            if webpage["gone"]:
+                if gone_urls is not None:
+                    gone_urls.append(current_url)
+                continue
+            if webpage["not_modified"] or not should_fetch_page(
+                current_url, webpage["last_modified"]
+            ):
+                # Unchanged page, keep crawling below it from the stored links
+                for url in get_stored_child_links(current_url):
+                    if url not in visited:
+                        queue.append((url, current_url))
                 continue
 
-            parsed_data = parse_webpage(webpage["html"], current_url)
-            result = {
-                "body_text": parsed_data["body_text"],
-                "last_modified": webpage["last_modified"],
-                "size": webpage["size"],
-                "parent_url": parent_url,
-                "title": parsed_data["title"],
-                "url": current_url,
-                "child_links": parsed_data["urls"],  # Add child links to the result
-            }
-            results.append(result)
+            result = parse_page(webpage, current_url, parent_url, analysis_pool)
             fetched_count += 1
 
-            for url in parsed_data["urls"]:
+            for url in result["child_links"]:
                 if url not in visited:
                     queue.append((url, current_url))
         except Exception as e:
             print(f"Failed to fetch {current_url}: {e}")
+            continue
+
+        yield result
+
+
+def recursive_fetch(base_url: str, max_pages: int = 500) -> List[Dict[str, Optional[str]]]:
+    """
+    Fetches webpages like `iter_recursive_fetch` and returns them as a list.
+
+    Args:
+        base_url (str): The initial URL from which to begin fetching webpages.
+        max_pages (int): The maximum number of pages to fetch.
 
-    return results
+    Returns:
+        List[Dict[str, Optional[str]]]: The fetched pages, see `iter_recursive_fetch`.
+    """
+    return list(iter_recursive_fetch(base_url, max_pages))
 
 
-def fetch_and_save_pages(base_url: str):
+def fetch_and_parse(
+    url: str,
+    validators: Dict[str, str],
+    parent_url: Optional[str] = None,
+    analysis_pool: Optional[Executor] = None,
+) -> Tuple[Dict[str, Optional[str]], Optional[Dict[str, Optional[object]]]]:
+    """
+    Fetches and parses a single webpage. Runs in the worker threads of `concurrent_fetch`.
+
+    Args:
+        url (str): The URL of the webpage.
+        validators (Dict[str, str]): Conditional request headers, see `fetch_webpage`.
+        parent_url (str, optional): The URL of the page that linked to it.
+        analysis_pool (Executor, optional): See `parse_page`.
+
+    Returns:
+        Tuple[Dict, Dict]: The results of `fetch_webpage` and `parse_page`. The page is not
+                           parsed, and the second item is None, if it has not changed or
+                           is gone.
+    """
+    webpage = fetch_webpage(url, validators)
+    if webpage["not_modified"] or webpage["gone"]:
+        return webpage, None
+    return webpage, parse_page(webpage, url, parent_url, analysis_pool)
+
+
+def iter_concurrent_fetch(
+    base_url: str,
+    max_pages: int = 500,
+    max_workers: int = 8,
+    max_connections_per_host: int = 2,
+    host_delay: float = 0.5,
+    analysis_pool: Optional[Executor] = None,
+    gone_urls: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Fetches webpages in breadth-first order like `iter_recursive_fetch`, but with a pool of worker threads.
+
+    The frontier keeps one FIFO queue per host. Only the calling thread touches the frontier,
+    the visited set and the database; the workers download and parse pages. A host never has
+    more than `max_connections_per_host` requests in flight, and consecutive requests to the
+    same host start at least `host_delay` seconds apart.
+
+    Args:
+        base_url (str): The initial URL from which to begin fetching webpages.
+        max_pages (int): The maximum number of pages to fetch.
+        max_workers (int): The maximum number of requests in flight across all hosts.
+        max_connections_per_host (int): The maximum number of requests in flight per host.
+        host_delay (float): The minimum delay, in seconds, between two requests to the same host.
+        analysis_pool (Executor, optional): Parses the pages, see `parse_page`.
+        gone_urls (List[str], optional): Receives the URLs that answered 404 or 410.
+
+    Yields:
+        Dict[str, Optional[str]]: The fetched pages, in the same format as `iter_recursive_fetch`.
+    """
+    # URLs are marked as visited when they enter the frontier, so the first page
+    # linking to a URL becomes its parent, as in the BFS of recursive_fetch
+    visited: Set[str] = {base_url}
+    frontier: Dict[str, deque] = {urlparse(base_url).netloc: deque([(base_url, None)])}
+    active_connections: Dict[str, int] = {}
+    next_request_time: Dict[str, float] = {}
+    in_flight = {}  # future -> (url, parent_url, host)
+    fetched_count = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while fetched_count < max_pages and (frontier or in_flight):
+            # Pages that end up unchanged don't count, so only cap by what is still needed
+            capacity = min(max_workers, max_pages - fetched_count)
+            now = time.monotonic()
+            next_ready = None
+
+            for host in list(frontier):
+                queue = frontier[host]
+                while queue and len(in_flight) < capacity:
+                    if active_connections.get(host, 0) >= max_connections_per_host:
+                        break
+                    ready_at = next_request_time.get(host, now)
+                    if ready_at > now:
+                        next_ready = ready_at if next_ready is None else min(next_ready, ready_at)
+                        break
+
+                    current_url, parent_url = queue.popleft()
+                    print(current_url)
+                    future = executor.submit(
+                        fetch_and_parse,
+                        current_url,
+                        get_cache_validators(current_url),
+                        parent_url,
+                        analysis_pool,
+                    )
+                    in_flight[future] = (current_url, parent_url, host)
+                    active_connections[host] = active_connections.get(host, 0) + 1
+                    next_request_time[host] = now + host_delay
+                if not queue:
+                    del frontier[host]
+
+            timeout = None if next_ready is None else max(0.0, next_ready - now)
+            if not in_flight:
+                if timeout is None:
+                    break
+                time.sleep(timeout)
+                continue
+
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                current_url, parent_url, host = in_flight.pop(future)
+                active_connections[host] -= 1
+                try:
+                    webpage, page = future.result()
+                    if webpage["gone"]:
+                        if gone_urls is not None:
+                            gone_urls.append(current_url)
+                        continue
+                    unchanged = webpage["not_modified"] or not should_fetch_page(
+                        current_url, webpage["last_modified"]
+                    )
+                except Exception as e:
+                    print(f"Failed to fetch {current_url}: {e}")
+                    continue
+
+                if unchanged:
+                    # Keep crawling below the page from the stored links
+                    child_links = get_stored_child_links(current_url)
+                else:
+                    if fetched_count >= max_pages:
+                        continue
+                    child_links = page["child_links"]
+
+                for url in child_links:
+                    if url not in visited:
+                        visited.add(url)
+                        frontier.setdefault(urlparse(url).netloc, deque()).append(
+                            (url, current_url)
+                        )
+
+                if not unchanged:
+                    fetched_count += 1
+                    yield page
+
+        # Drop requests that were still queued when max_pages was reached
+        for future in in_flight:
+            future.cancel()
+
+
+def concurrent_fetch(
+    base_url: str,
+    max_pages: int = 500,
+    max_workers: int = 8,
+    max_connections_per_host: int = 2,
+    host_delay: float = 0.5,
+) -> List[Dict[str, Optional[str]]]:
+    """
+    Fetches webpages like `iter_concurrent_fetch` and returns them as a list.
+
+    Args:
+        See `iter_concurrent_fetch`.
+
+    Returns:
+        List[Dict[str, Optional[str]]]: The fetched pages, see `iter_recursive_fetch`.
+    """
+    return list(
+        iter_concurrent_fetch(
+            base_url, max_pages, max_workers, max_connections_per_host, host_delay
+        )
+    )
+
+
+def crawl_into_queue(pages: Iterator[Dict[str, Optional[str]]], queue: Queue, errors: List[Exception]):
+    """
+    Puts every crawled page into the queue, followed by None once the crawl is over.
+    Runs on the producer thread of `fetch_and_save_pages`.
+
+    Args:
+        pages (Iterator[Dict]): The crawler, see `iter_recursive_fetch`.
+        queue (Queue): A bounded queue; putting blocks while the indexer is behind.
+        errors (List[Exception]): Receives the exception that stopped the crawl, if any.
+    """
+    try:
+        for page in pages:
+            queue.put(page)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        queue.put(None)
+
+
+def save_batch(
+    batch: List[Dict[str, Optional[str]]],
+    saved_count: int,
+    analyzed: bool = False,
+):
+    """
+    Indexes and commits a batch of pages.
+
+    Args:
+        batch (List[Dict]): The pages to save.
+        saved_count (int): The number of pages saved so far, including this batch.
+        analyzed (bool): The crawler already analyzed the pages, see `parse_page`.
+    """
+    # Only the statistics of the new pages are computed, so each batch stays cheap
+    add_pages(batch, incremental=True, analyzed=analyzed)
+    connection.commit()
+    print(f"Saved {saved_count} pages")
+
+
+def fetch_and_save_pages(
+    base_url: str,
+    max_pages: int = 500,
+    max_workers: int = 1,
+    max_connections_per_host: int = 2,
+    host_delay: float = 0.5,
+    batch_size: int = 50,
+    queue_size: int = 100,
+    analysis_workers: int = 1,
+):
     """
     Fetches webpages starting from the specified base URL and saves them to the database.
 
+    The crawler runs on a background thread and hands pages to the indexer through a queue
+    of at most `queue_size` pages. The indexer commits them every `batch_size` pages, so
+    memory use does not grow with `max_pages` and a partial crawl is kept (and searchable)
+    if the process stops. Each batch updates the statistics of its own pages, and of every
+    page once the IDF drifted too far (see `database.add_pages.update_statistics`), so
+    there is no refresh at the end. Stored pages that now answer 404 or 410 are removed
+    once the crawl is over.
+
     Args:
         base_url (str): The initial URL from which to begin fetching webpages.
+        max_pages (int): The maximum number of pages to fetch.
+        max_workers (int): The number of concurrent requests. With 1, pages are fetched one
+                           at a time by `iter_recursive_fetch`; otherwise `iter_concurrent_fetch`
+                           is used.
+        max_connections_per_host (int): See `iter_concurrent_fetch`.
+        host_delay (float): See `iter_concurrent_fetch`.
+        batch_size (int): The number of pages indexed per transaction.
+        queue_size (int): The maximum number of crawled pages waiting to be indexed.
+        analysis_workers (int): The number of processes that parse, tokenize and stem the
+                                pages. With more than 1, the crawler hands them the HTML
+                                (see `parse_page`) and this process only writes their
+                                results to the database. The processes are
+                                spawned, so the calling script must only start the crawl
+                                under `if __name__ == "__main__":`.
     """
 
-    results = recursive_fetch(base_url)
-    add_pages(results)
+    # Workers are spawned rather than forked: they start on first use, once the
+    # crawler threads run and may hold locks that a forked child would inherit
+    analysis_pool = None
+    if analysis_workers > 1:
+        analysis_pool = ProcessPoolExecutor(
+            analysis_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    gone_urls = []
+    if max_workers > 1:
+        pages = iter_concurrent_fetch(
+            base_url,
+            max_pages,
+            max_workers,
+            max_connections_per_host,
+            host_delay,
+            analysis_pool,
+            gone_urls,
+        )
+    else:
+        pages = iter_recursive_fetch(base_url, max_pages, analysis_pool, gone_urls)
+
+    queue = Queue(maxsize=queue_size)
+    errors = []
+    producer = threading.Thread(
+        target=crawl_into_queue, args=(pages, queue, errors), daemon=True
+    )
+
+    batch = []
+    saved_count = 0
+    try:
+        producer.start()
+        while True:
+            page = queue.get()
+            if page is not None:
+                batch.append(page)
+            if batch and (page is None or len(batch) >= batch_size):
+                saved_count += len(batch)
+                save_batch(batch, saved_count, analysis_pool is not None)
+                batch = []
+            if page is None:
+                break
+    finally:
+        if analysis_pool is not None:
+            analysis_pool.shutdown()
+
+    producer.join()
+    if gone_urls:
+        remove_pages(gone_urls)
+    if errors:
+        raise errors[0]
@@ -0,0 +1,31 @@
+from typing import Dict, Optional
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+
+def parse_webpage(html: str, base_url: str) -> Dict[str, Optional[object]]:
+    """
+    Parses the webpage HTML to extract the title, body text, and all URLs.
+
+    Args:
+        html (str): The HTML content of the webpage.
+        base_url (str): The base URL to resolve relative URLs.
+
+    Returns:
+        Dict[str, Optional[object]]: A dictionary containing:
+            - "title" (str): The title of the webpage, or None if not found.
+            - "body_text" (str): The combined text of the body content.
+            - "urls" (List[str]): A list of all URLs found in anchor tags.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.string if soup.title else None
+    if soup.title:
+        soup.title.decompose()  # Remove the title element from the soup
+    body_text = " ".join(soup.stripped_strings)
+    urls = [urljoin(base_url, a["href"]) for a in soup.find_all("a", href=True)]
+    return {
+        "title": title,
+        "body_text": body_text,
+        "urls": urls,
+    }
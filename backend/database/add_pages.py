@@ -1,71 +1,117 @@
-import json
+import heapq
 import math
 from collections import defaultdict
+from concurrent.futures import Executor
 from datetime import datetime
+from typing import Optional
 
-from database.db import connection, cursor
+from crawler.parse_webpage import parse_webpage
+from database.db import connection, cursor, set_indexing_pragmas
+from database.dictionary import get_doc_ids, get_terms, insert_documents, insert_terms
 from database.indexer import Indexer
+from database.metadata import bump_index_generation, get_metadata, set_metadata
+from database.token_frequencies import refresh_token_frequencies
 
 indexer = Indexer()
 
-
-def insert_url(url):
-    """Insert a URL into the urls table if it doesn't already exist."""
-    cursor.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (url,))
-
-
-def insert_page_information(url, title, last_modified, size):
-    """Insert or update a page's metadata into the forward_index table."""
-    cursor.execute(
+# The tables that hold the index of each field
+STATISTICS_FIELDS = {
+    "body": {
+        "inverted_index": "inverted_index",
+        "statistics": "word_statistics",
+        "positional_index": "positional_index",
+        "document_frequency": "document_frequency",
+        "max_weight": "word_max_weight",
+        "norm": "body_norm",
+    },
+    "title": {
+        "inverted_index": "title_inverted_index",
+        "statistics": "title_statistics",
+        "positional_index": "title_positional_index",
+        "document_frequency": "title_document_frequency",
+        "max_weight": "title_max_weight",
+        "norm": "title_norm",
+    },
+}
+
+# In incremental mode, statistics are fully recomputed once the number of pages
+# changed since the last full refresh exceeds this fraction of the collection.
+# Until then, the IDF of untouched pages is allowed to drift.
+STATISTICS_DRIFT_THRESHOLD = 0.1
+
+# Number of pages whose rows are accumulated before being written with executemany
+INDEXING_BATCH_SIZE = 100
+
+# Number of keywords stored per page in page_top_keywords
+TOP_KEYWORDS = 5
+
+# Number of pages sent to a worker process at a time when analyzing in parallel
+ANALYSIS_CHUNK_SIZE = 16
+
+
+def insert_page_information(rows):
+    """Insert or update pages' metadata, as (doc_id, title, last_modified, size, etag) rows."""
+    cursor.executemany(
         """
-        INSERT INTO page_information (url, title, last_modified_date, size)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(url) DO UPDATE SET
+        INSERT INTO page_information (doc_id, title, last_modified_date, size, etag)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(doc_id) DO UPDATE SET
             title=excluded.title,
             last_modified_date=excluded.last_modified_date,
-            size=excluded.size
+            size=excluded.size,
+            etag=excluded.etag
         """,
-        (url, title, last_modified, size),
+        rows,
     )
 
-def insert_foward_index(url, word):
-    """Insert or update a page's title into the forward_index table."""
-    cursor.execute(
+def insert_foward_index(rows):
+    """Insert or update pages' body text into the forward_index table, as (doc_id, word) rows."""
+    cursor.executemany(
         """
-        INSERT INTO forward_index (url, word)
+        INSERT INTO forward_index (doc_id, word)
         VALUES (?, ?)
-        ON CONFLICT(url) DO UPDATE SET
+        ON CONFLICT(doc_id) DO UPDATE SET
             word=excluded.word
         """,
-        (url, word),
+        rows,
     )
 
-def insert_title_foward_index(url, title):
-    """Insert or update a page's title into the forward_index table."""
-    cursor.execute(
+def insert_title_foward_index(rows):
+    """Insert or update pages' titles into the title_forward_index table, as (doc_id, title) rows."""
+    cursor.executemany(
         """
-        INSERT INTO title_forward_index (url, title)
+        INSERT INTO title_forward_index (doc_id, title)
         VALUES (?, ?)
-        ON CONFLICT(url) DO UPDATE SET
+        ON CONFLICT(doc_id) DO UPDATE SET
             title=excluded.title
         """,
-        (url, title),
+        rows,
     )
 
 
-def insert_page_relationship(parent_url, child_url):
-    """Insert a parent-child relationship into the page_relationships table if it doesn't already exist."""
-    if parent_url:
-        insert_url(parent_url)
-        cursor.execute(
-            """
-            INSERT OR IGNORE INTO page_relationships (parent_url, child_url)
-            VALUES (?, ?)
-            """,
-            (parent_url, child_url),
+def record_link_changes(count):
+    """
+    Count links added or removed since PageRank was last computed, see
+    `database.page_rank.calculate_page_rank`.
+    """
+    if count:
+        set_metadata(
+            "page_rank_changed_links", get_metadata("page_rank_changed_links", 0) + count
         )
 
 
+def insert_page_relationships(rows):
+    """Insert (parent_id, child_id) relationships into the page_relationships table if they don't already exist."""
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO page_relationships (parent_id, child_id)
+        VALUES (?, ?)
+        """,
+        rows,
+    )
+    record_link_changes(cursor.rowcount)
+
+
 def calculate_term_frequency(stems):
     """Calculate the term frequency for a list of stems."""
     term_frequency = defaultdict(int)
@@ -74,233 +120,694 @@ def calculate_term_frequency(stems):
     return term_frequency
 
 
-def insert_words_and_inverted_index(url, term_frequency):
-    """Insert words and their term frequencies into the words and inverted_index tables."""
-    for stem, tf in term_frequency.items():
-        # Insert into words table
-        cursor.execute("INSERT OR IGNORE INTO words (word) VALUES (?)", (stem,))
+def insert_words_and_inverted_index(rows):
+    """Insert (term_id, doc_id, tf) rows into the words and inverted_index tables."""
+    cursor.executemany(
+        "INSERT OR IGNORE INTO words (term_id) VALUES (?)",
+        [(term_id,) for term_id, _, _ in rows],
+    )
+    cursor.executemany(
+        """
+        INSERT INTO inverted_index (term_id, doc_id, term_frequency)
+        VALUES (?, ?, ?)
+        ON CONFLICT(term_id, doc_id) DO UPDATE SET
+            term_frequency=excluded.term_frequency
+        """,
+        rows,
+    )
+
+
+def insert_titles_and_titl_inverted_index(rows):
+    """Insert (term_id, doc_id, tf) rows into the titles and title_inverted_index tables."""
+    cursor.executemany(
+        "INSERT OR IGNORE INTO titles (term_id) VALUES (?)",
+        [(term_id,) for term_id, _, _ in rows],
+    )
+    cursor.executemany(
+        """
+        INSERT INTO title_inverted_index (term_id, doc_id, term_frequency)
+        VALUES (?, ?, ?)
+        ON CONFLICT(term_id, doc_id) DO UPDATE SET
+            term_frequency=excluded.term_frequency
+        """,
+        rows,
+    )
+
+
+def get_total_documents():
+    """Get the total number of documents in the database."""
+    cursor.execute("SELECT COUNT(*) FROM documents")
+    return cursor.fetchone()[0]
+
 
-        # Insert into inverted_index table
+def get_document_frequencies(inverted_index_table):
+    """Get the number of documents in which each term appears, with a single GROUP BY."""
+    return dict(
         cursor.execute(
-            """
-            INSERT INTO inverted_index (word, url, term_frequency)
-            VALUES (?, ?, ?)
-            ON CONFLICT(word, url) DO UPDATE SET
-                term_frequency=excluded.term_frequency
-            """,
-            (stem, url, tf),
+            f"SELECT term_id, COUNT(*) FROM {inverted_index_table} GROUP BY term_id"
         )
+    )
 
 
-def insert_titles_and_titl_inverted_index(url, term_frequency):
-    """Insert words and their term frequencies into the words and inverted_index tables."""
-    for stem, tf in term_frequency.items():
-        # Insert into words table
-        cursor.execute("INSERT OR IGNORE INTO titles (title) VALUES (?)", (stem,))
-
-        # Insert into inverted_index table
+def get_max_term_frequencies(inverted_index_table):
+    """Get the maximum term frequency of each document, with a single GROUP BY."""
+    return dict(
         cursor.execute(
-            """
-            INSERT INTO title_inverted_index (title, url, term_frequency)
-            VALUES (?, ?, ?)
-            ON CONFLICT(title, url) DO UPDATE SET
-                term_frequency=excluded.term_frequency
-            """,
-            (stem, url, tf),
+            f"SELECT doc_id, MAX(term_frequency) FROM {inverted_index_table} GROUP BY doc_id"
         )
+    )
 
 
-def get_total_documents():
-    """Get the total number of documents in the database."""
-    cursor.execute("SELECT COUNT(*) FROM urls")
-    return cursor.fetchone()[0]
+def insert_field_statistics(field, total_documents):
+    """
+    Compute the TF-IDF of every posting of one field and bulk insert them into its
+    statistics table. The document frequency table of the field is rewritten too.
 
+    Args:
+        field (str): Either "body" or "title", see STATISTICS_FIELDS.
+        total_documents (int): The number of documents in the database.
 
-def get_document_frequency(stem):
-    """Get the number of documents in which the term appears."""
-    cursor.execute(
-        "SELECT COUNT(DISTINCT url) FROM inverted_index WHERE word = ?", (stem,)
+    Returns:
+        dict: A mapping of doc_id -> sum of the squared TF-IDF values of the document.
+    """
+    tables = STATISTICS_FIELDS[field]
+    document_frequencies = get_document_frequencies(tables["inverted_index"])
+    max_term_frequencies = get_max_term_frequencies(tables["inverted_index"])
+    sum_of_squares = defaultdict(float)
+
+    def tf_idf_rows():
+        # Read through a separate cursor, the shared one runs the inserts
+        postings = connection.execute(
+            f"SELECT term_id, doc_id, term_frequency FROM {tables['inverted_index']}"
+        )
+        for term_id, doc_id, tf in postings:
+            idf = math.log2(total_documents / document_frequencies[term_id])
+            tf_idf = tf * idf / max_term_frequencies[doc_id]
+            sum_of_squares[doc_id] += tf_idf**2
+            yield term_id, doc_id, tf_idf
+
+    cursor.execute(f"DELETE FROM {tables['statistics']}")
+    cursor.executemany(
+        f"INSERT INTO {tables['statistics']} (term_id, doc_id, tf_idf) VALUES (?, ?, ?)",
+        tf_idf_rows(),
     )
-    return cursor.fetchone()[0]
 
-
-def get_title_frequency(stem):
-    """Get the number of documents in which the term appears."""
-    cursor.execute(
-        "SELECT COUNT(DISTINCT url) FROM title_inverted_index WHERE title = ?", (stem,)
+    cursor.execute(f"DELETE FROM {tables['document_frequency']}")
+    cursor.executemany(
+        f"INSERT INTO {tables['document_frequency']} (term_id, frequency) VALUES (?, ?)",
+        document_frequencies.items(),
     )
-    return cursor.fetchone()[0]
+    return sum_of_squares
 
 
-def insert_word_statistics(url, term_frequency, max_word_tf):
-    """Insert TF-IDF values into the keyword_statistics table."""
-    total_documents = get_total_documents()
+def update_field_statistics(field, total_documents, doc_ids):
+    """
+    Recompute the TF-IDF of the given pages only, using the maintained document
+    frequencies of the field.
 
-    for stem, tf in term_frequency.items():
-        word_idf = get_document_frequency(stem)
-        idf = math.log2(total_documents / word_idf)
-        tf_idf = tf * idf / max_word_tf
-        cursor.execute(
-            """
-            INSERT INTO word_statistics (word, url, tf_idf)
-            VALUES (?, ?, ?)
-            ON CONFLICT(word, url) DO UPDATE SET
-                tf_idf=excluded.tf_idf
+    Args:
+        field (str): Either "body" or "title", see STATISTICS_FIELDS.
+        total_documents (int): The number of documents in the database.
+        doc_ids (Iterable[int]): The pages whose statistics are out of date.
+
+    Returns:
+        dict: A mapping of doc_id -> sum of the squared TF-IDF values of the document.
+    """
+    tables = STATISTICS_FIELDS[field]
+    sum_of_squares = {}
+
+    for doc_id in doc_ids:
+        postings = cursor.execute(
+            f"""
+            SELECT i.term_id, i.term_frequency, d.frequency
+            FROM {tables["inverted_index"]} i
+            JOIN {tables["document_frequency"]} d ON d.term_id = i.term_id
+            WHERE i.doc_id = ?
             """,
-            (stem, url, tf_idf),
+            (doc_id,),
+        ).fetchall()
+        max_tf = max((tf for _, tf, _ in postings), default=0)
+
+        rows = []
+        sum_of_squares[doc_id] = 0.0
+        for term_id, tf, document_frequency in postings:
+            idf = math.log2(total_documents / document_frequency)
+            tf_idf = tf * idf / max_tf
+            sum_of_squares[doc_id] += tf_idf**2
+            rows.append((term_id, doc_id, tf_idf))
+
+        cursor.execute(f"DELETE FROM {tables['statistics']} WHERE doc_id = ?", (doc_id,))
+        cursor.executemany(
+            f"INSERT INTO {tables['statistics']} (term_id, doc_id, tf_idf) VALUES (?, ?, ?)",
+            rows,
         )
 
+    return sum_of_squares
 
-def insert_title_statistics(url, term_frequency, max_title_tf):
-    """Insert TF-IDF values into the title_statistics table."""
-    total_documents = get_total_documents()
 
-    for stem, tf in term_frequency.items():
-        title_idf = get_title_frequency(stem)
-        idf = math.log2(total_documents / title_idf)
-        tf_idf = tf * idf / max_title_tf
+def insert_max_weights(field, doc_ids=None):
+    """
+    Store the largest normalized weight (tf_idf / norm) of each stem of one field.
+    Must run after the document norms are written.
+
+    Args:
+        field (str): Either "body" or "title", see STATISTICS_FIELDS.
+        doc_ids (Iterable[int], optional): Only raise the maxima with the weights of
+                                           these pages. By default, every maximum is
+                                           recomputed.
+    """
+    tables = STATISTICS_FIELDS[field]
+    weights = f"""
+        FROM {tables["statistics"]} s
+        JOIN document_norms n ON n.doc_id = s.doc_id
+        WHERE n.{tables["norm"]} > 0
+    """
+    weight = f"s.tf_idf / n.{tables['norm']}"
+
+    if doc_ids is None:
+        cursor.execute(f"DELETE FROM {tables['max_weight']}")
         cursor.execute(
-            """
-            INSERT INTO title_statistics (title, url, tf_idf)
-            VALUES (?, ?, ?)
-            ON CONFLICT(title, url) DO UPDATE SET
-                tf_idf=excluded.tf_idf
-            """,
-            (stem, url, tf_idf),
+            f"""INSERT INTO {tables["max_weight"]} (term_id, max_weight)
+                SELECT s.term_id, MAX({weight}) {weights}
+                GROUP BY s.term_id"""
         )
+        return
+
+    # Lowering a maximum would need every page of the stem, an overestimate is harmless
+    cursor.executemany(
+        f"""
+        INSERT INTO {tables["max_weight"]} (term_id, max_weight)
+        SELECT s.term_id, {weight} {weights} AND s.doc_id = ?
+        ON CONFLICT(term_id) DO UPDATE SET
+            max_weight=MAX(max_weight, excluded.max_weight)
+        """,
+        [(doc_id,) for doc_id in doc_ids],
+    )
 
 
-# Referenced from insert_words_and_inverted_index(url, term_frequencies)
-def insert_tokens(url, term_frequencies):
-    """Insert words/n-grams and their term frequencies into the tokens"""
-    for token_info, tf in term_frequencies.items():
-        if isinstance(token_info, tuple):
-            # Handle n-gram case where token_info is (token, n)
-            token, ngram_size = token_info
-        else:
-            # Handle single word case
-            token = token_info
-            ngram_size = 1
+def remove_page_terms(field, doc_id, term_ids):
+    """
+    Remove the postings of a page for the given stems from one field, and decrement
+    the document frequency of those stems.
+    """
+    tables = STATISTICS_FIELDS[field]
+    rows = [(term_id, doc_id) for term_id in term_ids]
 
-        # Insert into tokens table with ngram_size
-        cursor.execute(
-            "INSERT OR IGNORE INTO tokens (word, ngram_size) VALUES (?, ?)",
-            (token, ngram_size),
+    for table in ("inverted_index", "statistics", "positional_index"):
+        cursor.executemany(
+            f"DELETE FROM {tables[table]} WHERE term_id = ? AND doc_id = ?", rows
         )
 
+    cursor.executemany(
+        f"""
+        UPDATE {tables["document_frequency"]} SET frequency = frequency - 1
+        WHERE term_id = ?
+        """,
+        [(term_id,) for term_id in term_ids],
+    )
+    cursor.execute(f"DELETE FROM {tables['document_frequency']} WHERE frequency <= 0")
+
+
+def replace_page_terms(field, pages):
+    """
+    Prepare one field of the given pages for re-indexing: drop the postings of stems a
+    page no longer contains and keep the document frequency of each stem in sync.
+
+    Args:
+        field (str): Either "body" or "title", see STATISTICS_FIELDS.
+        pages (list[tuple[int, dict]]): (doc_id, term_id -> frequency in the new
+                                        version) pairs.
+
+    Returns:
+        set: The term_ids removed from at least one page.
+    """
+    tables = STATISTICS_FIELDS[field]
+    added_documents = defaultdict(int)
+    all_removed_term_ids = set()
+
+    for doc_id, term_frequency in pages:
+        old_term_ids = {
+            term_id
+            for (term_id,) in cursor.execute(
+                f"SELECT term_id FROM {tables['inverted_index']} WHERE doc_id = ?",
+                (doc_id,),
+            ).fetchall()
+        }
+        removed_term_ids = old_term_ids - term_frequency.keys()
+        if removed_term_ids:
+            remove_page_terms(field, doc_id, removed_term_ids)
+            all_removed_term_ids |= removed_term_ids
+        for term_id in term_frequency.keys() - old_term_ids:
+            added_documents[term_id] += 1
+
+    cursor.executemany(
+        f"""
+        INSERT INTO {tables["document_frequency"]} (term_id, frequency)
+        VALUES (?, ?)
+        ON CONFLICT(term_id) DO UPDATE SET
+            frequency=frequency + excluded.frequency
+        """,
+        added_documents.items(),
+    )
+    return all_removed_term_ids
+
+
+def insert_positions(title_rows, body_rows):
+    """Insert (term_id, doc_id, positions) rows into the title_positional_index and positional_index tables."""
+    cursor.executemany(
+        """
+        INSERT INTO title_positional_index (term_id, doc_id, positions)
+        VALUES (?, ?, ?)
+        ON CONFLICT(term_id, doc_id) DO UPDATE SET
+            positions=excluded.positions
+        """,
+        [
+            (term_id, doc_id, " ".join(map(str, positions)))
+            for term_id, doc_id, positions in title_rows
+        ],
+    )
+    cursor.executemany(
+        """
+        INSERT INTO positional_index (term_id, doc_id, positions)
+        VALUES (?, ?, ?)
+        ON CONFLICT(term_id, doc_id) DO UPDATE SET
+            positions=excluded.positions
+        """,
+        [
+            (term_id, doc_id, " ".join(map(str, positions)))
+            for term_id, doc_id, positions in body_rows
+        ],
+    )
+
+
+def insert_stemmed_text(rows):
+    """Replace pages' rows in the page_stemmed_title and page_stemmed_word tables, from (doc_id, title_stems, body_stems)."""
+    cursor.executemany(
+        """INSERT OR REPLACE INTO page_stemmed_title (doc_id, stemmed_title) VALUES (?, ?)""",
+        [(doc_id, " ".join(title_stems)) for doc_id, title_stems, _ in rows],
+    )
+    cursor.executemany(
+        """INSERT OR REPLACE INTO page_stemmed_word (doc_id, stemmed_word) VALUES (?, ?)""",
+        [(doc_id, " ".join(body_stems)) for doc_id, _, body_stems in rows],
+    )
+
+
+def insert_top_keywords(doc_ids, rows):
+    """Replace the keywords of the given pages with (doc_id, term_id, frequency) rows."""
+    cursor.executemany(
+        "DELETE FROM page_top_keywords WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids]
+    )
+    cursor.executemany(
+        "INSERT INTO page_top_keywords (doc_id, term_id, frequency) VALUES (?, ?, ?)",
+        rows,
+    )
+
+
+def get_top_keywords(title_term_frequency, body_term_frequency):
+    """
+    Get the most frequent stems of a page, adding up its title and body frequencies.
+
+    Returns:
+        list[tuple[str, int]]: Up to TOP_KEYWORDS (stem, frequency) tuples, most
+                               frequent first, ties broken alphabetically.
+    """
+    frequencies = dict(body_term_frequency)
+    for stem, tf in title_term_frequency.items():
+        frequencies[stem] = frequencies.get(stem, 0) + tf
+    return heapq.nsmallest(
+        TOP_KEYWORDS, frequencies.items(), key=lambda item: (-item[1], item[0])
+    )
+
+
+def insert_stems(rows):
+    """Insert (token, stem) rows into the stems table."""
+    cursor.executemany("INSERT OR IGNORE INTO stems (token, stem) VALUES (?, ?)", rows)
+
+
+def insert_tokens(rows):
+    """Insert (token, ngram_size) rows for words/n-grams into the tokens table"""
+    cursor.executemany(
+        "INSERT OR IGNORE INTO tokens (word, ngram_size) VALUES (?, ?)", rows
+    )
+
 
 def generate_ngrams(tokens, n):
     """Generate n-grams from a list of tokens."""
     return [" ".join(tokens[i : i + n]) for i in range(len(tokens) - n + 1)]
 
 
-def process_page(page):
-    """Process a single page and insert its data into the database."""
-    url = page["url"]
+def analyze_page(page):
+    """
+    Tokenize, stem and count the terms of a page. Does not touch the database, so it
+    can run in worker processes (see `add_pages`).
+
+    Args:
+        page (dict): A page as described in `add_pages`. If it has an "html" key
+                     instead of "title" and "body_text", the HTML is parsed first.
+
+    Returns:
+        dict: The page's metadata ("url", "title", "last_modified", "size", "etag",
+              "parent_url", "body_text") plus, for "title" and "body", the stems
+              ("<field>_stems"), term frequencies ("<field>_term_frequency") and
+              positions ("<field>_positions"), the (stem, frequency) keywords of
+              the page ("top_keywords"), the set of ("token", ngram_size)
+              pairs for the tokens table ("tokens"), the set of (token, stem)
+              pairs for the stems table ("stems") and the links found in the
+              HTML, if it was parsed ("child_links").
+    """
+    child_links = []
+    if "html" in page and "body_text" not in page:
+        parsed = parse_webpage(page["html"], page["url"])
+        page = {**page, "title": parsed["title"], "body_text": parsed["body_text"]}
+        child_links = parsed["urls"]
+
     title = page["title"]
-    last_modified = datetime.strptime(page["last_modified"], "%a, %d %b %Y %H:%M:%S %Z")
-    # last_modified = datetime.strptime(page["last_modified"], "%Y-%m-%d %H:%M:%S")
-    parent_url = page["parent_url"]
     body_text = page["body_text"]
-    # size = len(body_text)
-    size = page["size"]
 
-    # Insert URL and forward index
-    insert_url(url)
-    insert_page_information(url, title, last_modified, size)
-    insert_foward_index(url, body_text)
-    insert_title_foward_index(url, title)
+    # Tokenize and stem each text once, everything below is derived from the stems
+    title_tokens = indexer.tokenize(title)
+    body_tokens = indexer.tokenize(body_text)
+    title_stems = indexer.stem(title_tokens)
+    body_stems = indexer.stem(body_tokens)
 
-    # Insert page relationship if parent_url exists
-    insert_page_relationship(parent_url, url)
+    # Unigrams, then n-grams (for n=2 and n=3) of the title and of the body
+    tokens = {(stem, 1) for stem in title_stems + body_stems}
+    for n in [2, 3]:
+        for stems in (title_stems, body_stems):
+            if len(stems) >= n:
+                tokens.update((ngram, n) for ngram in generate_ngrams(stems, n))
 
-    # Index the page content
-    indexer.index_page(url, title, body_text)
+    title_term_frequency = calculate_term_frequency(title_stems)
+    body_term_frequency = calculate_term_frequency(body_stems)
 
-    # Get the indexed data
-    title_stems = indexer.stem(indexer.tokenize(title))
-    body_stems = indexer.stem(indexer.tokenize(body_text))
+    return {
+        "url": page["url"],
+        "title": title,
+        "last_modified": datetime.strptime(
+            page["last_modified"], "%a, %d %b %Y %H:%M:%S %Z"
+        ),
+        "size": page["size"],
+        "etag": page.get("etag"),
+        "parent_url": page["parent_url"],
+        "body_text": body_text,
+        "title_stems": title_stems,
+        "body_stems": body_stems,
+        "title_term_frequency": title_term_frequency,
+        "body_term_frequency": body_term_frequency,
+        "title_positions": indexer.positions(title_stems),
+        "body_positions": indexer.positions(body_stems),
+        "top_keywords": get_top_keywords(title_term_frequency, body_term_frequency),
+        "tokens": tokens,
+        "stems": set(zip(title_tokens, title_stems)) | set(zip(body_tokens, body_stems)),
+        "child_links": child_links,
+    }
+
+
+def write_pages(analyses):
+    """
+    Insert a batch of analyzed pages into the database, with one executemany per table.
 
-    # Insert title and body into the page_stemmed_word and page_stemmed_title tables
-    cursor.execute(
-        """INSERT INTO page_stemmed_title (url, stemmed_title) VALUES (?, ?)""",
-        (url, " ".join(title_stems)),
+    Args:
+        analyses (list[dict]): Pages returned by `analyze_page`.
+
+    Returns:
+        set: The tokens whose frequency may have changed, see
+             `database.token_frequencies.refresh_token_frequencies`.
+    """
+    # If a page appears twice in the batch, its last version wins
+    analyses = list({analysis["url"]: analysis for analysis in analyses}.values())
+
+    # Number the pages (and their parents) and every stem of the batch
+    doc_ids = insert_documents(
+        [a["url"] for a in analyses] + [a["parent_url"] for a in analyses if a["parent_url"]]
     )
-    cursor.execute(
-        """INSERT INTO page_stemmed_word (url, stemmed_word) VALUES (?, ?)""",
-        (url, " ".join(body_stems)),
+    term_ids = insert_terms(
+        stem
+        for a in analyses
+        for field in ("title", "body")
+        for stem in a[f"{field}_term_frequency"]
     )
+    for a in analyses:
+        a["doc_id"] = doc_ids[a["url"]]
+
+    # Insert forward index
+    insert_page_information(
+        [
+            (a["doc_id"], a["title"], a["last_modified"], a["size"], a["etag"])
+            for a in analyses
+        ]
+    )
+    insert_foward_index([(a["doc_id"], a["body_text"]) for a in analyses])
+    insert_title_foward_index([(a["doc_id"], a["title"]) for a in analyses])
 
-    # Culate term frequency for title and body
-    title_term_frequency = calculate_term_frequency(title_stems)
-    body_term_frequency = calculate_term_frequency(body_stems)
+    # Insert page relationship if parent_url exists
+    insert_page_relationships(
+        [(doc_ids[a["parent_url"]], a["doc_id"]) for a in analyses if a["parent_url"]]
+    )
+
+    # Insert title and body into the page_stemmed_word and page_stemmed_title tables
+    insert_stemmed_text(
+        [(a["doc_id"], a["title_stems"], a["body_stems"]) for a in analyses]
+    )
+
+    # Drop stems the pages no longer contain and track document frequencies
+    removed_term_ids = {}
+    for field in ("title", "body"):
+        removed_term_ids[field] = replace_page_terms(
+            field,
+            [
+                (
+                    a["doc_id"],
+                    {
+                        term_ids[stem]: tf
+                        for stem, tf in a[f"{field}_term_frequency"].items()
+                    },
+                )
+                for a in analyses
+            ],
+        )
+
+    # Store the positions of each stem
+    insert_positions(
+        [
+            (term_ids[stem], a["doc_id"], positions)
+            for a in analyses
+            for stem, positions in a["title_positions"].items()
+        ],
+        [
+            (term_ids[stem], a["doc_id"], positions)
+            for a in analyses
+            for stem, positions in a["body_positions"].items()
+        ],
+    )
 
     # Insert title words and inverted index, and body words and inverted index
-    insert_titles_and_titl_inverted_index(url, title_term_frequency)
-    insert_words_and_inverted_index(url, body_term_frequency)
+    insert_titles_and_titl_inverted_index(
+        [
+            (term_ids[stem], a["doc_id"], tf)
+            for a in analyses
+            for stem, tf in a["title_term_frequency"].items()
+        ]
+    )
+    insert_words_and_inverted_index(
+        [
+            (term_ids[stem], a["doc_id"], tf)
+            for a in analyses
+            for stem, tf in a["body_term_frequency"].items()
+        ]
+    )
+
+    # Store the keywords shown with the search results
+    insert_top_keywords(
+        [a["doc_id"] for a in analyses],
+        [
+            (a["doc_id"], term_ids[keyword], frequency)
+            for a in analyses
+            for keyword, frequency in a["top_keywords"]
+        ],
+    )
 
-    ###############################################################
     # Here handle token and n-grams
+    insert_tokens({token for a in analyses for token in a["tokens"]})
 
-    # Get the tokenized data
-    title_tokens = indexer.stem(indexer.tokenize(title))
-    body_tokens = indexer.stem(indexer.tokenize(body_text))
+    # Remember the stem of every token, see `database.stemmer.load_stem_table`
+    insert_stems({pair for a in analyses for pair in a["stems"]})
 
-    # Calculate term frequencies for all tokens (including n-grams)
-    term_frequencies = defaultdict(int)
-    all_stems = title_stems + body_stems
+    # The new tokens, and the stems added to or removed from a page body
+    changed_tokens = {token for a in analyses for token, _ in a["tokens"]}
+    changed_tokens.update(get_terms(removed_term_ids["body"]).values())
+    return changed_tokens
 
-    # Add unigrams (single words)
-    for stem in all_stems:
-        term_frequencies[stem] += 1
 
-    # Generate and add n-grams (for n=2 and n=3)
-    for n in [2, 3]:
-        # Generate n-grams from title
-        if len(title_tokens) >= n:
-            title_ngrams = generate_ngrams(title_tokens, n)
-            for ngram in title_ngrams:
-                term_frequencies[(ngram, n)] += 1
+def process_page(page):
+    """Process a single page and insert its data into the database."""
+    write_pages([analyze_page(page)])
 
-        # Generate n-grams from body
-        if len(body_tokens) >= n:
-            body_ngrams = generate_ngrams(body_tokens, n)
-            for ngram in body_ngrams:
-                term_frequencies[(ngram, n)] += 1
 
-    insert_tokens(url, term_frequencies)
+def compute_word_and_title_statistics():
+    """
+    Compute and insert word and title statistics into the database.
+
+    Document frequencies and the maximum term frequency of each page are computed once
+    with GROUP BY queries, then every TF-IDF row is written with a single executemany,
+    together with the vector norms of each page.
+    """
+    total_documents = get_total_documents()
+    body_sum_of_squares = insert_field_statistics("body", total_documents)
+    title_sum_of_squares = insert_field_statistics("title", total_documents)
+
+    # Store the vector magnitudes used by cosine similarity
+    doc_ids = [
+        doc_id for (doc_id,) in cursor.execute("SELECT doc_id FROM documents").fetchall()
+    ]
+    cursor.execute("DELETE FROM document_norms")
+    cursor.executemany(
+        "INSERT INTO document_norms (doc_id, body_norm, title_norm) VALUES (?, ?, ?)",
+        (
+            (
+                doc_id,
+                body_sum_of_squares.get(doc_id, 0.0) ** 0.5,
+                title_sum_of_squares.get(doc_id, 0.0) ** 0.5,
+            )
+            for doc_id in doc_ids
+        ),
+    )
+    insert_max_weights("body")
+    insert_max_weights("title")
 
+    # Start measuring drift from this refresh
+    set_metadata("statistics_document_count", total_documents)
+    set_metadata("statistics_changed_documents", 0)
+    bump_index_generation()
 
-def compute_word_and_title_statistics():
-    """Compute and insert word and title statistics into the database."""
-    cursor.execute("SELECT DISTINCT url FROM urls")
-    urls = cursor.fetchall()
-
-    for (url,) in urls:
-        # Get the term frequency for the body text from inverted_index
-        words_tf = cursor.execute(
-            "SELECT word, term_frequency FROM inverted_index WHERE url = ?", (url,)
-        ).fetchall()
 
-        # Get the term frequency for the title from title_inverted_index
-        titles_tf = cursor.execute(
-            "SELECT title, term_frequency FROM title_inverted_index WHERE url = ?",
-            (url,),
-        ).fetchall()
+def statistics_drift_exceeds(
+    changed_documents, drift_threshold=STATISTICS_DRIFT_THRESHOLD
+):
+    """
+    Check whether the IDF drifted too far since the last full statistics refresh.
+
+    Args:
+        changed_documents (int): The number of pages changed since the last full
+                                 refresh.
+        drift_threshold (float): The fraction of changed pages that triggers a
+                                 full refresh.
+
+    Returns:
+        bool: True if a full refresh is due, or if there never was one.
+    """
+    refreshed_document_count = get_metadata("statistics_document_count")
+    return (
+        refreshed_document_count is None
+        or changed_documents > drift_threshold * refreshed_document_count
+    )
+
+
+def update_statistics(
+    doc_ids, changed_documents=None, drift_threshold=STATISTICS_DRIFT_THRESHOLD
+):
+    """
+    Incrementally update word and title statistics after some pages changed.
+
+    Only the TF-IDF values and norms of the given pages are recomputed, using the
+    current document frequencies. The IDF of the other pages is left as is until
+    the number of pages changed since the last full refresh exceeds
+    `drift_threshold` of the collection, at which point everything is recomputed.
+
+    Args:
+        doc_ids (Iterable[int]): The pages that were added or re-indexed.
+        changed_documents (int, optional): How many pages changed, including removed
+                                           ones. Defaults to the number of `doc_ids`.
+        drift_threshold (float): The fraction of changed pages that triggers a
+                                 full refresh.
+
+    Returns:
+        bool: True if a full refresh was performed, False otherwise.
+    """
+    doc_ids = list(doc_ids)
+    if changed_documents is None:
+        changed_documents = len(doc_ids)
+
+    changed_documents += get_metadata("statistics_changed_documents", 0)
+    if statistics_drift_exceeds(changed_documents, drift_threshold):
+        compute_word_and_title_statistics()
+        return True
+
+    total_documents = get_total_documents()
+    body_sum_of_squares = update_field_statistics("body", total_documents, doc_ids)
+    title_sum_of_squares = update_field_statistics("title", total_documents, doc_ids)
+    cursor.executemany(
+        """
+        INSERT INTO document_norms (doc_id, body_norm, title_norm)
+        VALUES (?, ?, ?)
+        ON CONFLICT(doc_id) DO UPDATE SET
+            body_norm=excluded.body_norm,
+            title_norm=excluded.title_norm
+        """,
+        [
+            (
+                doc_id,
+                body_sum_of_squares[doc_id] ** 0.5,
+                title_sum_of_squares[doc_id] ** 0.5,
+            )
+            for doc_id in doc_ids
+        ],
+    )
+    insert_max_weights("body", doc_ids)
+    insert_max_weights("title", doc_ids)
 
-        # Convert the list of tuples to a dictionary
-        words_tf_dict = {word: tf for word, tf in words_tf}
-        titles_tf_dict = {title: tf for title, tf in titles_tf}
+    set_metadata("statistics_changed_documents", changed_documents)
+    bump_index_generation()
+    return False
+
+
+def remove_pages(urls, drift_threshold=STATISTICS_DRIFT_THRESHOLD):
+    """
+    Remove pages (e.g. ones that disappeared during a recrawl) from the database.
 
-        # Get maxTF of word for this document
-        max_word_tf = max(words_tf_dict.values()) if words_tf_dict else 0
-        # Get maxTF of title for this document
-        max_title_tf = max(titles_tf_dict.values()) if titles_tf_dict else 0
+    Args:
+        urls (list[str]): The pages to remove. URLs that are not stored are ignored.
+        drift_threshold (float): See `update_statistics`.
+    """
+    doc_ids = get_doc_ids(urls)
+    if not doc_ids:
+        return
+
+    removed_body_term_ids = set()
+    for doc_id in doc_ids.values():
+        for field, tables in STATISTICS_FIELDS.items():
+            term_ids = [
+                term_id
+                for (term_id,) in cursor.execute(
+                    f"SELECT term_id FROM {tables['inverted_index']} WHERE doc_id = ?",
+                    (doc_id,),
+                ).fetchall()
+            ]
+            remove_page_terms(field, doc_id, term_ids)
+            if field == "body":
+                removed_body_term_ids.update(term_ids)
+
+        for table in (
+            "page_information",
+            "forward_index",
+            "title_forward_index",
+            "page_stemmed_word",
+            "page_stemmed_title",
+            "document_norms",
+            "page_top_keywords",
+            "page_rank",
+            "documents",
+        ):
+            cursor.execute(f"DELETE FROM {table} WHERE doc_id = ?", (doc_id,))
+        cursor.execute(
+            "DELETE FROM page_relationships WHERE parent_id = ? OR child_id = ?",
+            (doc_id, doc_id),
+        )
+        record_link_changes(cursor.rowcount)
 
-        # Insert word statistics
-        insert_word_statistics(url, words_tf_dict, max_word_tf)
-        # Insert title statistics
-        insert_title_statistics(url, titles_tf_dict, max_title_tf)
+    refresh_token_frequencies(get_terms(removed_body_term_ids).values())
+    update_statistics([], len(doc_ids), drift_threshold)
+    connection.commit()
 
 
 '''
@@ -385,10 +892,22 @@ def process_page(page):
 '''
 
 
-def add_pages(pages: list[dict]):
+def add_pages(
+    pages: list[dict],
+    incremental: bool = False,
+    drift_threshold: float = STATISTICS_DRIFT_THRESHOLD,
+    batch_size: int = INDEXING_BATCH_SIZE,
+    analysis_pool: Optional[Executor] = None,
+    analyzed: bool = False,
+):
     """
     Add multiple webpages to the database.
 
+    Pages are analyzed and then written `batch_size` at a time with executemany, all
+    within a single transaction. With an `analysis_pool`, the parsing, stemming and
+    counting of `analyze_page` runs in its worker processes while this process stays
+    the only one writing to SQLite.
+
     Args:
         pages (list[dict]): A list of dictionaries, each containing the following keys:
             - body_text (str): The main content of the page to be added.
@@ -399,14 +918,54 @@ def add_pages(pages: list[dict]):
             - title (str): The title of the page to be added.
             - url (str): The URL of the page to be added.
             - size (int): The size of the page.
+            - etag (str, optional): The ETag header of the page, if the server sent one.
+            The title and body_text can be replaced by the raw page as "html".
+        incremental (bool): Only recompute the statistics of the added pages, see
+                            `update_statistics`. Otherwise the statistics of every
+                            page are recomputed.
+        drift_threshold (float): See `update_statistics`.
+        batch_size (int): The number of pages written per batch of executemany calls.
+        analysis_pool (Executor, optional): A process pool (e.g. a
+                                            `concurrent.futures.ProcessPoolExecutor`)
+                                            to analyze the pages on several cores.
+        analyzed (bool): The pages were already analyzed by `analyze_page` (e.g. by
+                         the crawler, see `crawler.fetch_and_save_pages.parse_page`)
+                         and are written as they are.
 
     Returns:
         None: This function does not return any value.
     """
-    for page in pages:
-        process_page(page)
+    set_indexing_pragmas()
+
+    if analyzed:
+        analyses = pages
+    elif analysis_pool is None:
+        analyses = map(analyze_page, pages)
+    else:
+        analyses = analysis_pool.map(analyze_page, pages, chunksize=ANALYSIS_CHUNK_SIZE)
+
+    urls = []
+    changed_tokens = set()
+    batch = []
+    for analysis in analyses:
+        batch.append(analysis)
+        urls.append(analysis["url"])
+        if len(batch) >= batch_size:
+            changed_tokens |= write_pages(batch)
+            batch = []
+    if batch:
+        changed_tokens |= write_pages(batch)
 
     # Compute and insert word and title statistics
-    compute_word_and_title_statistics()
+    if incremental:
+        doc_ids = get_doc_ids(urls)
+        refresh_token_frequencies(changed_tokens)
+        # A page added twice is one changed page
+        update_statistics(
+            [doc_ids[url] for url in dict.fromkeys(urls)], drift_threshold=drift_threshold
+        )
+    else:
+        refresh_token_frequencies()
+        compute_word_and_title_statistics()
 
     connection.commit()
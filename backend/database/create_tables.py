@@ -1,4 +1,6 @@
 from database.db import connection, cursor
+from database.migrations import get_schema_version, get_table_names, migrate_v1_to_v2
+from database.token_frequencies import refresh_token_frequencies
 
 
 def create_tables():
@@ -6,13 +8,22 @@ def create_tables():
     Create tables in the database by reading SQL statements from creates.sql.
 
     This function reads the SQL statements from the tables.sql file and
-    executes them to create the necessary tables in the database.
+    executes them to create the necessary tables in the database. A database
+    created with the version 1 (URL/word keyed) schema is migrated in place, and
+    tables added to the schema since a database was created are filled.
     """
     try:
         with open("tables.sql", "r") as file:
             sql_statements = file.read()
 
-        cursor.executescript(sql_statements)
+        existing_tables = get_table_names()
+        if get_schema_version() == 1:
+            migrate_v1_to_v2(sql_statements)
+        else:
+            cursor.executescript(sql_statements)
+
+        if "token_frequencies" not in existing_tables:
+            refresh_token_frequencies()
         connection.commit()
 
     except Exception as e:
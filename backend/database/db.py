@@ -1,6 +1,50 @@
 import os
 import sqlite3
 
+# Maximum number of bound parameters used in a single "IN (...)" query.
+# SQLite builds before 3.32 reject statements with more than 999 variables.
+MAX_QUERY_PARAMETERS = 500
+
+# The database file, relative to the backend directory unless absolute. Tests point it
+# to a scratch file through the SEARCH_ENGINE_DB environment variable.
+DATABASE_PATH = os.environ.get("SEARCH_ENGINE_DB", "documents.db")
+
 # Global variables for easy access
-connection = sqlite3.connect("documents.db", check_same_thread=False)
+connection = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
 cursor = connection.cursor()
+
+
+def chunked(items, size=MAX_QUERY_PARAMETERS):
+    """
+    Split a list into consecutive chunks of at most `size` items.
+
+    Args:
+        items (list): The items to split.
+        size (int): The maximum chunk size.
+
+    Returns:
+        Iterator[list]: The chunks, in order.
+    """
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def set_indexing_pragmas(cache_size_kb=65536):
+    """
+    Tune the database for bulk writes while indexing.
+
+    WAL lets the crawler and the search server keep reading while pages are being
+    written, and synchronous=NORMAL only syncs at checkpoints instead of every commit.
+
+    Args:
+        cache_size_kb (int): The page cache size of the indexing connection, in KiB.
+    """
+    # The journal mode cannot be changed inside a transaction
+    if not connection.in_transaction:
+        connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA cache_size=-{cache_size_kb}")
+
+# Separate connection for the crawler's lookups, so pages can be crawled on one
+# thread while another thread writes them to the index through `connection`
+crawler_connection = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
@@ -0,0 +1,100 @@
+from database.db import chunked, cursor
+
+"""
+Lookups into the documents and terms dictionaries, which give every URL and stem the
+integer id used by the rest of the schema (see tables.sql).
+"""
+
+
+def get_ids(table, key_column, id_column, keys):
+    """
+    Look up the ids of the given keys in a dictionary table.
+
+    Args:
+        table (str): "documents" or "terms".
+        key_column (str): The column holding the keys ("url" or "term").
+        id_column (str): The column holding the ids ("doc_id" or "term_id").
+        keys (Iterable[str]): The keys to look up.
+
+    Returns:
+        dict: A mapping of key -> id. Unknown keys are omitted.
+    """
+    ids = {}
+    for chunk in chunked(list(set(keys))):
+        placeholders = ", ".join("?" * len(chunk))
+        ids.update(
+            cursor.execute(
+                f"""SELECT {key_column}, {id_column} FROM {table}
+                    WHERE {key_column} IN ({placeholders})""",
+                chunk,
+            )
+        )
+    return ids
+
+
+def get_doc_ids(urls):
+    """Get a mapping of url -> doc_id for the known URLs among `urls`."""
+    return get_ids("documents", "url", "doc_id", urls)
+
+
+def get_term_ids(terms):
+    """Get a mapping of term -> term_id for the known stems among `terms`."""
+    return get_ids("terms", "term", "term_id", terms)
+
+
+def insert_documents(urls):
+    """
+    Add URLs to the documents table if they are not there yet.
+
+    Returns:
+        dict: A mapping of url -> doc_id for every URL in `urls`.
+    """
+    # New ids are given in the order of `urls`
+    urls = list(dict.fromkeys(urls))
+    cursor.executemany(
+        "INSERT OR IGNORE INTO documents (url) VALUES (?)", [(url,) for url in urls]
+    )
+    return get_doc_ids(urls)
+
+
+def insert_terms(terms):
+    """
+    Add stems to the terms table if they are not there yet.
+
+    Returns:
+        dict: A mapping of term -> term_id for every stem in `terms`.
+    """
+    # New ids are given in the order of `terms`
+    terms = list(dict.fromkeys(terms))
+    cursor.executemany(
+        "INSERT OR IGNORE INTO terms (term) VALUES (?)", [(term,) for term in terms]
+    )
+    return get_term_ids(terms)
+
+
+def get_urls(doc_ids):
+    """Get a mapping of doc_id -> url for the given document ids."""
+    urls = {}
+    for chunk in chunked(list(set(doc_ids))):
+        placeholders = ", ".join("?" * len(chunk))
+        urls.update(
+            cursor.execute(
+                f"SELECT doc_id, url FROM documents WHERE doc_id IN ({placeholders})",
+                chunk,
+            )
+        )
+    return urls
+
+
+def get_terms(term_ids):
+    """Get a mapping of term_id -> term for the given term ids."""
+    terms = {}
+    for chunk in chunked(list(set(term_ids))):
+        placeholders = ", ".join("?" * len(chunk))
+        terms.update(
+            cursor.execute(
+                f"SELECT term_id, term FROM terms WHERE term_id IN ({placeholders})",
+                chunk,
+            )
+        )
+    return terms
@@ -2,21 +2,18 @@ import re
 from collections import defaultdict
 
 # from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
+from database.stemmer import stem_word
 
 
 class Indexer:
     def __init__(self):
-        """Initialize the Indexer with stopwords and a stemmer."""
+        """Initialize the Indexer with stopwords."""
 
         self.stop_words = None
         with open("database/stopwords.txt", "r") as file:
             self.stop_words = set(file.read().split())
 
         # self.stop_words = set(stopwords.words("english"))
-        self.stemmer = PorterStemmer()
-        self.body_index = defaultdict(list)
-        self.title_index = defaultdict(list)
 
     def tokenize(self, text):
         """
@@ -34,7 +31,7 @@ class Indexer:
 
     def stem(self, tokens):
         """
-        Stem a list of tokens using the Porter Stemmer.
+        Stem a list of tokens using the cached Porter Stemmer (see `database.stemmer`).
 
         Args:
             tokens (list): A list of tokens to stem.
@@ -42,7 +39,22 @@ class Indexer:
         Returns:
             list: A list of stemmed tokens.
         """
-        return [self.stemmer.stem(token) for token in tokens]
+        return [stem_word(token) for token in tokens]
+
+    def positions(self, stems):
+        """
+        Record the positions at which each stem occurs.
+
+        Args:
+            stems (list): A list of stemmed tokens, in document order.
+
+        Returns:
+            dict: A mapping of stem -> sorted list of positions.
+        """
+        positions = defaultdict(list)
+        for position, stem in enumerate(stems):
+            positions[stem].append(position)
+        return positions
 
     def index_page(self, page_id, title, body):
         """
@@ -52,6 +64,10 @@ class Indexer:
             page_id (str): The unique identifier (URL) of the page.
             title (str): The title of the page.
             body (str): The body text of the page.
+
+        Returns:
+            tuple[dict, dict]: The positions of each stem in the title and in the
+                               body, as returned by `positions`.
         """
         title_tokens = self.tokenize(title)
         body_tokens = self.tokenize(body)
@@ -59,10 +75,4 @@ class Indexer:
         title_stems = self.stem(title_tokens)
         body_stems = self.stem(body_tokens)
 
-        # Index title stems
-        for stem in title_stems:
-            self.title_index[stem].append(page_id)
-
-        # Index body stems
-        for stem in body_stems:
-            self.body_index[stem].append(page_id)
+        return self.positions(title_stems), self.positions(body_stems)
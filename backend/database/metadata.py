@@ -0,0 +1,99 @@
+import threading
+
+from database.db import cursor
+
+
+def get_metadata(key, default=None):
+    """
+    Read a value from the index_metadata table.
+
+    Args:
+        key (str): The name of the value.
+        default: What to return if the key has never been set.
+
+    Returns:
+        The stored value, or `default`.
+    """
+    cursor.execute("SELECT value FROM index_metadata WHERE key = ?", (key,))
+    result = cursor.fetchone()
+    return default if result is None else result[0]
+
+
+def set_metadata(key, value):
+    """
+    Insert or update a value in the index_metadata table.
+
+    Args:
+        key (str): The name of the value.
+        value: The value to store (int, float or str).
+    """
+    cursor.execute(
+        """
+        INSERT INTO index_metadata (key, value)
+        VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET
+            value=excluded.value
+        """,
+        (key, value),
+    )
+
+
+def get_index_generation():
+    """
+    Get the index generation, which changes every time the index is modified.
+
+    Returns:
+        int: The current generation, 0 if the index was never modified.
+    """
+    return get_metadata("index_generation", 0)
+
+
+def bump_index_generation():
+    """
+    Mark the index as modified, invalidating everything cached from it (e.g. the
+    /search result cache). Takes effect when the transaction is committed.
+    """
+    cursor.execute(
+        """
+        INSERT INTO index_metadata (key, value)
+        VALUES ('index_generation', 1)
+        ON CONFLICT(key) DO UPDATE SET
+            value=value + 1
+        """
+    )
+
+
+class GenerationCache:
+    """
+    A value built from the index on first use, and rebuilt after every index change,
+    such as the in-memory indexes of the API.
+    """
+
+    def __init__(self, build):
+        """
+        Args:
+            build (Callable[[sqlite3.Cursor, int], Any]): Builds the value, from a
+                                                          cursor and the index
+                                                          generation it is read at.
+        """
+        self.build = build
+        self.value = None
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def get(self, cursor):
+        """
+        Get the value of the current index generation.
+
+        Args:
+            cursor (sqlite3.Cursor): The cursor used to build the value.
+
+        Returns:
+            The value returned by `build`.
+        """
+        generation = get_index_generation()
+        with self.lock:
+            if self.value is None or self.generation != generation:
+                self.value = self.build(cursor, generation)
+                self.generation = generation
+            return self.value
@@ -0,0 +1,261 @@
+from collections import defaultdict
+
+from database.add_pages import (
+    compute_word_and_title_statistics,
+    get_top_keywords,
+    indexer,
+    insert_positions,
+    insert_top_keywords,
+)
+from database.db import connection, cursor
+from database.dictionary import insert_terms
+
+"""
+Upgrades of existing databases to the schema in tables.sql.
+
+The schema version is stored in `PRAGMA user_version`. Version 1 databases predate
+it (their user_version is 0) and are recognized by their urls table.
+"""
+
+SCHEMA_VERSION = 2
+
+# The version 1 tables, with their columns that held a URL and the version 2 column
+# holding its doc_id instead. The urls table is replaced by documents.
+V1_URL_COLUMNS = {
+    "urls": {"url": "doc_id"},
+    "page_relationships": {"parent_url": "parent_id", "child_url": "child_id"},
+    "words": {},
+    "titles": {},
+    "page_information": {"url": "doc_id"},
+    "forward_index": {"url": "doc_id"},
+    "inverted_index": {"url": "doc_id"},
+    "title_forward_index": {"url": "doc_id"},
+    "title_inverted_index": {"url": "doc_id"},
+    "word_statistics": {"url": "doc_id"},
+    "title_statistics": {"url": "doc_id"},
+    "positional_index": {"url": "doc_id"},
+    "title_positional_index": {"url": "doc_id"},
+    "document_norms": {"url": "doc_id"},
+    "document_frequency": {},
+    "title_document_frequency": {},
+    "word_max_weight": {},
+    "title_max_weight": {},
+    "page_rank": {"url": "doc_id"},
+    "page_top_keywords": {"url": "doc_id"},
+    "page_stemmed_word": {"url": "doc_id"},
+    "page_stemmed_title": {"url": "doc_id"},
+}
+
+# The version 1 tables that held a stem, and its column. It becomes term_id.
+V1_TERM_COLUMNS = {
+    "words": "word",
+    "titles": "title",
+    "inverted_index": "word",
+    "title_inverted_index": "title",
+    "word_statistics": "word",
+    "title_statistics": "title",
+    "positional_index": "word",
+    "title_positional_index": "title",
+    "document_frequency": "word",
+    "title_document_frequency": "title",
+    "word_max_weight": "word",
+    "title_max_weight": "title",
+    "page_top_keywords": "keyword",
+}
+
+
+def get_table_names():
+    """Get the names of the tables of the database."""
+    return {
+        name
+        for (name,) in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+
+
+def get_schema_version():
+    """
+    Get the schema version of the database.
+
+    Returns:
+        int: 0 for an empty database, 1 for a URL/word keyed database, otherwise
+             the stored user_version.
+    """
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version == 0 and "urls" in get_table_names():
+        return 1
+    return version
+
+
+def copy_v1_table(table):
+    """
+    Build the statement copying a renamed version 1 table ("<table>_v1") into its
+    version 2 table, replacing URLs and stems with their ids. Rows keep their order.
+    """
+    url_columns = V1_URL_COLUMNS[table]
+    term_column = V1_TERM_COLUMNS.get(table)
+
+    columns, values, joins = [], [], []
+    for _, column, *_ in cursor.execute(f"PRAGMA table_info({table})").fetchall():
+        if column in url_columns:
+            columns.append(url_columns[column])
+            values.append(f"{column}.doc_id")
+            joins.append(f"JOIN documents {column} ON {column}.url = old.{column}")
+        elif column == term_column:
+            columns.append("term_id")
+            values.append("term.term_id")
+            joins.append(f"JOIN terms term ON term.term = old.{column}")
+        else:
+            columns.append(column)
+            values.append(f"old.{column}")
+
+    return f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        SELECT {", ".join(values)} FROM {table}_v1 old {" ".join(joins)}
+        ORDER BY old.rowid;
+    """
+
+
+# The version 1 tables every derived table can be rebuilt from
+V1_REQUIRED_TABLES = [
+    "urls",
+    "inverted_index",
+    "title_inverted_index",
+    "page_stemmed_word",
+    "page_stemmed_title",
+]
+
+# Number of pages whose positions are written with one executemany
+POSITIONS_BATCH_SIZE = 100
+
+
+def rebuild_positional_indexes():
+    """
+    Fill both positional indexes from the stemmed text of each page (the stems of
+    the page_stemmed_word and page_stemmed_title tables, in document order, which
+    is what `database.add_pages.analyze_page` numbers the positions of).
+    """
+    # Read through a separate cursor, the shared one runs the inserts
+    pages = connection.execute(
+        """SELECT doc_id, t.stemmed_title, w.stemmed_word
+           FROM page_stemmed_word w LEFT JOIN page_stemmed_title t USING (doc_id)"""
+    )
+    while True:
+        batch = pages.fetchmany(POSITIONS_BATCH_SIZE)
+        if not batch:
+            break
+        title_positions = [
+            (doc_id, indexer.positions((title or "").split()))
+            for doc_id, title, _ in batch
+        ]
+        body_positions = [
+            (doc_id, indexer.positions(body.split())) for doc_id, _, body in batch
+        ]
+        term_ids = insert_terms(
+            stem
+            for _, positions in title_positions + body_positions
+            for stem in positions
+        )
+        insert_positions(
+            [
+                (term_ids[stem], doc_id, stem_positions)
+                for doc_id, positions in title_positions
+                for stem, stem_positions in positions.items()
+            ],
+            [
+                (term_ids[stem], doc_id, stem_positions)
+                for doc_id, positions in body_positions
+                for stem, stem_positions in positions.items()
+            ],
+        )
+
+
+def rebuild_top_keywords():
+    """Fill page_top_keywords from the term frequencies of every page."""
+    term_frequencies = defaultdict(lambda: ({}, {}))  # doc_id -> (title, body)
+    term_ids = {}
+    for field, table in enumerate(("title_inverted_index", "inverted_index")):
+        rows = cursor.execute(
+            f"""SELECT i.doc_id, t.term, i.term_id, i.term_frequency FROM {table} i
+                JOIN terms t USING (term_id)"""
+        )
+        for doc_id, term, term_id, term_frequency in rows:
+            term_frequencies[doc_id][field][term] = term_frequency
+            term_ids[term] = term_id
+
+    insert_top_keywords(
+        list(term_frequencies),
+        [
+            (doc_id, term_ids[term], frequency)
+            for doc_id, (title, body) in term_frequencies.items()
+            for term, frequency in get_top_keywords(title, body)
+        ],
+    )
+
+
+def migrate_v1_to_v2(schema, vacuum=True):
+    """
+    Convert a version 1 database in place, in a single transaction.
+
+    The version 1 tables are renamed, the version 2 tables are created from `schema`,
+    the documents and terms dictionaries are filled with every URL and stem, the rows
+    are copied with their ids and the version 1 tables are dropped. The tables that
+    version 1 did not have, or did not fill, are then rebuilt: the positional
+    indexes, the keywords of each page, and every statistic (tf-idf, document
+    frequencies, norms and maximum weights) with a full refresh.
+
+    Args:
+        schema (str): The contents of tables.sql.
+        vacuum (bool): Rebuild the database file afterwards to give the freed
+                       pages back to the file system.
+
+    Raises:
+        RuntimeError: If the database lacks a table needed to rebuild the others.
+                      It is left untouched, and should be recrawled.
+    """
+    table_names = get_table_names()
+    missing_tables = [table for table in V1_REQUIRED_TABLES if table not in table_names]
+    if missing_tables:
+        raise RuntimeError(
+            f"Cannot migrate a database without the {', '.join(missing_tables)} "
+            "table(s), delete it and run crawl_and_save.py again"
+        )
+
+    v1_tables = [table for table in V1_URL_COLUMNS if table in table_names]
+
+    script = ["BEGIN;"]
+    script += [f"ALTER TABLE {table} RENAME TO {table}_v1;" for table in v1_tables]
+    script.append(schema)
+
+    # Number the URLs in the order they were discovered, then the URLs that are
+    # only referenced by other tables
+    for table in v1_tables:
+        for column in V1_URL_COLUMNS[table]:
+            script.append(
+                f"""INSERT OR IGNORE INTO documents (url)
+                    SELECT {column} FROM {table}_v1 ORDER BY rowid;"""
+            )
+    for table in v1_tables:
+        if table in V1_TERM_COLUMNS:
+            script.append(
+                f"""INSERT OR IGNORE INTO terms (term)
+                    SELECT {V1_TERM_COLUMNS[table]} FROM {table}_v1 ORDER BY rowid;"""
+            )
+
+    script += [copy_v1_table(table) for table in v1_tables if table != "urls"]
+    script += [f"DROP TABLE {table}_v1;" for table in v1_tables]
+
+    # The transaction stays open until the derived tables are rebuilt
+    try:
+        cursor.executescript("\n".join(script))
+        rebuild_positional_indexes()
+        rebuild_top_keywords()
+        compute_word_and_title_statistics()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    if vacuum:
+        cursor.execute("VACUUM")
@@ -1,94 +1,198 @@
 import sqlite3
 
-import networkx as nx
+import numpy as np
+from scipy import sparse
 
 from database.db import connection, cursor
+from database.metadata import bump_index_generation, get_metadata, set_metadata
 
+# In incremental mode, PageRank is recomputed from scratch once the number of links
+# added or removed since the last computation exceeds this fraction of all links
+PAGE_RANK_DRIFT_THRESHOLD = 0.1
 
-def custom_pagerank(graph, alpha=0.85, max_iterations=100, tolerance=1.0e-6):
+
+def build_transition_matrix(nodes, edges):
     """
-    Custom implementation of the PageRank algorithm.
+    Build the column-stochastic link matrix of a graph.
 
-    Parameters:
-    - graph: A NetworkX directed graph
-    - alpha: Damping factor (typically 0.85)
-    - max_iterations: Maximum number of iterations
-    - tolerance: Convergence threshold
+    Args:
+        nodes (np.ndarray): The ids of the pages, in ascending order.
+        edges (np.ndarray): (parent, child) id pairs, of shape (E, 2). Both ends
+                            must be in `nodes`.
 
     Returns:
-    - Dictionary mapping nodes to PageRank scores
+        tuple[sparse.csr_matrix, np.ndarray]: The matrix, whose [child, parent] entry
+                                              is 1 / out degree of parent, and a mask
+                                              of the dangling nodes (pages without
+                                              outgoing links).
     """
-    nodes = list(graph.nodes())
     n = len(nodes)
+    # doc_ids are small integers, index them with a lookup table
+    indices = np.zeros(nodes[-1] + 1 if n else 0, dtype=np.int64)
+    indices[nodes] = np.arange(n)
+    parents = indices[edges[:, 0]]
+    children = indices[edges[:, 1]]
+    out_degrees = np.bincount(parents, minlength=n)
+    transition = sparse.csr_matrix(
+        (1.0 / out_degrees[parents], (children, parents)), shape=(n, n)
+    )
+    return transition, out_degrees == 0
+
+
+def sparse_pagerank(nodes, edges, alpha=0.85, max_iterations=100, tolerance=1.0e-6):
+    """
+    PageRank by power iteration over a sparse adjacency matrix.
 
-    # If the graph is empty, return an empty dictionary
-    if n == 0:
-        return {}
+    Each iteration is one sparse matrix-vector product, and the rank of dangling
+    nodes (pages without outgoing links) is spread evenly over all pages.
 
-    # Create a mapping from node names to indices
-    # node_indices = {node: i for i, node in enumerate(nodes)}
+    Args:
+        nodes (np.ndarray): The ids of the pages, in ascending order.
+        edges (np.ndarray): (parent, child) id pairs, of shape (E, 2).
+        alpha (float): The damping factor.
+        max_iterations (int): The maximum number of iterations.
+        tolerance (float): The convergence threshold on the L1 change of the scores.
 
-    # Initialize the PageRank scores (uniform distribution)
-    pr = {node: 1.0 / n for node in nodes}
+    Returns:
+        tuple[np.ndarray, list[float]]: The score of each node, in the order of
+                                        `nodes` and divided by their sum of
+                                        squares, and the L1 change of the scores at
+                                        each iteration.
+    """
+    n = len(nodes)
+    if n == 0:
+        return np.zeros(0), []
 
-    # Precompute outgoing edges for each node
-    outgoing_edges = {}
-    for node in nodes:
-        outgoing = list(graph.successors(node))
-        outgoing_edges[node] = outgoing
+    transition, dangling = build_transition_matrix(nodes, edges)
 
-    # Iterative PageRank calculation
+    pr = np.full(n, 1.0 / n)
+    residuals = []
     for _ in range(max_iterations):
-        next_pr = {node: (1.0 - alpha) / n for node in nodes}
-
-        # Calculate the contribution of each node to its neighbors
-        for node in nodes:
-            out_neighbors = outgoing_edges[node]
-            if out_neighbors:  # If the node has outgoing edges
-                weight = alpha * pr[node] / len(out_neighbors)
-                for neighbor in out_neighbors:
-                    next_pr[neighbor] += weight
-            else:  # Distribute evenly if no outgoing edges (dangling node)
-                weight = alpha * pr[node] / n
-                for target in nodes:
-                    next_pr[target] += weight
+        next_pr = alpha * (transition @ pr)
+        next_pr += (1.0 - alpha + alpha * pr[dangling].sum()) / n
 
         # Check for convergence
-        diff = sum(abs(next_pr[node] - pr[node]) for node in nodes)
+        diff = np.abs(next_pr - pr).sum()
+        residuals.append(diff)
         pr = next_pr
         if diff < tolerance:
             break
 
-    # Normalize scores to sum to 1
-    total = sum(score**2 for score in pr.values())
+    # Normalize scores by their sum of squares
+    total = np.dot(pr, pr)
     print(f"Total PageRank score: {total}")
-    return {node: score / total for node, score in pr.items()}
+    return pr / total, residuals
 
 
-def calculate_page_rank():
-    """Calculate PageRank scores and save them to the database"""
+def incremental_pagerank(
+    nodes, edges, ranks, alpha=0.85, max_iterations=100, tolerance=1.0e-6
+):
+    """
+    Update PageRank scores after some links changed, starting from the stored scores.
+
+    Power iteration runs on the residual (the change one more iteration would make),
+    starting from the stored scores instead of uniform ones. Each iteration is still
+    a sparse matrix-vector product over the whole graph, as in `sparse_pagerank`;
+    the saving is in the number of iterations: the residual is only significant
+    downstream of the changed links (plus a uniform term if the rank held by
+    dangling pages changed), so it falls below `tolerance` sooner.
+
+    Args:
+        nodes (np.ndarray): The ids of the pages, in ascending order.
+        edges (np.ndarray): (parent, child) id pairs, of shape (E, 2).
+        ranks (np.ndarray): The stored score of each node, NaN for new pages.
+        alpha (float): The damping factor.
+        max_iterations (int): The maximum number of iterations.
+        tolerance (float): The convergence threshold on the L1 norm of the residual.
 
-    # Query the page relationships
-    cursor.execute("SELECT parent_url, child_url FROM page_relationships")
-    relationships = cursor.fetchall()
+    Returns:
+        tuple[np.ndarray, list[float]] | None: The scores, normalized as in
+                                               `sparse_pagerank`, and the L1 norm
+                                               of the residual before each
+                                               iteration, or None if they did not
+                                               converge.
+    """
+    n = len(nodes)
+    transition, dangling = build_transition_matrix(nodes, edges)
 
-    # Get all pages (urls)
-    cursor.execute("SELECT url FROM urls")
-    all_pages = [row[0] for row in cursor.fetchall()]
+    # Stored scores are normalized by their sum of squares, power iteration keeps
+    # the scores summing to 1
+    pr = np.where(np.isnan(ranks), (1.0 - alpha) / n, ranks)
+    pr /= pr.sum()
 
-    # Create a directed graph
-    graph = nx.DiGraph()
+    # One step from the stored scores on the current graph
+    residual = alpha * (transition @ pr)
+    residual += (1.0 - alpha + alpha * pr[dangling].sum()) / n
+    residual -= pr
 
-    # Add all pages as nodes (even if they don't have relationships)
-    for page in all_pages:
-        graph.add_node(page)
+    residuals = []
+    for _ in range(max_iterations + 1):
+        residuals.append(np.abs(residual).sum())
+        if residuals[-1] < tolerance:
+            total = np.dot(pr, pr)
+            print(f"Total PageRank score: {total}")
+            return pr / total, residuals
 
-    # Add edges to the graph
-    for parent, child in relationships:
-        graph.add_edge(parent, child)
+        # The next residual is the current one carried along the links
+        pr += residual
+        dangling_residual = residual[dangling].sum()
+        residual = alpha * (transition @ residual) + alpha * dangling_residual / n
 
-    # Calculate PageRank using our custom implementation
-    pagerank_scores = custom_pagerank(graph, alpha=0.85)
+    return None
+
+
+def calculate_page_rank(incremental=False, drift_threshold=PAGE_RANK_DRIFT_THRESHOLD):
+    """
+    Calculate PageRank scores and save them to the database.
+
+    Args:
+        incremental (bool): Update the stored scores with `incremental_pagerank`
+                            instead of recomputing them from scratch. Falls back
+                            to a full computation when there are no stored scores,
+                            when the links changed since they were computed exceed
+                            `drift_threshold` of all links, or when the update does
+                            not converge.
+        drift_threshold (float): See `incremental`.
+
+    Returns:
+        dict: How the scores were computed: "mode" ("incremental" or "full"),
+              "iterations" and "residuals" (the L1 residual at each iteration).
+    """
+    # The page ids, and the links between them as an (E, 2) array
+    rows = cursor.execute("SELECT doc_id FROM documents ORDER BY doc_id")
+    pages = np.fromiter((doc_id for (doc_id,) in rows), dtype=np.int64)
+    relationships = np.fromiter(
+        (
+            doc_id
+            for relationship in cursor.execute(
+                "SELECT parent_id, child_id FROM page_relationships"
+            )
+            for doc_id in relationship
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    result = None
+    if incremental and len(pages):
+        stored = dict(cursor.execute("SELECT doc_id, rank FROM page_rank"))
+        changed_links = get_metadata("page_rank_changed_links", 0)
+        if stored and changed_links <= drift_threshold * max(len(relationships), 1):
+            ranks = np.array([stored.get(page, np.nan) for page in pages.tolist()])
+            result = incremental_pagerank(pages, relationships, ranks, alpha=0.85)
+
+    if result is not None:
+        scores, residuals = result
+        report = {"mode": "incremental", "iterations": len(residuals) - 1}
+    else:
+        scores, residuals = sparse_pagerank(pages, relationships, alpha=0.85)
+        report = {"mode": "full", "iterations": len(residuals)}
+    report["residuals"] = residuals
+    print(
+        f"PageRank ({report['mode']}) converged after {report['iterations']} "
+        f"iterations, final residual {residuals[-1] if residuals else 0.0:.3g}"
+    )
+
+    pagerank_scores = dict(zip(pages.tolist(), scores.tolist()))
 
     # Update the database with PageRank scores
     try:
@@ -96,13 +200,18 @@ def calculate_page_rank():
         cursor.execute("DELETE FROM page_rank")
 
         # Insert new PageRank scores
-        for page, score in pagerank_scores.items():
-            cursor.execute(
-                "INSERT INTO page_rank (url, rank) VALUES (?, ?)", (page, score)
-            )
-
+        cursor.executemany(
+            "INSERT INTO page_rank (doc_id, rank) VALUES (?, ?)",
+            pagerank_scores.items(),
+        )
+
+        # Upper bound of the PageRank factor, used to prune ranking
+        set_metadata("max_page_rank", max(pagerank_scores.values(), default=None))
+        set_metadata("page_rank_changed_links", 0)
+        bump_index_generation()
         connection.commit()
         print(f"PageRank scores calculated and saved for {len(pagerank_scores)} pages")
     except sqlite3.Error as e:
         connection.rollback()
-        print(f"Database error: {e}")
\ No newline at end of file
+        print(f"Database error: {e}")
+    return report
@@ -0,0 +1,136 @@
+"""
+Compressed posting lists, as stored in a compressed index snapshot (see
+`database.snapshot.export_snapshot`).
+
+A posting is a document id and the positions of the term in the document, whose
+count is the term frequency. The postings of a term, sorted by document id, are
+cut into blocks of POSTINGS_BLOCK_SIZE. Each block holds, as LEB128 varints:
+    - the document ids, delta-encoded from the last document id of the previous
+      block (0 for the first block),
+    - the term frequencies,
+    - for each posting in turn, its positions, delta-encoded from 0.
+Next to the blocks, a skip table keeps the last document id and the byte offset of
+every block, so a reader can jump to the block that may contain a document and
+decode that block only, and read the ids and frequencies without the positions.
+"""
+
+# Number of postings per block
+POSTINGS_BLOCK_SIZE = 128
+
+
+def encode_varint(value, out):
+    """Append a non-negative integer to `out` as an LEB128 varint."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(data, offset, count):
+    """
+    Decode consecutive varints.
+
+    Args:
+        data (bytes | memoryview): The encoded bytes.
+        offset (int): Where the first varint starts.
+        count (int): The number of varints to decode.
+
+    Returns:
+        tuple[list[int], int]: The values and the offset after the last one.
+    """
+    values = []
+    for _ in range(count):
+        byte = data[offset]
+        offset += 1
+        value = byte & 0x7F
+        shift = 7
+        while byte & 0x80:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+        values.append(value)
+    return values, offset
+
+
+def encode_postings(postings, out):
+    """
+    Encode the postings of one term at the end of `out`.
+
+    Args:
+        postings (list[tuple[int, list[int]]]): (document id, sorted positions)
+                                                tuples, sorted by document id.
+        out (bytearray): Where to append the blocks.
+
+    Returns:
+        tuple[list[int], list[int]]: The last document id and the start offset in
+                                     `out` of each block.
+    """
+    last_doc_ids = []
+    offsets = []
+    previous_doc_id = 0
+    for start in range(0, len(postings), POSTINGS_BLOCK_SIZE):
+        block = postings[start : start + POSTINGS_BLOCK_SIZE]
+        offsets.append(len(out))
+        for doc_id, _ in block:
+            encode_varint(doc_id - previous_doc_id, out)
+            previous_doc_id = doc_id
+        for _, positions in block:
+            encode_varint(len(positions), out)
+        for _, positions in block:
+            previous_position = 0
+            for position in positions:
+                encode_varint(position - previous_position, out)
+                previous_position = position
+        last_doc_ids.append(previous_doc_id)
+    return last_doc_ids, offsets
+
+
+def decode_block(data, offset, count, previous_doc_id):
+    """
+    Decode the document ids and term frequencies of a block.
+
+    Args:
+        data (bytes | memoryview): The encoded blocks.
+        offset (int): Where the block starts.
+        count (int): The number of postings in the block.
+        previous_doc_id (int): The last document id of the previous block, 0 for
+                               the first block of a term.
+
+    Returns:
+        tuple[list[int], list[int], int]: The document ids, the term frequencies
+                                          and the offset of the block's positions.
+    """
+    deltas, offset = decode_varints(data, offset, count)
+    doc_ids = []
+    for delta in deltas:
+        previous_doc_id += delta
+        doc_ids.append(previous_doc_id)
+    frequencies, offset = decode_varints(data, offset, count)
+    return doc_ids, frequencies, offset
+
+
+def decode_positions(data, offset, frequencies):
+    """
+    Decode the positions of a block.
+
+    Args:
+        data (bytes | memoryview): The encoded blocks.
+        offset (int): The offset returned by `decode_block`.
+        frequencies (list[int]): The term frequencies of the block.
+
+    Returns:
+        list[list[int]]: The positions of each posting of the block.
+    """
+    deltas, _ = decode_varints(data, offset, sum(frequencies))
+    positions = []
+    start = 0
+    for frequency in frequencies:
+        posting_positions = []
+        position = 0
+        for delta in deltas[start : start + frequency]:
+            position += delta
+            posting_positions.append(position)
+        positions.append(posting_positions)
+        start += frequency
+    return positions
@@ -1,6 +1,80 @@
 from datetime import datetime
+from typing import Dict, List
 
-from database.db import connection, cursor
+from database.db import crawler_connection
+
+# The crawler may run on its own thread while pages are being indexed, so it
+# reads through its own connection
+cursor = crawler_connection.cursor()
+
+HTTP_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+
+
+def parse_stored_date(value: str) -> datetime:
+    """
+    Parse a last modified date read from page_information.
+
+    process_page stores a datetime, which sqlite3 writes as "2023-05-16 05:03:16";
+    older rows may hold the raw "Tue, 16 May 2023 05:03:16 GMT" header instead.
+    """
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return datetime.strptime(value, HTTP_DATE_FORMAT)
+
+
+def get_cache_validators(url: str) -> Dict[str, str]:
+    """
+    Build the conditional request headers for a page that was fetched before.
+
+    Args:
+        url (str): The URL of the page.
+
+    Returns:
+        Dict[str, str]: "If-Modified-Since" and/or "If-None-Match" headers built from the
+                        stored last modified date and ETag. Empty if the page is unknown.
+    """
+    cursor.execute(
+        """SELECT p.last_modified_date, p.etag FROM page_information p
+           JOIN documents d USING (doc_id)
+           WHERE d.url = ?""",
+        (url,),
+    )
+    result = cursor.fetchone()
+    if result is None:
+        return {}
+
+    last_modified, etag = result
+    headers = {}
+    if last_modified:
+        headers["If-Modified-Since"] = parse_stored_date(last_modified).strftime(
+            HTTP_DATE_FORMAT
+        )
+    if etag:
+        headers["If-None-Match"] = etag
+    return headers
+
+
+def get_stored_child_links(url: str) -> List[str]:
+    """
+    Get the child links recorded for a page during a previous crawl.
+
+    Used to keep crawling below a page that has not changed, without downloading it.
+
+    Args:
+        url (str): The URL of the page.
+
+    Returns:
+        List[str]: The URLs of the page's children in page_relationships.
+    """
+    cursor.execute(
+        """SELECT child.url FROM page_relationships r
+           JOIN documents parent ON parent.doc_id = r.parent_id
+           JOIN documents child ON child.doc_id = r.child_id
+           WHERE parent.url = ?""",
+        (url,),
+    )
+    return [child_url for (child_url,) in cursor.fetchall()]
 
 
 def should_fetch_page(url: str, last_modified: str) -> bool:
@@ -23,7 +97,12 @@ def should_fetch_page(url: str, last_modified: str) -> bool:
     Returns:
         bool: True if the page should be fetched, False otherwise.
     """
-    cursor.execute("SELECT last_modified_date FROM page_information WHERE url = ?", (url,))
+    cursor.execute(
+        """SELECT p.last_modified_date FROM page_information p
+           JOIN documents d USING (doc_id)
+           WHERE d.url = ?""",
+        (url,),
+    )
     result = cursor.fetchone()
 
     if result is None:
@@ -31,12 +110,8 @@ def should_fetch_page(url: str, last_modified: str) -> bool:
         return True
 
     db_last_modified = result[0]
-    db_last_modified_date = datetime.strptime(
-        db_last_modified, "%a, %d %b %Y %H:%M:%S GMT"
-    )
-    input_last_modified_date = datetime.strptime(
-        last_modified, "%a, %d %b %Y %H:%M:%S GMT"
-    )
+    db_last_modified_date = parse_stored_date(db_last_modified)
+    input_last_modified_date = datetime.strptime(last_modified, HTTP_DATE_FORMAT)
 
     if db_last_modified_date == input_last_modified_date:
         # URL exists and last modified date has not changed
@@ -0,0 +1,297 @@
+import math
+import os
+import struct
+import sys
+from array import array
+
+from database.db import cursor
+from database.metadata import get_index_generation
+from database.postings import encode_postings
+
+"""
+Exports the tables needed to answer /search queries into a compact binary snapshot
+that the API server can mmap instead of querying SQLite.
+
+Layout (all integers little-endian):
+    header:   magic (8 bytes), section count (uint32), index generation (uint64)
+    sections: name (32 bytes, NUL padded), offset (uint64), length (uint64)
+    data:     the section payloads, each aligned to 8 bytes
+
+The index generation is the one of the database when the snapshot was exported (see
+`database.metadata.get_index_generation`), so the server can tell when the snapshot
+falls behind the database.
+
+Documents are numbered by their position in the sorted list of URLs (not by their
+doc_id in the database), so a URL can be turned into a document id by binary search.
+For each field ("title" and "body") the snapshot stores a sorted term dictionary and
+one posting list per term.
+
+Sections:
+    doc_url_offsets (uint32[N + 1]) and doc_urls (utf-8): the sorted URLs
+    page_rank, body_norm, title_norm (float32[N]): per-document values, NaN if missing
+    <field>_term_offsets (uint32[T + 1]) and <field>_terms (utf-8): the sorted terms
+    <field>_max_weights (float32[T]): the largest weight / norm of each term's postings
+
+By default, posting lists are arrays of tf-idf weights copied from the statistics
+tables:
+    <field>_posting_offsets (uint32[T + 1]): where each term's postings start and end
+    <field>_doc_ids (uint32[P]) and <field>_weights (float32[P]): the tf-idf postings
+
+A compressed snapshot instead stores the term frequencies and positions, in the
+block format of `database.postings`, and the values needed to compute the weights as
+a full statistics refresh would (tf * idf / max tf of the document). The norms are
+recomputed from these weights:
+    <field>_postings (bytes): the blocks of every term, one term after the other
+    <field>_term_blocks (uint32[T + 1]): the index of the first block of each term
+    <field>_block_last_doc_ids (uint32[B]) and <field>_block_offsets (uint32[B]): the
+        skip table, the last document id and the offset in <field>_postings of
+        each block
+    <field>_document_frequencies (uint32[T]) and <field>_idfs (float32[T])
+    <field>_max_tfs (uint32[N]): the largest term frequency of each document
+"""
+
+SNAPSHOT_MAGIC = b"SESNAP02"
+SNAPSHOT_PATH = "index.snapshot"
+SNAPSHOT_HEADER = struct.Struct("<8sIQ")
+SECTION_ENTRY = struct.Struct("<32sQQ")
+
+# Stored maxima are rounded up by this factor so that the float32 rounding cannot make
+# them smaller than the weights they bound
+MAX_WEIGHT_ROUNDING = 1 + 1e-6
+
+# Field name -> (tf-idf table, positional index table, norm column)
+SNAPSHOT_FIELDS = {
+    "title": ("title_statistics", "title_positional_index", "title_norm"),
+    "body": ("word_statistics", "positional_index", "body_norm"),
+}
+
+
+def to_little_endian(values):
+    """Byte-swap an array in place on big-endian hosts and return it."""
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_strings(strings):
+    """
+    Encode a list of strings as an offsets array and a concatenated UTF-8 blob.
+
+    Args:
+        strings (list[str]): The strings to encode, in order.
+
+    Returns:
+        tuple[array, bytes]: The uint32 offsets (one more than the number of
+                             strings) and the encoded bytes.
+    """
+    offsets = array("I", [0])
+    blob = bytearray()
+    for string in strings:
+        blob += string.encode("utf-8")
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def build_document_sections():
+    """
+    Build the URL dictionary and the per-document value sections.
+
+    Returns:
+        tuple[dict, dict]: A mapping of database doc_id -> snapshot document id, and
+                           the sections.
+    """
+    documents = sorted(
+        cursor.execute("SELECT doc_id, url FROM documents"),
+        key=lambda document: document[1].encode("utf-8"),
+    )
+    doc_ids = {
+        database_id: doc_id for doc_id, (database_id, _) in enumerate(documents)
+    }
+
+    sections = {}
+    sections["doc_url_offsets"], sections["doc_urls"] = encode_strings(
+        [url for _, url in documents]
+    )
+
+    page_rank = array("f", [math.nan]) * len(documents)
+    for database_id, rank in cursor.execute("SELECT doc_id, rank FROM page_rank"):
+        if database_id in doc_ids:
+            page_rank[doc_ids[database_id]] = rank
+    sections["page_rank"] = page_rank
+
+    for _, _, norm_column in SNAPSHOT_FIELDS.values():
+        norms = array("f", [math.nan]) * len(documents)
+        for database_id, norm in cursor.execute(
+            f"SELECT doc_id, {norm_column} FROM document_norms"
+        ):
+            if database_id in doc_ids:
+                norms[doc_ids[database_id]] = norm
+        sections[norm_column] = norms
+
+    return doc_ids, sections
+
+
+def build_field_sections(field, doc_ids, norms):
+    """Build the term dictionary and posting list sections of one field."""
+    table, _, _ = SNAPSHOT_FIELDS[field]
+
+    postings = {}
+    for term, database_id, tf_idf in cursor.execute(
+        f"SELECT t.term, s.doc_id, s.tf_idf FROM {table} s JOIN terms t USING (term_id)"
+    ):
+        if database_id in doc_ids:
+            postings.setdefault(term, []).append((doc_ids[database_id], tf_idf))
+
+    terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+    posting_offsets = array("I", [0])
+    posting_doc_ids = array("I")
+    posting_weights = array("f")
+    max_weights = array("f")
+    for term in terms:
+        max_weight = 0.0
+        for doc_id, tf_idf in sorted(postings[term]):
+            posting_doc_ids.append(doc_id)
+            posting_weights.append(tf_idf)
+            # Bound the weights as they will be read back, in float32
+            norm = norms[doc_id]
+            if norm > 0:
+                max_weight = max(max_weight, posting_weights[-1] / norm)
+        posting_offsets.append(len(posting_doc_ids))
+        max_weights.append(max_weight * MAX_WEIGHT_ROUNDING)
+
+    term_offsets, term_blob = encode_strings(terms)
+    return {
+        f"{field}_term_offsets": term_offsets,
+        f"{field}_terms": term_blob,
+        f"{field}_posting_offsets": posting_offsets,
+        f"{field}_doc_ids": posting_doc_ids,
+        f"{field}_weights": posting_weights,
+        f"{field}_max_weights": max_weights,
+    }
+
+
+def build_compressed_field_sections(field, doc_ids):
+    """
+    Build the term dictionary, compressed posting list and norm sections of one
+    field, from its positional index.
+    """
+    _, positional_table, norm_column = SNAPSHOT_FIELDS[field]
+    document_count = len(doc_ids)
+
+    postings = {}
+    for term, database_id, positions in cursor.execute(
+        f"""SELECT t.term, p.doc_id, p.positions FROM {positional_table} p
+            JOIN terms t USING (term_id)"""
+    ):
+        if database_id in doc_ids:
+            positions = [int(position) for position in positions.split()]
+            postings.setdefault(term, []).append((doc_ids[database_id], positions))
+
+    terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+    document_frequencies = array("I", (len(postings[term]) for term in terms))
+    idfs = array(
+        "f",
+        (math.log2(document_count / frequency) for frequency in document_frequencies),
+    )
+    max_tfs = array("I", [0]) * document_count
+    for term_postings in postings.values():
+        for doc_id, positions in term_postings:
+            max_tfs[doc_id] = max(max_tfs[doc_id], len(positions))
+
+    # Norms of the weights as they will be computed from the float32 IDFs
+    sum_of_squares = [0.0] * document_count
+    for term, idf in zip(terms, idfs):
+        for doc_id, positions in postings[term]:
+            sum_of_squares[doc_id] += (len(positions) * idf / max_tfs[doc_id]) ** 2
+    norms = array("f", (value**0.5 for value in sum_of_squares))
+
+    blob = bytearray()
+    term_blocks = array("I", [0])
+    block_last_doc_ids = array("I")
+    block_offsets = array("I")
+    max_weights = array("f")
+    for term, idf in zip(terms, idfs):
+        term_postings = sorted(postings[term])
+        last_doc_ids, offsets = encode_postings(term_postings, blob)
+        block_last_doc_ids.extend(last_doc_ids)
+        block_offsets.extend(offsets)
+        term_blocks.append(len(block_offsets))
+
+        max_weight = 0.0
+        for doc_id, positions in term_postings:
+            if norms[doc_id] > 0:
+                weight = len(positions) * idf / max_tfs[doc_id]
+                max_weight = max(max_weight, weight / norms[doc_id])
+        max_weights.append(max_weight * MAX_WEIGHT_ROUNDING)
+
+    term_offsets, term_blob = encode_strings(terms)
+    return {
+        f"{field}_term_offsets": term_offsets,
+        f"{field}_terms": term_blob,
+        f"{field}_postings": bytes(blob),
+        f"{field}_term_blocks": term_blocks,
+        f"{field}_block_last_doc_ids": block_last_doc_ids,
+        f"{field}_block_offsets": block_offsets,
+        f"{field}_document_frequencies": document_frequencies,
+        f"{field}_idfs": idfs,
+        f"{field}_max_tfs": max_tfs,
+        f"{field}_max_weights": max_weights,
+        norm_column: norms,
+    }
+
+
+def write_snapshot(path, sections, generation):
+    """
+    Write the sections to `path` atomically, tagged with the index generation they
+    were exported at.
+
+    The file is written next to the destination and then renamed over it, so servers
+    that still have the previous snapshot mapped keep reading a consistent file.
+    """
+    payloads = []
+    for name, data in sections.items():
+        if isinstance(data, array):
+            data = to_little_endian(data).tobytes()
+        payloads.append((name.encode("ascii"), data))
+
+    header_size = SNAPSHOT_HEADER.size + len(payloads) * SECTION_ENTRY.size
+    offset = header_size + (-header_size % 8)
+    table = []
+    for name, data in payloads:
+        table.append(SECTION_ENTRY.pack(name, offset, len(data)))
+        offset += len(data) + (-len(data) % 8)
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(payloads), generation))
+        file.write(b"".join(table))
+        file.write(b"\0" * (-header_size % 8))
+        for _, data in payloads:
+            file.write(data)
+            file.write(b"\0" * (-len(data) % 8))
+    os.replace(temp_path, path)
+
+
+def export_snapshot(path=SNAPSHOT_PATH, compressed=False):
+    """
+    Export the postings, PageRank scores and document norms into a binary snapshot.
+
+    Args:
+        path (str): Where to write the snapshot.
+        compressed (bool): Store compressed term frequencies and positions instead
+                           of tf-idf arrays, so that phrase queries can be answered
+                           from the snapshot too.
+    """
+    doc_ids, sections = build_document_sections()
+    for field, (_, _, norm_column) in SNAPSHOT_FIELDS.items():
+        if compressed:
+            sections.update(build_compressed_field_sections(field, doc_ids))
+        else:
+            sections.update(build_field_sections(field, doc_ids, sections[norm_column]))
+
+    write_snapshot(path, sections, get_index_generation())
+    print(f"Index snapshot written to {path} ({len(doc_ids)} documents)")
+
+
+if __name__ == "__main__":
+    export_snapshot(compressed="--compressed" in sys.argv[1:])
@@ -0,0 +1,71 @@
+import sqlite3
+from functools import lru_cache
+
+from nltk.stem import PorterStemmer
+
+from database.db import cursor
+
+"""
+Cached Porter stemming shared by the indexer and the query parser.
+
+Word frequencies are Zipfian, so most calls stem one of a few thousand words. The
+stems of recently seen tokens are kept in an in-process LRU cache, and the stems
+table (filled at index time) can be preloaded with `load_stem_table`.
+"""
+
+# Maximum number of tokens kept in the in-process cache
+STEM_CACHE_SIZE = 65536
+
+stemmer = PorterStemmer()
+
+# token -> stem, preloaded from the stems table
+stem_table = {}
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def porter_stem(token):
+    """Stem a token with the Porter Stemmer, caching the most recent results."""
+    return stemmer.stem(token)
+
+
+def stem_word(token):
+    """
+    Stem a single token.
+
+    Args:
+        token (str): The token to stem.
+
+    Returns:
+        str: The stem of the token.
+    """
+    stemmed = stem_table.get(token)
+    if stemmed is None:
+        stemmed = porter_stem(token)
+    return stemmed
+
+
+def load_stem_table():
+    """
+    Preload the stems of the tokens whose stem is in the words or titles table.
+
+    A database that has not been crawled yet (no tables) leaves the table empty,
+    and every token is stemmed by `porter_stem`.
+
+    Returns:
+        int: The number of tokens loaded.
+    """
+    stem_table.clear()
+    try:
+        rows = cursor.execute(
+            """SELECT token, stem FROM stems
+               WHERE stem IN (
+                   SELECT term FROM terms
+                   WHERE term_id IN (
+                       SELECT term_id FROM words UNION SELECT term_id FROM titles
+                   )
+               )"""
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return 0
+    stem_table.update(rows)
+    return len(stem_table)
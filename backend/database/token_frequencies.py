@@ -0,0 +1,38 @@
+from database.db import chunked, cursor
+
+"""
+The token_frequencies table: every token of the tokens table with the total body
+term frequency of the stem spelled like it, precomputed for /suggestions.
+"""
+
+TOKEN_FREQUENCIES_QUERY = """
+    INSERT OR REPLACE INTO token_frequencies (word, ngram_size, frequency)
+    SELECT t.word, t.ngram_size, COALESCE(SUM(i.term_frequency), 0)
+    FROM tokens t
+    LEFT JOIN terms te ON te.term = t.word
+    LEFT JOIN inverted_index i ON i.term_id = te.term_id
+    {where}
+    GROUP BY t.word
+"""
+
+
+def refresh_token_frequencies(words=None):
+    """
+    Recompute the frequency of some tokens, or of every token.
+
+    Args:
+        words (Iterable[str], optional): The tokens that were added, or whose stem
+                                         was added to or removed from a page body.
+                                         Defaults to every token.
+    """
+    if words is None:
+        cursor.execute("DELETE FROM token_frequencies")
+        cursor.execute(TOKEN_FREQUENCIES_QUERY.format(where=""))
+        return
+
+    for chunk in chunked(list(set(words))):
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(
+            TOKEN_FREQUENCIES_QUERY.format(where=f"WHERE t.word IN ({placeholders})"),
+            chunk,
+        )
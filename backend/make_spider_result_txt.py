@@ -6,37 +6,43 @@ def fetch_data():
     query = """
     WITH keyword_data AS (
         SELECT 
-            url, 
-            GROUP_CONCAT(word || ' ' || term_frequency, '; ' ORDER BY term_frequency DESC) AS keywords
+            i.doc_id, 
+            GROUP_CONCAT(t.term || ' ' || i.term_frequency, '; ' ORDER BY i.term_frequency DESC) AS keywords
         FROM 
-            inverted_index
+            inverted_index i
+        JOIN 
+            terms t USING (term_id)
         GROUP BY 
-            url
+            i.doc_id
     ),
     child_link_data AS (
         SELECT 
-            parent_url, 
-            GROUP_CONCAT(child_url, '; ' ORDER BY child_url) AS child_links
+            r.parent_id, 
+            GROUP_CONCAT(d.url, '; ' ORDER BY d.url) AS child_links
         FROM 
-            page_relationships
+            page_relationships r
+        JOIN 
+            documents d ON d.doc_id = r.child_id
         GROUP BY 
-            parent_url
+            r.parent_id
     )
     SELECT 
-        fi.url, 
-        fi.title, 
-        fi.last_modified_date, 
-        fi.size, 
+        d.url, 
+        pi.title, 
+        pi.last_modified_date, 
+        pi.size, 
         kd.keywords,
         cld.child_links
     FROM 
-        forward_index fi
+        page_information pi
+    JOIN 
+        documents d ON d.doc_id = pi.doc_id
     LEFT JOIN 
-        keyword_data kd ON fi.url = kd.url
+        keyword_data kd ON pi.doc_id = kd.doc_id
     LEFT JOIN 
-        child_link_data cld ON fi.url = cld.parent_url
+        child_link_data cld ON pi.doc_id = cld.parent_id
     GROUP BY 
-        fi.url
+        pi.doc_id
     """
     cursor.execute(query)
     return cursor.fetchall()
@@ -4,12 +4,20 @@ from api.app import app
 from api.routes.search import search_bp
 from api.routes.suggestions import suggestions_bp
 from api.routes.get_stemmed_word import get_stemmed_word_bp
+from api.utils.retrieval import load_snapshot
+from database.snapshot import SNAPSHOT_PATH
+from database.stemmer import load_stem_table
 
 
 """
     This script starts the Flask server for the search engine application.
     It imports the necessary modules and registers the blueprints for different routes.
     The server runs in debug mode for development purposes.
+    If crawl_and_save.py exported an index snapshot, it is memory-mapped so that
+    search queries are answered without going through SQLite, and reopened when a
+    newer one replaces it. Until then, an index change makes queries go through
+    SQLite again.
+    The stems of the indexed tokens are preloaded to warm the query stemmer.
     To run the server, execute this script. Ensure that the database and other dependencies
     are properly set up before starting the server.
     Usage:
@@ -20,6 +28,9 @@ app.register_blueprint(search_bp)
 app.register_blueprint(suggestions_bp)
 app.register_blueprint(get_stemmed_word_bp)
 
+load_snapshot(SNAPSHOT_PATH)
+load_stem_table()
+
 
 if __name__ == "__main__":
     with app.app_context():
@@ -1,21 +1,38 @@
-CREATE TABLE IF NOT EXISTS urls (
-  url TEXT PRIMARY KEY
+--- Schema version 2: pages and stems are stored once, in the documents and terms
+--- dictionaries, and every other table refers to them by integer id. Databases
+--- created with the URL/word keyed version 1 are converted by
+--- `database.migrations.migrate_v1_to_v2`.
+
+--- Every known page, crawled or only linked to.
+CREATE TABLE IF NOT EXISTS documents (
+  doc_id INTEGER PRIMARY KEY,
+  url TEXT NOT NULL UNIQUE
+);
+
+--- Every stem found in a body or a title.
+CREATE TABLE IF NOT EXISTS terms (
+  term_id INTEGER PRIMARY KEY,
+  term TEXT NOT NULL UNIQUE
 );
 
+--- Links are listed in the order they were discovered (rowid order).
 CREATE TABLE IF NOT EXISTS page_relationships (
-  parent_url TEXT NOT NULL,
-  child_url TEXT NOT NULL,
-  PRIMARY KEY (parent_url, child_url),
-  FOREIGN KEY (parent_url) REFERENCES urls (url),
-  FOREIGN KEY (child_url) REFERENCES urls (url)
+  parent_id INTEGER NOT NULL,
+  child_id INTEGER NOT NULL,
+  PRIMARY KEY (parent_id, child_id),
+  FOREIGN KEY (parent_id) REFERENCES documents (doc_id),
+  FOREIGN KEY (child_id) REFERENCES documents (doc_id)
 );
 
+--- The stems found in a body (words) or in a title (titles).
 CREATE TABLE IF NOT EXISTS words (
-  word TEXT PRIMARY KEY
+  term_id INTEGER PRIMARY KEY,
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
 );
 
 CREATE TABLE IF NOT EXISTS titles (
-  title TEXT PRIMARY KEY
+  term_id INTEGER PRIMARY KEY,
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
 );
 
 --- This table stores the tokens (words) and their n-gram sizes.
@@ -24,79 +41,180 @@ CREATE TABLE IF NOT EXISTS tokens (
   ngram_size INT
 );
 
+--- This table stores every token with the total frequency, in page bodies, of the
+--- stem spelled like it (0 for n-grams), to rank autosuggestions. It is kept up to
+--- date as pages are added or removed, see `database.token_frequencies`.
+CREATE TABLE IF NOT EXISTS token_frequencies (
+  word TEXT PRIMARY KEY,
+  ngram_size INT NOT NULL,
+  frequency INT NOT NULL
+) WITHOUT ROWID;
+
+--- This table stores the stem of every indexed token, to warm the stemmer cache.
+CREATE TABLE IF NOT EXISTS stems (
+  token TEXT PRIMARY KEY,
+  stem TEXT NOT NULL
+);
+
 CREATE TABLE IF NOT EXISTS page_information (
-  url TEXT PRIMARY KEY,
+  doc_id INTEGER PRIMARY KEY,
   title TEXT NOT NULL,
   last_modified_date TIMESTAMP NOT NULL,
   size INT NOT NULL,
-  FOREIGN KEY (url) REFERENCES urls (url)
+  etag TEXT,
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
 );
 
 CREATE TABLE IF NOT EXISTS forward_index (
-  url TEXT PRIMARY KEY,
+  doc_id INTEGER PRIMARY KEY,
   word TEXT NOT NULL,
-  FOREIGN KEY (url) REFERENCES urls (url)
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
 );
 
 CREATE TABLE IF NOT EXISTS inverted_index (
-  word TEXT NOT NULL,
-  url TEXT NOT NULL,
+  term_id INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
   term_frequency INT NOT NULL,
-  PRIMARY KEY (word, url),
-  FOREIGN KEY (word) REFERENCES tokens (word),
-  FOREIGN KEY (url) REFERENCES urls (url)
-);
+  PRIMARY KEY (term_id, doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS title_forward_index (
-  url TEXT PRIMARY KEY,
+  doc_id INTEGER PRIMARY KEY,
   title TEXT NOT NULL,
-  FOREIGN KEY (url) REFERENCES urls (url)
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
 );
 
 CREATE TABLE IF NOT EXISTS title_inverted_index (
-  title TEXT NOT NULL,
-  url TEXT NOT NULL,
+  term_id INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
   term_frequency INT NOT NULL,
-  PRIMARY KEY (title, url),
-  FOREIGN KEY (title) REFERENCES titles (title),
-  FOREIGN KEY (url) REFERENCES urls (url)
-);
+  PRIMARY KEY (term_id, doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS word_statistics (
-  word TEXT NOT NULL,
-  url TEXT NOT NULL,
+  term_id INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
   tf_idf FLOAT NOT NULL,
-  PRIMARY KEY (word, url),
-  FOREIGN KEY (word) REFERENCES tokens (word),
-  FOREIGN KEY (url) REFERENCES urls (url)
-);
+  PRIMARY KEY (term_id, doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+) WITHOUT ROWID;
 
 CREATE TABLE IF NOT EXISTS title_statistics (
-  title TEXT NOT NULL,
-  url TEXT NOT NULL,
+  term_id INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
   tf_idf FLOAT NOT NULL,
-  PRIMARY KEY (title, url),
-  FOREIGN KEY (title) REFERENCES titles (title),
-  FOREIGN KEY (url) REFERENCES urls (url)
+  PRIMARY KEY (term_id, doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+) WITHOUT ROWID;
+
+--- These tables store the positions (space separated, counted after stop word
+--- removal) at which a stem occurs in the body or title of a page.
+CREATE TABLE IF NOT EXISTS positional_index (
+  term_id INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
+  positions TEXT NOT NULL,
+  PRIMARY KEY (term_id, doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS title_positional_index (
+  term_id INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
+  positions TEXT NOT NULL,
+  PRIMARY KEY (term_id, doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+) WITHOUT ROWID;
+
+--- This table stores the magnitude of the tf-idf vector of each page, so that
+--- cosine similarity can be computed from the postings of the query terms only.
+CREATE TABLE IF NOT EXISTS document_norms (
+  doc_id INTEGER PRIMARY KEY,
+  body_norm FLOAT NOT NULL,
+  title_norm FLOAT NOT NULL,
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+);
+
+--- These tables store the number of pages containing each stem. They are kept up
+--- to date as pages are added, re-indexed or removed, so that statistics can be
+--- recomputed for the changed pages only.
+CREATE TABLE IF NOT EXISTS document_frequency (
+  term_id INTEGER PRIMARY KEY,
+  frequency INT NOT NULL,
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
+);
+
+CREATE TABLE IF NOT EXISTS title_document_frequency (
+  term_id INTEGER PRIMARY KEY,
+  frequency INT NOT NULL,
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
+);
+
+--- These tables store the largest normalized weight (tf-idf / norm) of each stem
+--- over all pages. Ranking uses them as upper bounds to skip pages that cannot
+--- reach the top results. After incremental updates they may only overestimate.
+CREATE TABLE IF NOT EXISTS word_max_weight (
+  term_id INTEGER PRIMARY KEY,
+  max_weight FLOAT NOT NULL,
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
+);
+
+CREATE TABLE IF NOT EXISTS title_max_weight (
+  term_id INTEGER PRIMARY KEY,
+  max_weight FLOAT NOT NULL,
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
+);
+
+--- Key/value bookkeeping about the state of the index.
+CREATE TABLE IF NOT EXISTS index_metadata (
+  key TEXT PRIMARY KEY,
+  value
 );
 
 CREATE TABLE IF NOT EXISTS page_rank (
-  url TEXT PRIMARY KEY,
+  doc_id INTEGER PRIMARY KEY,
   rank FLOAT NOT NULL,
-  FOREIGN KEY (url) REFERENCES urls (url)
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
 );
 
 
+--- This table stores the most frequent stems of each page (body and title
+--- term frequencies added up), shown as keywords with the search results.
+CREATE TABLE IF NOT EXISTS page_top_keywords (
+  doc_id INTEGER NOT NULL,
+  term_id INTEGER NOT NULL,
+  frequency INT NOT NULL,
+  PRIMARY KEY (doc_id, term_id),
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id),
+  FOREIGN KEY (term_id) REFERENCES terms (term_id)
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS page_stemmed_word (
-  url TEXT NOT NULL,
+  doc_id INTEGER PRIMARY KEY,
   stemmed_word TEXT NOT NULL,
-  PRIMARY KEY (url, stemmed_word),
-  FOREIGN KEY (url) REFERENCES urls (url)
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
 );
 
 CREATE TABLE IF NOT EXISTS page_stemmed_title (
-  url TEXT NOT NULL,
+  doc_id INTEGER PRIMARY KEY,
   stemmed_title TEXT NOT NULL,
-  PRIMARY KEY (url, stemmed_title),
-  FOREIGN KEY (url) REFERENCES urls (url)
-);
\ No newline at end of file
+  FOREIGN KEY (doc_id) REFERENCES documents (doc_id)
+);
+
+--- Per-page lookups into the term-keyed tables
+CREATE INDEX IF NOT EXISTS inverted_index_doc_id ON inverted_index (doc_id);
+CREATE INDEX IF NOT EXISTS title_inverted_index_doc_id ON title_inverted_index (doc_id);
+CREATE INDEX IF NOT EXISTS word_statistics_doc_id ON word_statistics (doc_id);
+CREATE INDEX IF NOT EXISTS title_statistics_doc_id ON title_statistics (doc_id);
+CREATE INDEX IF NOT EXISTS positional_index_doc_id ON positional_index (doc_id);
+CREATE INDEX IF NOT EXISTS title_positional_index_doc_id ON title_positional_index (doc_id);
+CREATE INDEX IF NOT EXISTS page_relationships_child_id ON page_relationships (child_id);
+
+PRAGMA user_version = 2;
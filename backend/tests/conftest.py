@@ -0,0 +1,77 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+"""
+Shared setup of the backend tests.
+
+The tests run from the backend directory, like the scripts (which read tables.sql and
+database/stopwords.txt from there), against a scratch database: `database.db` opens
+its connections on import, so SEARCH_ENGINE_DB is set before any test module imports
+it.
+
+Usage:
+    cd backend && python -m pytest tests
+"""
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIR = tempfile.mkdtemp(prefix="search-engine-tests-")
+
+os.chdir(BACKEND_DIR)
+sys.path.insert(0, BACKEND_DIR)
+os.environ["SEARCH_ENGINE_DB"] = os.path.join(SCRATCH_DIR, "documents.db")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+
+def drop_all_tables():
+    """
+    Empty the scratch database.
+
+    Returns:
+        int: The index generation it had, 0 if it had none.
+    """
+    from database.db import connection, cursor
+    from database.metadata import get_index_generation
+
+    connection.rollback()
+    try:
+        generation = get_index_generation()
+    except sqlite3.OperationalError:
+        generation = 0
+
+    tables = cursor.execute(
+        """SELECT name FROM sqlite_master
+           WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"""
+    ).fetchall()
+    for (table,) in tables:
+        cursor.execute(f"DROP TABLE {table}")
+    cursor.execute("PRAGMA user_version = 0")
+    connection.commit()
+    return generation
+
+
+@pytest.fixture
+def empty_database():
+    """
+    An empty database with the schema of tables.sql.
+
+    The index generation keeps growing from one test to the next, so the in-memory
+    indexes of the API (see `database.metadata.get_index_generation`) are rebuilt.
+    """
+    from database.create_tables import create_tables
+    from database.db import connection, cursor
+    from database.metadata import set_metadata
+
+    generation = drop_all_tables()
+    create_tables()
+    set_metadata("index_generation", generation + 1)
+    connection.commit()
+    yield cursor
+    connection.rollback()
@@ -0,0 +1,181 @@
+import multiprocessing
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from crawler.fetch_and_save_pages import fetch_and_save_pages, iter_concurrent_fetch
+from database.dictionary import get_doc_ids
+
+"""
+Crawls a local stub site with `iter_concurrent_fetch`.
+
+Page i of the site links to pages 2i + 1 and 2i + 2, back to the root and to itself,
+so the BFS parent of page j is page (j - 1) // 2. Odd pages are served under
+127.0.0.1 and even pages under localhost, which the crawler sees as two hosts.
+"""
+
+PAGE_COUNT = 40
+
+# How long the stub server takes to answer, so that requests overlap
+RESPONSE_DELAY = 0.05
+
+
+def page_number(url):
+    """Get the number of a page from its URL or path, ".../p<number>.htm"."""
+    return int(url.rsplit("/p", 1)[1][: -len(".htm")])
+
+
+class StubSite:
+    """A stub HTTP server that records the requests it receives."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()  # path -> number of requests
+        self.active = Counter()  # host -> requests being answered
+        self.max_active = Counter()  # host -> most requests answered at once
+        self.max_total_active = 0
+        self.start_times = {}  # host -> start times of its requests
+        self.gone = set()  # pages answered with 410 Gone
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                host = self.headers["Host"].split(":")[0]
+                with site.lock:
+                    site.requests[self.path] += 1
+                    site.active[host] += 1
+                    site.max_active[host] = max(
+                        site.max_active[host], site.active[host]
+                    )
+                    site.max_total_active = max(
+                        site.max_total_active, sum(site.active.values())
+                    )
+                    site.start_times.setdefault(host, []).append(time.monotonic())
+                try:
+                    time.sleep(RESPONSE_DELAY)
+                    if page_number(self.path) in site.gone:
+                        self.send_error(410)
+                        return
+                    body = site.render(page_number(self.path)).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/html")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                finally:
+                    with site.lock:
+                        site.active[host] -= 1
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, page):
+        host = "127.0.0.1" if page % 2 else "localhost"
+        return f"http://{host}:{self.port}/p{page}.htm"
+
+    def render(self, page):
+        anchors = "".join(
+            f'<a href="{self.url(linked)}">link</a>'
+            for linked in (0, page, 2 * page + 1, 2 * page + 2)
+            if linked < PAGE_COUNT
+        )
+        return (
+            f"<html><title>Page {page}</title>"
+            f"<body>page {page} {anchors}</body></html>"
+        )
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_site(empty_database, monkeypatch):
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1,localhost")
+    site = StubSite()
+    yield site
+    site.close()
+
+
+def crawl(site, **options):
+    return list(iter_concurrent_fetch(site.url(0), **options))
+
+
+def test_crawls_every_page_once_with_bfs_parents(stub_site):
+    pages = crawl(stub_site, max_pages=100, max_workers=8, host_delay=0)
+
+    assert sorted(page["url"] for page in pages) == sorted(
+        stub_site.url(page) for page in range(PAGE_COUNT)
+    )
+    assert set(stub_site.requests.values()) == {1}
+    for page in pages:
+        number = page_number(page["url"])
+        expected_parent = None if number == 0 else stub_site.url((number - 1) // 2)
+        assert page["parent_url"] == expected_parent
+
+
+def test_honours_max_pages(stub_site):
+    pages = crawl(stub_site, max_pages=10, max_workers=8, host_delay=0)
+
+    urls = [page["url"] for page in pages]
+    assert len(urls) == 10
+    assert len(set(urls)) == 10
+    assert set(stub_site.requests.values()) == {1}
+
+
+def test_limits_connections_per_host(stub_site):
+    crawl(stub_site, max_workers=8, max_connections_per_host=2, host_delay=0)
+
+    assert max(stub_site.max_active.values()) <= 2
+    # Both hosts are crawled at the same time
+    assert stub_site.max_total_active > 2
+
+
+def test_spaces_requests_to_the_same_host(stub_site):
+    host_delay = 0.1
+    crawl(stub_site, max_pages=8, max_workers=8, host_delay=host_delay)
+
+    for start_times in stub_site.start_times.values():
+        gaps = [b - a for a, b in zip(start_times, start_times[1:])]
+        # The handler starts timing after the request was sent, allow some jitter
+        assert all(gap > host_delay * 0.8 for gap in gaps)
+
+
+def test_parses_pages_in_the_analysis_pool(stub_site):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(2, mp_context=context) as analysis_pool:
+        pages = crawl(
+            stub_site, max_workers=8, host_delay=0, analysis_pool=analysis_pool
+        )
+
+    assert len(pages) == PAGE_COUNT
+    assert set(stub_site.requests.values()) == {1}
+    for page in pages:
+        number = page_number(page["url"])
+        expected_parent = None if number == 0 else stub_site.url((number - 1) // 2)
+        assert page["parent_url"] == expected_parent
+        # The worker parsed the page and returned its links with the analysis
+        assert page["title"] == f"Page {number}"
+        assert stub_site.url(0) in page["child_links"]
+        assert page["body_term_frequency"]
+
+
+def test_removes_pages_that_are_gone(stub_site):
+    urls = [stub_site.url(page) for page in range(PAGE_COUNT)]
+    fetch_and_save_pages(urls[0], max_pages=100, max_workers=8, host_delay=0)
+    assert len(get_doc_ids(urls)) == PAGE_COUNT
+
+    # A leaf page, whose parent still links to it
+    stub_site.gone.add(PAGE_COUNT - 1)
+    fetch_and_save_pages(urls[0], max_pages=100, max_workers=8, host_delay=0)
+    assert get_doc_ids(urls).keys() == set(urls[:-1])
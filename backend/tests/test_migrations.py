@@ -0,0 +1,231 @@
+import math
+import random
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+from api.routes.search import get_tf_score, parse_query
+from api.utils import retrieval
+from api.utils.page_details import get_pages_details
+from conftest import drop_all_tables
+from database.add_pages import add_pages, generate_ngrams, indexer
+from database.create_tables import create_tables
+from database.db import connection, cursor
+from database.metadata import set_metadata
+from database.migrations import get_schema_version, get_table_names, migrate_v1_to_v2
+from database.page_rank import calculate_page_rank
+
+"""
+Migrates a database written with the version 1 (URL/word keyed) schema, kept in
+fixtures/v1_tables.sql, and checks that it answers queries like a database indexed
+with the current schema.
+"""
+
+PAGE_COUNT = 30
+
+VOCABULARY = (
+    "computer science movie hong kong university research student engineering data "
+    "mining search engine index python news sport football games playing"
+).split()
+
+QUERIES = [
+    "computer",
+    "movie science",
+    "playing games",
+    '"hong kong university"',
+    'news "data mining"',
+]
+
+FIELD_WEIGHTS = {"title": 0.7, "body": 0.3}
+
+
+def make_pages():
+    """Pages of random words, every fifth one holding a few fixed phrases."""
+    rng = random.Random(18)
+    urls = [f"http://example.com/p{i}.htm" for i in range(PAGE_COUNT)]
+    pages = []
+    for i, url in enumerate(urls):
+        title = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 5)))
+        body = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, 80)))
+        if i % 5 == 0:
+            body += " hong kong university of science and technology data mining"
+        pages.append(
+            {
+                "url": url,
+                "title": title,
+                "body_text": body,
+                "last_modified": "Tue, 16 May 2023 05:03:16 GMT",
+                "size": len(body),
+                "parent_url": urls[(i - 1) // 2] if i else None,
+                "child_links": [],
+            }
+        )
+    return pages
+
+
+def write_v1_database(pages, page_ranks):
+    """Write the pages into the version 1 tables, like the version 1 crawler did."""
+    with open("tests/fixtures/v1_tables.sql") as file:
+        cursor.executescript(file.read())
+
+    stems = {}
+    for page in pages:
+        url = page["url"]
+        title_stems = indexer.stem(indexer.tokenize(page["title"]))
+        body_stems = indexer.stem(indexer.tokenize(page["body_text"]))
+        stems[url] = (Counter(title_stems), Counter(body_stems))
+        last_modified = datetime.strptime(
+            page["last_modified"], "%a, %d %b %Y %H:%M:%S %Z"
+        )
+
+        cursor.execute("INSERT OR IGNORE INTO urls (url) VALUES (?)", (url,))
+        cursor.execute(
+            """INSERT INTO page_information (url, title, last_modified_date, size)
+               VALUES (?, ?, ?, ?)""",
+            (url, page["title"], last_modified, page["size"]),
+        )
+        cursor.execute(
+            "INSERT INTO forward_index (url, word) VALUES (?, ?)",
+            (url, page["body_text"]),
+        )
+        cursor.execute(
+            "INSERT INTO title_forward_index (url, title) VALUES (?, ?)",
+            (url, page["title"]),
+        )
+        if page["parent_url"]:
+            cursor.execute(
+                """INSERT OR IGNORE INTO page_relationships (parent_url, child_url)
+                   VALUES (?, ?)""",
+                (page["parent_url"], url),
+            )
+        cursor.execute(
+            "INSERT INTO page_stemmed_title (url, stemmed_title) VALUES (?, ?)",
+            (url, " ".join(title_stems)),
+        )
+        cursor.execute(
+            "INSERT INTO page_stemmed_word (url, stemmed_word) VALUES (?, ?)",
+            (url, " ".join(body_stems)),
+        )
+
+        for stem, tf in stems[url][0].items():
+            cursor.execute("INSERT OR IGNORE INTO titles (title) VALUES (?)", (stem,))
+            cursor.execute(
+                """INSERT INTO title_inverted_index (title, url, term_frequency)
+                   VALUES (?, ?, ?)""",
+                (stem, url, tf),
+            )
+        for stem, tf in stems[url][1].items():
+            cursor.execute("INSERT OR IGNORE INTO words (word) VALUES (?)", (stem,))
+            cursor.execute(
+                """INSERT INTO inverted_index (word, url, term_frequency)
+                   VALUES (?, ?, ?)""",
+                (stem, url, tf),
+            )
+
+        tokens = {(stem, 1) for stem in title_stems + body_stems}
+        for n in [2, 3]:
+            for field_stems in (title_stems, body_stems):
+                tokens.update((ngram, n) for ngram in generate_ngrams(field_stems, n))
+        cursor.executemany(
+            "INSERT OR IGNORE INTO tokens (word, ngram_size) VALUES (?, ?)", tokens
+        )
+
+    # The tf-idf of version 1, with the document frequencies of the whole crawl
+    for field, table in ((0, "title_statistics"), (1, "word_statistics")):
+        document_frequency = Counter(
+            stem for title_body in stems.values() for stem in title_body[field]
+        )
+        for url, title_body in stems.items():
+            term_frequency = title_body[field]
+            for stem, tf in term_frequency.items():
+                idf = math.log2(len(pages) / document_frequency[stem])
+                cursor.execute(
+                    f"INSERT INTO {table} VALUES (?, ?, ?)",
+                    (stem, url, tf * idf / max(term_frequency.values())),
+                )
+
+    cursor.executemany("INSERT INTO page_rank (url, rank) VALUES (?, ?)", page_ranks)
+    connection.commit()
+
+
+def rank_all(query):
+    parsed_query = parse_query(query.lower())
+    query_vector = get_tf_score(parsed_query[0])
+    return retrieval.rank(query_vector, parsed_query[1], PAGE_COUNT, FIELD_WEIGHTS)
+
+
+def get_keywords(urls):
+    return [page["keywords"] for page in get_pages_details([(url, 0) for url in urls])]
+
+
+@pytest.fixture
+def v1_database(empty_database):
+    """
+    A version 1 database of the fixture pages, with the rankings and keywords of
+    the same pages indexed with the current schema.
+    """
+    pages = make_pages()
+    add_pages(pages)
+    calculate_page_rank()
+    connection.commit()
+
+    rankings = {query: rank_all(query) for query in QUERIES}
+    keywords = get_keywords(page["url"] for page in pages)
+    page_ranks = cursor.execute(
+        "SELECT url, rank FROM page_rank JOIN documents USING (doc_id)"
+    ).fetchall()
+
+    generation = drop_all_tables()
+    write_v1_database(pages, page_ranks)
+    yield pages, rankings, keywords
+    # Leave a version 2 database, whose in-memory indexes are rebuilt
+    connection.rollback()
+    drop_all_tables()
+    create_tables()
+    set_metadata("index_generation", generation + 1)
+    connection.commit()
+
+
+def test_migrates_a_version_1_database(v1_database):
+    pages, rankings, keywords = v1_database
+    assert get_schema_version() == 1
+
+    create_tables()
+
+    assert get_schema_version() == 2
+    assert "urls" not in get_table_names()
+    for table in (
+        "positional_index",
+        "title_positional_index",
+        "document_frequency",
+        "title_document_frequency",
+        "document_norms",
+        "word_max_weight",
+        "title_max_weight",
+        "page_top_keywords",
+    ):
+        assert cursor.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0], table
+
+    for query, expected in rankings.items():
+        assert expected
+        ranking = rank_all(query)
+        assert dict(ranking).keys() == dict(expected).keys(), query
+        for (url, score), (_, expected_score) in zip(
+            sorted(ranking), sorted(expected)
+        ):
+            assert score == pytest.approx(expected_score, rel=1e-9), query
+    assert get_keywords(page["url"] for page in pages) == keywords
+
+
+def test_refuses_to_migrate_without_the_stemmed_text(v1_database):
+    cursor.execute("DROP TABLE page_stemmed_word")
+    connection.commit()
+
+    with open("tables.sql") as file:
+        schema = file.read()
+    with pytest.raises(RuntimeError, match="page_stemmed_word"):
+        migrate_v1_to_v2(schema)
+
+    assert get_schema_version() == 1
+    assert cursor.execute("SELECT COUNT(*) FROM urls").fetchone()[0] == PAGE_COUNT
@@ -0,0 +1,147 @@
+import random
+
+import pytest
+
+from api.routes.search import get_tf_score, parse_query
+from api.utils import retrieval
+from database.add_pages import add_pages
+from database.db import connection
+from database.page_rank import calculate_page_rank
+from database.snapshot import export_snapshot
+
+"""
+Ranks the same queries from SQLite, from an index snapshot with MaxScore pruning
+(`top_k`) and from a snapshot with `VectorScorer`, and checks that every mode returns
+the same URLs with the same scores.
+"""
+
+PAGE_COUNT = 120
+
+VOCABULARY = (
+    "computer science movie hong kong university research student engineering data "
+    "mining search engine index python java network system theory learning deep "
+    "neural movies played playing plays game games news sport football basketball"
+).split()
+
+QUERIES = [
+    "computer",
+    "movie science",
+    "hong kong university",
+    "playing games games",
+    "zzz",
+    '"hong kong"',
+    '"hong kong university"',
+    'movies "deep neural"',
+    'science "university of science"',
+    '"data mining" "search engine"',
+]
+
+FIELD_WEIGHTS = {"title": 0.7, "body": 0.3}
+
+# The scores of a snapshot are computed from float32 weights and norms
+SCORE_TOLERANCE = 1e-5
+
+
+def make_pages():
+    """Pages of random words, every tenth one holding a few fixed phrases."""
+    rng = random.Random(7)
+    urls = [f"http://example.com/p{i}.htm" for i in range(PAGE_COUNT)]
+    pages = []
+    for i, url in enumerate(urls):
+        title = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 5)))
+        body = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(5, 200)))
+        if i % 10 == 0:
+            body += " hong kong university of science and technology data mining"
+        pages.append(
+            {
+                "url": url,
+                "title": title,
+                "body_text": body,
+                "last_modified": "Tue, 16 May 2023 05:03:16 GMT",
+                "size": len(body),
+                "parent_url": urls[(i - 1) // 2] if i else None,
+                "child_links": [urls[2 * i + 1]] if 2 * i + 1 < PAGE_COUNT else [],
+            }
+        )
+    return pages
+
+
+@pytest.fixture
+def index(empty_database, tmp_path):
+    """The fixture pages, indexed in SQLite and in plain and compressed snapshots."""
+    add_pages(make_pages())
+    calculate_page_rank()
+    connection.commit()
+
+    paths = {}
+    for compressed in (False, True):
+        paths[compressed] = str(tmp_path / f"index-{compressed}.snapshot")
+        export_snapshot(paths[compressed], compressed=compressed)
+    yield paths
+    retrieval.snapshot_path = None
+    retrieval.snapshot = retrieval.vector_scorer = None
+
+
+def rank_all(query, k):
+    parsed_query = parse_query(query.lower())
+    query_vector = get_tf_score(parsed_query[0])
+    return retrieval.rank(query_vector, parsed_query[1], k, FIELD_WEIGHTS)
+
+
+def rank_in_every_mode(paths, query, k):
+    """Rank a query in every mode, keyed by (snapshot compressed, vectorized)."""
+    retrieval.snapshot_path = None
+    retrieval.snapshot = retrieval.vector_scorer = None
+    rankings = {"sqlite": rank_all(query, k)}
+    for compressed, path in paths.items():
+        for vectorized in (False, True):
+            retrieval.load_snapshot(path, vectorized=vectorized)
+            assert retrieval.snapshot is not None
+            assert (retrieval.vector_scorer is not None) == vectorized
+            rankings[compressed, vectorized] = rank_all(query, k)
+    return rankings
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_every_mode_returns_the_same_results(index, query):
+    rankings = rank_in_every_mode(index, query, PAGE_COUNT)
+    expected = dict(rankings.pop("sqlite"))
+    if query != "zzz":
+        assert expected
+
+    for mode, ranking in rankings.items():
+        assert dict(ranking).keys() == expected.keys(), mode
+        for url, score in ranking:
+            assert score == pytest.approx(expected[url], rel=SCORE_TOLERANCE), mode
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_every_mode_selects_the_same_top_k(index, query):
+    k = 5
+    rankings = rank_in_every_mode(index, query, k)
+    expected = rankings.pop("sqlite")
+
+    for mode, ranking in rankings.items():
+        assert len(ranking) == len(expected), mode
+        # Documents tied at the cut-off may differ, their scores may not
+        assert [score for _, score in ranking] == pytest.approx(
+            [score for _, score in expected], rel=SCORE_TOLERANCE
+        ), mode
+
+
+@pytest.mark.parametrize("vectorized", (False, True))
+def test_keeps_its_snapshot_when_another_query_drops_it(index, monkeypatch, vectorized):
+    query = 'science "hong kong university"'
+    retrieval.load_snapshot(index[True], vectorized=vectorized)
+    expected = rank_all(query, PAGE_COUNT)
+
+    # Another thread drops the snapshot while the query is being ranked
+    find_phrase_matches = retrieval.find_phrase_matches
+
+    def find_and_drop(phrase_list, snapshot=None):
+        matches = find_phrase_matches(phrase_list, snapshot)
+        retrieval.snapshot = retrieval.vector_scorer = None
+        return matches
+
+    monkeypatch.setattr(retrieval, "find_phrase_matches", find_and_drop)
+    assert rank_all(query, PAGE_COUNT) == expected